@@ -28,4 +28,54 @@ CREATE TABLE files (
   ),
   INDEX idx_filekind_status (file_kind, processing_status, id),
   INDEX idx_size_checksum (size_bytes, checksum, id)
-);
\ No newline at end of file
+);
+-- Content-addressed photo store (photos/thumbnails stored once per distinct content)
+ALTER TABLE files
+  ADD COLUMN content_hash CHAR(64) NULL AFTER checksum,             -- sha256 of stored bytes (content_blobs key)
+  ADD INDEX ix_files_content_hash (content_hash);
+
+CREATE TABLE content_blobs (
+  sha256 CHAR(64) NOT NULL PRIMARY KEY,                             -- sha256 of stored bytes
+  storage_path VARCHAR(768) NOT NULL,                               -- /srv/uploads/store/ab/cd/<sha256>.webp
+  thumbnail_path VARCHAR(768) NULL,                                 -- /srv/uploads/store/ab/cd/<sha256>_thumb.webp
+  size_bytes BIGINT UNSIGNED NOT NULL,
+  ref_count INT UNSIGNED NOT NULL DEFAULT 0,                        -- number of files rows using this blob
+  released_at TIMESTAMP NULL,                                       -- when ref_count last dropped to 0 (GC candidate)
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  INDEX idx_blobs_gc (ref_count, released_at)
+);
+
+-- Responsive photo sizes stored next to each blob (<sha256>_w<width>.webp)
+ALTER TABLE content_blobs
+  ADD COLUMN derivative_widths VARCHAR(64) NULL AFTER thumbnail_path;  -- e.g. '150,320,640,1280'
+
+-- Path lookups for storage reconciliation (python -m app.utils.storage_reconcile)
+ALTER TABLE files
+  ADD INDEX idx_storage_path (storage_path(191)),
+  ADD INDEX idx_thumbnail_path (thumbnail_path(191));
+
+-- Aggregate statistics per kind/status (maintained by the application on every files change)
+CREATE TABLE file_stats (
+  file_kind ENUM('image','pdf') NOT NULL,
+  processing_status ENUM('pending','quarantined','scanning','ready','rejected') NOT NULL,
+  file_count BIGINT NOT NULL DEFAULT 0,
+  total_bytes BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (file_kind, processing_status)
+);
+
+-- Initial fill (or POST /files/admin/statistics/rebuild)
+INSERT INTO file_stats (file_kind, processing_status, file_count, total_bytes)
+SELECT file_kind, processing_status, COUNT(*), COALESCE(SUM(size_bytes), 0)
+FROM files
+GROUP BY file_kind, processing_status;
+
+-- Perceptual hash of photos (near-duplicate detection, in-memory BK-tree index)
+ALTER TABLE files
+  ADD COLUMN perceptual_hash CHAR(16) NULL AFTER height;            -- 64-bit dHash hex
+
+-- Why the upload worker rejected a file (GET /files/{id}/status, any process)
+ALTER TABLE files
+  ADD COLUMN rejection_code VARCHAR(32) NULL AFTER processing_status,   -- e.g. 'VIRUS_FOUND', 'NO_FREE_SLOT'
+  ADD COLUMN rejection_message VARCHAR(512) NULL AFTER rejection_code;
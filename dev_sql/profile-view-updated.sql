@@ -85,7 +85,7 @@ SELECT DISTINCT
   md.start_date,
   md.end_date,
   
-  -- Calculate age from birth_date
+  -- Calculate age from birth_date (display only; filter on birth_date ranges instead)
   YEAR(CURDATE()) - YEAR(p.birth_date) - (DATE_FORMAT(p.birth_date, '%m%d') > DATE_FORMAT(CURDATE(), '%m%d')) AS age
   
 FROM Users u
@@ -133,8 +133,11 @@ SELECT
   
   -- Calculate match score (0-8)
   MAX(
+    -- Age range compared on birth_date bounds (age >= n <=> born on or before
+    -- today minus n years) so idx_vw_profiles_birth_date can be used
     CASE 
-      WHEN mp.age BETWEEN cp.age_from AND cp.age_to THEN 1 ELSE 0 
+      WHEN mp.birth_date <= DATE_SUB(CURDATE(), INTERVAL cp.age_from YEAR)
+        AND mp.birth_date > DATE_SUB(CURDATE(), INTERVAL cp.age_to + 1 YEAR) THEN 1 ELSE 0 
     END +
     CASE 
       WHEN mp.height_cm BETWEEN cp.height_from AND cp.height_to THEN 1 ELSE 0 
@@ -1,11 +1,15 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from ..models.file import File, FileKindEnum, ProcessingStatusEnum
+from sqlalchemy import func, and_, or_, text
+from ..models.file import File, FileKindEnum, ProcessingStatusEnum, ContentBlob, FileStats
 from ..schemas.file import FileCreate, FileUpdate
 from fastapi import HTTPException
+from collections import OrderedDict, namedtuple
+import os
+import threading
+import time
 import uuid
 import hashlib
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 def generate_file_id() -> str:
     """Generate UUID v4 for file ID"""
@@ -46,6 +50,118 @@ def get_files_by_ids(db: Session, file_ids: List[str]):
     """
     return db.query(File).filter(File.id.in_(file_ids)).all()
 
+# ==================== METADATA CACHE ====================
+
+# Serving routes only need a few immutable columns of ready files; keep them
+# in a bounded LRU so thumbnail/document hits skip the DB round trip.
+# Entries expire after FILE_META_CACHE_TTL seconds so deletes made by other
+# worker processes are picked up.
+FILE_META_CACHE_SIZE = int(os.getenv("FILE_META_CACHE_SIZE", "10000"))
+FILE_META_CACHE_TTL = int(os.getenv("FILE_META_CACHE_TTL", "300"))
+
+FileMeta = namedtuple("FileMeta", [
+    "id", "file_kind", "storage_path", "thumbnail_path", "mime_type",
+    "checksum", "content_hash", "processing_status", "width", "derivative_widths"
+])
+
+_file_meta_cache = OrderedDict()  # file_id -> (expires_at, FileMeta)
+_file_meta_lock = threading.Lock()
+_file_meta_stats = {"hits": 0, "misses": 0}
+
+
+def _to_file_meta(db_file: File, derivative_widths: str = None) -> FileMeta:
+    return FileMeta(
+        id=db_file.id,
+        file_kind=db_file.file_kind,
+        storage_path=db_file.storage_path,
+        thumbnail_path=db_file.thumbnail_path,
+        mime_type=db_file.mime_type,
+        checksum=db_file.checksum,
+        content_hash=db_file.content_hash,
+        processing_status=db_file.processing_status,
+        width=db_file.width,
+        derivative_widths=tuple(int(w) for w in derivative_widths.split(",") if w) if derivative_widths else ()
+    )
+
+
+def _cache_get(file_id: str) -> Optional[FileMeta]:
+    with _file_meta_lock:
+        entry = _file_meta_cache.get(file_id)
+        if entry is None or entry[0] < time.monotonic():
+            _file_meta_stats["misses"] += 1
+            return None
+        _file_meta_cache.move_to_end(file_id)
+        _file_meta_stats["hits"] += 1
+        return entry[1]
+
+
+def _cache_put(meta: FileMeta) -> None:
+    # Only ready files: their paths and checksum no longer change
+    if meta.processing_status != ProcessingStatusEnum.ready:
+        return
+    with _file_meta_lock:
+        _file_meta_cache[meta.id] = (time.monotonic() + FILE_META_CACHE_TTL, meta)
+        _file_meta_cache.move_to_end(meta.id)
+        while len(_file_meta_cache) > FILE_META_CACHE_SIZE:
+            _file_meta_cache.popitem(last=False)
+
+
+def invalidate_file_meta(file_id: str) -> None:
+    """Drop a file from the metadata cache (call on delete and status change)"""
+    with _file_meta_lock:
+        _file_meta_cache.pop(file_id, None)
+
+
+def get_file_metas(db: Session, file_ids: List[str]) -> Dict[str, FileMeta]:
+    """
+    Get serving metadata for files, from cache or with one IN (...) query
+    
+    Purpose: Thumbnail/document routes without a DB round trip per hit
+    
+    Returns: {file_id: FileMeta} for files that exist
+    """
+    metas = {}
+    missing = []
+    for file_id in file_ids:
+        meta = _cache_get(file_id)
+        if meta:
+            metas[file_id] = meta
+        else:
+            missing.append(file_id)
+    
+    if missing:
+        rows = (
+            db.query(File, ContentBlob.derivative_widths)
+            .outerjoin(ContentBlob, ContentBlob.sha256 == File.content_hash)
+            .filter(File.id.in_(missing))
+            .all()
+        )
+        for db_file, derivative_widths in rows:
+            meta = _to_file_meta(db_file, derivative_widths)
+            _cache_put(meta)
+            metas[db_file.id] = meta
+    return metas
+
+
+def get_file_meta(db: Session, file_id: str) -> Optional[FileMeta]:
+    """
+    Get serving metadata for one file (cached for ready files)
+    
+    Returns: FileMeta or None if the file does not exist
+    """
+    return get_file_metas(db, [file_id]).get(file_id)
+
+
+def get_file_meta_cache_stats() -> dict:
+    """Metadata cache size and hit counters (this worker process)"""
+    with _file_meta_lock:
+        return {
+            "entries": len(_file_meta_cache),
+            "max_entries": FILE_META_CACHE_SIZE,
+            "ttl_seconds": FILE_META_CACHE_TTL,
+            **_file_meta_stats
+        }
+
 def update_file(db: Session, file_id: str, file_data: FileUpdate):
     """
     Update file metadata
@@ -69,6 +185,7 @@ def update_file(db: Session, file_id: str, file_data: FileUpdate):
     
     db.commit()
     db.refresh(db_file)
+    invalidate_file_meta(file_id)
     return db_file
 
 def delete_file(db: Session, file_id: str):
@@ -86,6 +203,7 @@ def delete_file(db: Session, file_id: str):
     
     db.delete(db_file)
     db.commit()
+    invalidate_file_meta(file_id)
     return db_file
 
 # ==================== FILTERING & SEARCH ====================
@@ -243,6 +361,30 @@ def find_duplicates_by_size_and_name(db: Session, size_bytes: int, original_name
 
 # ==================== STATISTICS & ADMIN ====================
 
+def _statistics_from_rows(rows) -> dict:
+    """Build the statistics dict from (file_kind, processing_status, count, bytes) rows"""
+    files_by_kind = {kind.value: 0 for kind in FileKindEnum}
+    files_by_status = {status.value: 0 for status in ProcessingStatusEnum}
+    total_files = 0
+    total_size = 0
+    for kind, status, count, size in rows:
+        kind, status = getattr(kind, "value", kind), getattr(status, "value", status)
+        files_by_kind[kind] = files_by_kind.get(kind, 0) + (count or 0)
+        files_by_status[status] = files_by_status.get(status, 0) + (count or 0)
+        total_files += count or 0
+        total_size += int(size or 0)
+    
+    return {
+        "total_files": total_files,
+        "total_size_bytes": total_size,
+        "total_size_mb": round(total_size / (1024 * 1024), 2),
+        "files_by_kind": files_by_kind,
+        "files_by_status": files_by_status,
+        "pending_files": files_by_status.get("pending", 0),
+        "rejected_files": files_by_status.get("rejected", 0)
+    }
+
+
 def get_file_statistics(db: Session):
     """
     Get file system statistics
@@ -254,30 +396,79 @@ def get_file_statistics(db: Session):
     - Total storage used
     - Files by kind (image/pdf)
     - Files by status (pending/ready/rejected)
+    
+    Reads the file_stats aggregate (one row per kind/status, maintained on
+    every files change), so the cost does not grow with the files table.
+    """
+    rows = db.query(
+        FileStats.file_kind, FileStats.processing_status, FileStats.file_count, FileStats.total_bytes
+    ).all()
+    if not rows:
+        # Fresh database: build the aggregate once
+        rebuild_file_stats(db)
+        rows = db.query(
+            FileStats.file_kind, FileStats.processing_status, FileStats.file_count, FileStats.total_bytes
+        ).all()
+    return _statistics_from_rows(rows)
+
+
+def rebuild_file_stats(db: Session, apply: bool = True) -> dict:
     """
-    total_files = db.query(func.count(File.id)).scalar()
-    total_size = db.query(func.sum(File.size_bytes)).scalar() or 0
+    Recompute file_stats from files in one pass and report drift
     
-    # Files by kind
-    files_by_kind = {}
-    for kind in FileKindEnum:
-        count = db.query(func.count(File.id)).filter(File.file_kind == kind.value).scalar()
-        files_by_kind[kind.value] = count
+    Purpose: Verification / repair of the maintained aggregate
     
-    # Files by status
-    files_by_status = {}
-    for status in ProcessingStatusEnum:
-        count = db.query(func.count(File.id)).filter(File.processing_status == status.value).scalar()
-        files_by_status[status.value] = count
+    Uses a single GROUP BY file_kind, processing_status WITH ROLLUP on MySQL
+    (plain GROUP BY elsewhere). The file_stats rows are locked first, so
+    concurrent uploads wait instead of updating a table being replaced.
+    
+    Returns:
+    - drift: {"kind/status": {"stored": [count, bytes], "actual": [count, bytes]}} for mismatches
+    - total_files / total_size_bytes: Grand total (ROLLUP row)
+    - applied: Whether file_stats was replaced
+    """
+    stored = {
+        (getattr(row.file_kind, "value", row.file_kind), getattr(row.processing_status, "value", row.processing_status)):
+            (row.file_count, int(row.total_bytes or 0))
+        for row in db.query(FileStats).with_for_update().all()
+    }
+    
+    if db.bind.dialect.name == "mysql":
+        result = db.execute(text(
+            "SELECT file_kind, processing_status, COUNT(*), COALESCE(SUM(size_bytes), 0) "
+            "FROM files GROUP BY file_kind, processing_status WITH ROLLUP"
+        )).all()
+        actual = {(kind, status): (count, int(size)) for kind, status, count, size in result if kind and status}
+        grand_total = next(((count, int(size)) for kind, status, count, size in result if kind is None), (0, 0))
+    else:
+        result = db.query(
+            File.file_kind, File.processing_status, func.count(File.id), func.coalesce(func.sum(File.size_bytes), 0)
+        ).group_by(File.file_kind, File.processing_status).all()
+        actual = {
+            (getattr(kind, "value", kind), getattr(status, "value", status)): (count, int(size))
+            for kind, status, count, size in result
+        }
+        grand_total = (sum(count for count, _ in actual.values()), sum(size for _, size in actual.values()))
+    
+    drift = {
+        f"{kind}/{status}": {"stored": list(stored.get((kind, status), (0, 0))), "actual": list(actual.get((kind, status), (0, 0)))}
+        for kind, status in set(stored) | set(actual)
+        if stored.get((kind, status), (0, 0)) != actual.get((kind, status), (0, 0))
+    }
+    
+    if apply:
+        db.query(FileStats).delete(synchronize_session=False)
+        for (kind, status), (count, size) in actual.items():
+            db.add(FileStats(file_kind=kind, processing_status=status, file_count=count, total_bytes=size))
+        db.commit()
+    else:
+        db.rollback()
     
     return {
-        "total_files": total_files,
-        "total_size_bytes": total_size,
-        "total_size_mb": round(total_size / (1024 * 1024), 2),
-        "files_by_kind": files_by_kind,
-        "files_by_status": files_by_status,
-        "pending_files": files_by_status.get("pending", 0),
-        "rejected_files": files_by_status.get("rejected", 0)
+        "drift": drift,
+        "total_files": grand_total[0],
+        "total_size_bytes": grand_total[1],
+        "applied": apply
     }
 
 def get_large_files(db: Session, min_size_mb: int = 10, skip: int = 0, limit: int = 100):
@@ -326,12 +517,15 @@ def get_orphaned_thumbnails(db: Session):
     
     Purpose: Cleanup orphaned references
     
-    Note: Requires filesystem check (not just DB query)
+    Note: Requires filesystem check (not just DB query); rows are streamed
+    in batches, iterate instead of materializing. For a full check in both
+    directions use python -m app.utils.storage_reconcile
     """
     return (
         db.query(File)
         .filter(File.thumbnail_path.isnot(None))
-        .all()
+        .execution_options(stream_results=True)
+        .yield_per(1000)
     )
 
 # ==================== PROCESSING WORKFLOW ====================
@@ -0,0 +1,537 @@
+# app/crud/file_async.py
+"""
+AsyncSession CRUD for the async file routes (uploads, deletes, serving) and
+the background upload worker (app/utils/upload_processor.py)
+- Same behaviour and return values as the sync functions of the same name
+  in app/crud/file_upload.py and the metadata lookups in app/crud/file.py
+- Queries await on the event loop (aiomysql) instead of blocking it
+- Shares the metadata cache with app/crud/file.py; file_stats is still
+  maintained by the before_flush listener (AsyncSession flushes through a
+  regular Session underneath)
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.file import FileMeta, _cache_get, _cache_put, _to_file_meta, invalidate_file_meta
+from app.models.astrology import AstrologyDetails
+from app.models.family import FamilyDetails
+from app.models.file import ContentBlob, File, FileKindEnum, ProcessingStatusEnum
+from app.models.profile import Profile
+
+
+# ==================== FILE RECORD MANAGEMENT ====================
+
+async def create_file_record(
+    db: AsyncSession,
+    file_id: str,
+    original_name: str,
+    mime_type: str,
+    size_bytes: int,
+    checksum: str,
+    storage_path: str,
+    thumbnail_path: Optional[str] = None,
+    processing_status: str = ProcessingStatusEnum.ready,
+    width: Optional[int] = None,
+    height: Optional[int] = None
+) -> File:
+    """
+    Create a new file record in database
+
+    Args:
+        db: Async database session
+        file_id: Unique file identifier
+        original_name: Original filename
+        mime_type: MIME type
+        size_bytes: File size in bytes
+        checksum: SHA256 checksum
+        storage_path: Path to stored file
+        thumbnail_path: Path to thumbnail (if image)
+        processing_status: Processing status enum
+        width: Image width (if image)
+        height: Image height (if image)
+
+    Returns:
+        Created File object
+    """
+    db_file = File(
+        id=file_id,
+        original_name=original_name,
+        file_kind=FileKindEnum.image if mime_type.startswith('image/') else FileKindEnum.pdf,
+        mime_type=mime_type,
+        size_bytes=size_bytes,
+        checksum=checksum,
+        storage_path=storage_path,
+        thumbnail_path=thumbnail_path,
+        processing_status=processing_status,
+        width=width,
+        height=height,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+    db.add(db_file)
+    await db.commit()
+    await db.refresh(db_file)
+    return db_file
+
+
+async def get_file_by_id(db: AsyncSession, file_id: str) -> Optional[File]:
+    """
+    Get file by ID
+
+    Returns:
+        File object or None
+    """
+    return await db.scalar(select(File).where(File.id == file_id))
+
+
+async def update_file_record(db: AsyncSession, file_id: str, **kwargs) -> Optional[File]:
+    """
+    Update file record
+
+    Args:
+        db: Async database session
+        file_id: File ID
+        **kwargs: Fields to update
+
+    Returns:
+        Updated File object, or None if not found
+    """
+    db_file = await get_file_by_id(db, file_id)
+    if not db_file:
+        return None
+
+    for key, value in kwargs.items():
+        if hasattr(db_file, key):
+            setattr(db_file, key, value)
+
+    db_file.updated_at = datetime.utcnow()
+    await db.commit()
+    await db.refresh(db_file)
+    invalidate_file_meta(file_id)
+    return db_file
+
+
+async def delete_file_record(db: AsyncSession, file_id: str) -> bool:
+    """
+    Delete file record from database
+
+    Returns:
+        True if successful, False if not found
+    """
+    db_file = await get_file_by_id(db, file_id)
+    if not db_file:
+        return False
+
+    await db.delete(db_file)
+    await db.commit()
+    invalidate_file_meta(file_id)
+    return True
+
+
+async def get_profile_file_ids(db: AsyncSession, profile_id: int) -> List[str]:
+    """
+    Get IDs of all files assigned to a profile (photo slots, community certificate, horoscope)
+
+    Returns:
+        List of file IDs
+    """
+    file_ids = []
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.profile_id == profile_id))
+    if family:
+        file_ids.extend([family.photo_file_id_1, family.photo_file_id_2, family.community_file_id])
+    file_ids.append(await get_astrology_file_id(db, profile_id))
+    return [file_id for file_id in file_ids if file_id]
+
+
+async def find_duplicate_by_checksum(db: AsyncSession, checksum: str, profile_id: int) -> Optional[File]:
+    """
+    Find a ready file with the same checksum already assigned to this profile
+
+    Returns:
+        Existing File object if duplicate found, None otherwise
+    """
+    print(f"[find_duplicate_by_checksum] Checking for duplicate with checksum: {checksum}")
+    file_ids = await get_profile_file_ids(db, profile_id)
+    if not file_ids:
+        return None
+    return await db.scalar(
+        select(File).where(
+            and_(
+                File.id.in_(file_ids),
+                File.checksum == checksum,
+                File.processing_status == ProcessingStatusEnum.ready
+            )
+        ).limit(1)
+    )
+
+
+# ==================== BACKGROUND PROCESSING ====================
+
+async def claim_file_for_processing(db: AsyncSession, file_id: str) -> bool:
+    """
+    Atomically move a file from 'pending' to 'scanning' (one worker in any process wins)
+
+    Returns:
+        True if this caller claimed the file, False otherwise
+    """
+    # Row lock: a concurrent claimer waits, then sees 'scanning' and gives up
+    db_file = await db.scalar(
+        select(File).where(
+            and_(File.id == file_id, File.processing_status == ProcessingStatusEnum.pending)
+        ).with_for_update()
+    )
+    if not db_file:
+        await db.rollback()
+        return False
+
+    db_file.processing_status = ProcessingStatusEnum.scanning
+    db_file.updated_at = datetime.utcnow()
+    await db.commit()
+    return True
+
+
+async def get_unfinished_uploads(db: AsyncSession, stale_after_minutes: int = 15) -> List[File]:
+    """
+    Get uploads that still need background processing
+
+    Files stuck in 'scanning' longer than stale_after_minutes (worker died
+    mid-job) are reset to 'pending' first so they can be claimed again.
+
+    Returns:
+        List of pending File objects
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=stale_after_minutes)
+    # ORM updates (not a bulk UPDATE) so file_stats follows the status change
+    stale_files = await db.scalars(
+        select(File).where(
+            and_(File.processing_status == ProcessingStatusEnum.scanning, File.updated_at < cutoff)
+        ).with_for_update()
+    )
+    for db_file in stale_files:
+        db_file.processing_status = ProcessingStatusEnum.pending
+    await db.commit()
+
+    return list(await db.scalars(select(File).where(File.processing_status == ProcessingStatusEnum.pending)))
+
+
+# ==================== CONTENT BLOBS ====================
+
+async def get_content_blob(db: AsyncSession, sha256: str) -> Optional[ContentBlob]:
+    """
+    Get content blob by SHA256 of its stored bytes (fresh from the database)
+
+    Returns:
+        ContentBlob object or None
+    """
+    return await db.scalar(
+        select(ContentBlob).where(ContentBlob.sha256 == sha256).execution_options(populate_existing=True)
+    )
+
+
+async def get_perceptual_hash_for_content(db: AsyncSession, content_hash: str) -> Optional[str]:
+    """
+    Get the perceptual hash already computed for a stored WebP
+
+    Returns:
+        dHash hex string or None
+    """
+    return await db.scalar(
+        select(File.perceptual_hash).where(
+            and_(File.content_hash == content_hash, File.perceptual_hash.isnot(None), File.perceptual_hash != "")
+        ).limit(1)
+    )
+
+
+async def find_blob_by_source_checksum(db: AsyncSession, checksum: str) -> Optional[ContentBlob]:
+    """
+    Find the stored blob produced from an identical upload (any profile)
+
+    Returns:
+        Referenced ContentBlob object or None
+    """
+    return await db.scalar(
+        select(ContentBlob)
+        .join(File, File.content_hash == ContentBlob.sha256)
+        .where(
+            and_(
+                File.checksum == checksum,
+                File.processing_status == ProcessingStatusEnum.ready,
+                ContentBlob.ref_count > 0
+            )
+        ).limit(1)
+    )
+
+
+async def acquire_content_blob(
+    db: AsyncSession,
+    sha256: str,
+    storage_path: str,
+    size_bytes: int,
+    thumbnail_path: Optional[str] = None,
+    derivative_widths: Optional[str] = None
+) -> ContentBlob:
+    """
+    Add a reference to a content blob, creating the blob row if needed
+
+    Call before writing the blob to storage: the row stops garbage
+    collection from deleting the files underneath the new reference.
+
+    Returns:
+        ContentBlob object
+    """
+    for _ in range(2):
+        result = await db.execute(
+            update(ContentBlob)
+            .where(ContentBlob.sha256 == sha256)
+            .values(ref_count=ContentBlob.ref_count + 1, released_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            await db.commit()
+            return await get_content_blob(db, sha256)
+
+        db.add(ContentBlob(
+            sha256=sha256,
+            storage_path=storage_path,
+            thumbnail_path=thumbnail_path,
+            derivative_widths=derivative_widths,
+            size_bytes=size_bytes,
+            ref_count=1
+        ))
+        try:
+            await db.commit()
+            return await get_content_blob(db, sha256)
+        except IntegrityError:
+            # Another worker inserted the same blob first, add a reference instead
+            await db.rollback()
+    raise RuntimeError(f"Failed to acquire content blob {sha256}")
+
+
+async def release_content_blob(db: AsyncSession, sha256: str) -> Optional[int]:
+    """
+    Drop one reference to a content blob (files are garbage collected later)
+
+    Returns:
+        Remaining reference count, or None if the blob does not exist
+    """
+    blob = await db.scalar(select(ContentBlob).where(ContentBlob.sha256 == sha256).with_for_update())
+    if not blob:
+        await db.rollback()
+        return None
+
+    blob.ref_count = max(blob.ref_count - 1, 0)
+    if blob.ref_count == 0:
+        blob.released_at = datetime.utcnow()
+    await db.commit()
+    return blob.ref_count
+
+
+# ==================== SLOT LOOKUP / UNASSIGNMENT ====================
+
+async def get_profile_with_family(db: AsyncSession, profile_id: int) -> Optional[Tuple[Profile, FamilyDetails]]:
+    """
+    Get profile and family details
+
+    Returns:
+        Tuple[Profile, FamilyDetails] or None
+    """
+    profile = await db.scalar(select(Profile).where(Profile.id == profile_id))
+    if not profile:
+        return None
+
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.profile_id == profile_id))
+    return profile, family
+
+
+async def find_available_photo_slot(db: AsyncSession, profile_id: int) -> Tuple[int, Optional[str]]:
+    """
+    Find available photo slot in family_details
+
+    Returns:
+        Tuple[slot_number, error_code]
+        - (1, None) if slot 1 available
+        - (2, None) if slot 1 taken, slot 2 available
+        - (None, "NO_FREE_SLOT") if both slots taken
+    """
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.profile_id == profile_id))
+
+    if not family or family.photo_file_id_1 is None:
+        return 1, None
+    if family.photo_file_id_2 is None:
+        return 2, None
+    return None, "NO_FREE_SLOT"
+
+
+async def assign_photo_to_slot(db: AsyncSession, profile_id: int, file_id: str, slot_number: int) -> bool:
+    """
+    Assign file to photo slot (1 or 2) in family_details
+
+    Returns:
+        True if successful, False if error
+    """
+    if slot_number not in (1, 2):
+        return False
+
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.profile_id == profile_id))
+    if not family:
+        # Create family record if doesn't exist
+        family = FamilyDetails(profile_id=profile_id)
+        db.add(family)
+
+    if slot_number == 1:
+        family.photo_file_id_1 = file_id
+    else:
+        family.photo_file_id_2 = file_id
+    await db.commit()
+    return True
+
+
+async def unassign_photo_from_slot(db: AsyncSession, file_id: str) -> bool:
+    """
+    Unassign photo from family_details slot
+
+    Returns:
+        True if successful, False if not assigned
+    """
+    family = await db.scalar(
+        select(FamilyDetails).where(
+            or_(FamilyDetails.photo_file_id_1 == file_id, FamilyDetails.photo_file_id_2 == file_id)
+        )
+    )
+    if not family:
+        return False
+
+    if family.photo_file_id_1 == file_id:
+        family.photo_file_id_1 = None
+    elif family.photo_file_id_2 == file_id:
+        family.photo_file_id_2 = None
+    await db.commit()
+    return True
+
+
+async def assign_community_cert_to_family(db: AsyncSession, profile_id: int, file_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Assign community certificate file to family_details
+
+    Returns:
+        Tuple[success, error_message]
+    """
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.profile_id == profile_id))
+    if not family:
+        # Create family record if doesn't exist
+        family = FamilyDetails(profile_id=profile_id)
+        db.add(family)
+    elif family.community_file_id is not None:
+        return False, "Community certificate already uploaded for this profile"
+
+    family.community_file_id = file_id
+    await db.commit()
+    return True, None
+
+
+async def unassign_community_cert_from_family(db: AsyncSession, file_id: str) -> bool:
+    """
+    Unassign community certificate from family_details
+
+    Returns:
+        True if successful, False if not found
+    """
+    family = await db.scalar(select(FamilyDetails).where(FamilyDetails.community_file_id == file_id))
+    if not family:
+        return False
+
+    family.community_file_id = None
+    await db.commit()
+    return True
+
+
+async def get_astrology_file_id(db: AsyncSession, profile_id: int) -> Optional[str]:
+    """
+    Get horoscope file ID assigned to a profile
+
+    Returns:
+        File ID or None if no horoscope is assigned
+    """
+    return await db.scalar(select(AstrologyDetails.file_id).where(AstrologyDetails.profile_id == profile_id))
+
+
+async def assign_horoscope_to_astrology(db: AsyncSession, profile_id: int, file_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Assign horoscope file to astrology_details
+
+    Returns:
+        Tuple[success, error_message]
+    """
+    astrology = await db.scalar(select(AstrologyDetails).where(AstrologyDetails.profile_id == profile_id))
+    if not astrology:
+        # Create astrology record if doesn't exist
+        astrology = AstrologyDetails(profile_id=profile_id)
+        db.add(astrology)
+    elif astrology.file_id is not None:
+        return False, "Horoscope file already uploaded for this profile"
+
+    astrology.file_id = file_id
+    await db.commit()
+    return True, None
+
+
+async def unassign_horoscope_from_astrology(db: AsyncSession, file_id: str) -> bool:
+    """
+    Unassign horoscope file from astrology_details
+
+    Returns:
+        True if successful, False if not found
+    """
+    astrology = await db.scalar(select(AstrologyDetails).where(AstrologyDetails.file_id == file_id))
+    if not astrology:
+        return False
+
+    astrology.file_id = None
+    await db.commit()
+    return True
+
+
+# ==================== SERVING METADATA ====================
+
+async def get_file_metas(db: AsyncSession, file_ids: List[str]) -> Dict[str, FileMeta]:
+    """
+    Get serving metadata for files, from cache or with one IN (...) query
+
+    Returns:
+        {file_id: FileMeta} for files that exist
+    """
+    metas = {}
+    missing = []
+    for file_id in file_ids:
+        meta = _cache_get(file_id)
+        if meta:
+            metas[file_id] = meta
+        else:
+            missing.append(file_id)
+
+    if missing:
+        rows = await db.execute(
+            select(File, ContentBlob.derivative_widths)
+            .outerjoin(ContentBlob, ContentBlob.sha256 == File.content_hash)
+            .where(File.id.in_(missing))
+        )
+        for db_file, derivative_widths in rows:
+            meta = _to_file_meta(db_file, derivative_widths)
+            _cache_put(meta)
+            metas[db_file.id] = meta
+    return metas
+
+
+async def get_file_meta(db: AsyncSession, file_id: str) -> Optional[FileMeta]:
+    """
+    Get serving metadata for one file (cached for ready files)
+
+    Returns:
+        FileMeta or None if the file does not exist
+    """
+    return (await get_file_metas(db, [file_id])).get(file_id)
@@ -2,21 +2,26 @@
 """
 CRUD operations for file uploads with profile photo integration
 - Create file records
-- Find duplicate files
+- Find duplicate files (scoped to the uploading profile)
+- Reference-counted content blobs (content-addressed photo store)
 - Update file metadata
 - Assign photo slots in family_details
+- Claim pending uploads for background processing
 - Delete files and cleanup
 """
 
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
-from app.models.file import File, ProcessingStatusEnum, FileKindEnum
+from sqlalchemy.exc import IntegrityError
+from app.models.file import File, ProcessingStatusEnum, FileKindEnum, ContentBlob
 from app.models.family import FamilyDetails
 from app.models.profile import Profile
+from app.models.astrology import AstrologyDetails
 from app.schemas.file import FileCreate
+from app.crud.file import invalidate_file_meta
 import uuid
-from datetime import datetime
-from typing import Optional, Tuple
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List
 
 
 # ==================== FILE RECORD MANAGEMENT ====================
@@ -88,20 +93,47 @@ def get_file_by_id(db: Session, file_id: str) -> Optional[File]:
     return db.query(File).filter(File.id == file_id).first()
 
 
-def find_duplicate_by_checksum(db: Session, checksum: str) -> Optional[File]:
+def get_profile_file_ids(db: Session, profile_id: int) -> List[str]:
     """
-    Find existing file by checksum (duplicate detection)
+    Get IDs of all files assigned to a profile (photo slots, community certificate, horoscope)
+    
+    Args:
+        db: Database session
+        profile_id: Profile ID
+    
+    Returns:
+        List of file IDs
+    """
+    file_ids = []
+    family = db.query(FamilyDetails).filter(FamilyDetails.profile_id == profile_id).first()
+    if family:
+        file_ids.extend([family.photo_file_id_1, family.photo_file_id_2, family.community_file_id])
+    file_ids.append(get_astrology_file_id(db, profile_id))
+    return [file_id for file_id in file_ids if file_id]
+
+
+def find_duplicate_by_checksum(db: Session, checksum: str, profile_id: int) -> Optional[File]:
+    """
+    Find a ready file with the same checksum already assigned to this profile
+    
+    Identical content uploaded by another profile is not a duplicate: it
+    gets its own files row and shares the stored copy through content_blobs.
     
     Args:
         db: Database session
         checksum: SHA256 checksum
+        profile_id: Profile ID uploading the file
     
     Returns:
         Existing File object if duplicate found, None otherwise
     """
     print(f"[find_duplicate_by_checksum] Checking for duplicate with checksum: {checksum}")
+    file_ids = get_profile_file_ids(db, profile_id)
+    if not file_ids:
+        return None
     return db.query(File).filter(
         and_(
+            File.id.in_(file_ids),
             File.checksum == checksum,
             File.processing_status == ProcessingStatusEnum.ready
         )
@@ -135,6 +167,7 @@ def update_file_record(
     db_file.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(db_file)
+    invalidate_file_meta(file_id)
     return db_file
 
 
@@ -155,9 +188,257 @@ def delete_file_record(db: Session, file_id: str) -> bool:
     
     db.delete(db_file)
     db.commit()
+    invalidate_file_meta(file_id)
+    return True
+
+
+# ==================== BACKGROUND PROCESSING ====================
+
+def claim_file_for_processing(db: Session, file_id: str) -> bool:
+    """
+    Atomically move a file from 'pending' to 'scanning'
+    
+    Only one worker (in any process) wins the claim, so a job that was
+    enqueued twice (e.g., startup recovery in several gunicorn workers)
+    is processed once.
+    
+    Args:
+        db: Database session
+        file_id: File ID
+    
+    Returns:
+        True if this caller claimed the file, False otherwise
+    """
+    # Row lock: a concurrent claimer waits, then sees 'scanning' and gives up
+    db_file = db.query(File).filter(
+        and_(
+            File.id == file_id,
+            File.processing_status == ProcessingStatusEnum.pending
+        )
+    ).with_for_update().first()
+    if not db_file:
+        db.rollback()
+        return False
+    
+    db_file.processing_status = ProcessingStatusEnum.scanning
+    db_file.updated_at = datetime.utcnow()
+    db.commit()
     return True
 
 
+def get_unfinished_uploads(db: Session, stale_after_minutes: int = 15) -> List[File]:
+    """
+    Get uploads that still need background processing
+    
+    Files stuck in 'scanning' longer than stale_after_minutes (worker died
+    mid-job) are reset to 'pending' first so they can be claimed again.
+    
+    Args:
+        db: Database session
+        stale_after_minutes: Age after which a 'scanning' file is considered abandoned
+    
+    Returns:
+        List of pending File objects
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=stale_after_minutes)
+    # ORM updates (not a bulk UPDATE) so file_stats follows the status change
+    stale_files = db.query(File).filter(
+        and_(
+            File.processing_status == ProcessingStatusEnum.scanning,
+            File.updated_at < cutoff
+        )
+    ).with_for_update().all()
+    for db_file in stale_files:
+        db_file.processing_status = ProcessingStatusEnum.pending
+    db.commit()
+    
+    return db.query(File).filter(
+        File.processing_status == ProcessingStatusEnum.pending
+    ).all()
+
+
+# ==================== CONTENT BLOBS ====================
+
+def get_content_blob(db: Session, sha256: str) -> Optional[ContentBlob]:
+    """
+    Get content blob by SHA256 of its stored bytes
+    
+    Args:
+        db: Database session
+        sha256: Content hash
+    
+    Returns:
+        ContentBlob object or None
+    """
+    return db.query(ContentBlob).filter(ContentBlob.sha256 == sha256).first()
+
+
+def get_perceptual_hash_for_content(db: Session, content_hash: str) -> Optional[str]:
+    """
+    Get the perceptual hash already computed for a stored WebP
+    
+    Args:
+        db: Database session
+        content_hash: SHA256 of the stored WebP
+    
+    Returns:
+        dHash hex string or None
+    """
+    row = db.query(File.perceptual_hash).filter(
+        and_(File.content_hash == content_hash, File.perceptual_hash.isnot(None), File.perceptual_hash != "")
+    ).first()
+    return row[0] if row else None
+
+
+def find_blob_by_source_checksum(db: Session, checksum: str) -> Optional[ContentBlob]:
+    """
+    Find the stored blob produced from an identical upload (any profile)
+    
+    Lets the worker skip conversion when the same original bytes were
+    already converted and stored.
+    
+    Args:
+        db: Database session
+        checksum: SHA256 of the original upload
+    
+    Returns:
+        Referenced ContentBlob object or None
+    """
+    return db.query(ContentBlob).join(
+        File, File.content_hash == ContentBlob.sha256
+    ).filter(
+        and_(
+            File.checksum == checksum,
+            File.processing_status == ProcessingStatusEnum.ready,
+            ContentBlob.ref_count > 0
+        )
+    ).first()
+
+
+def acquire_content_blob(
+    db: Session,
+    sha256: str,
+    storage_path: str,
+    size_bytes: int,
+    thumbnail_path: Optional[str] = None,
+    derivative_widths: Optional[str] = None
+) -> ContentBlob:
+    """
+    Add a reference to a content blob, creating the blob row if needed
+    
+    Call before writing the blob to disk: the row (and its lock) stops
+    garbage collection from deleting the files underneath the new reference.
+    
+    Args:
+        db: Database session
+        sha256: Content hash
+        storage_path: Path of the stored file in the content store
+        size_bytes: Stored size in bytes
+        thumbnail_path: Path of the stored thumbnail
+        derivative_widths: Stored responsive widths (e.g., "150,320,640")
+    
+    Returns:
+        ContentBlob object
+    """
+    for _ in range(2):
+        updated = db.query(ContentBlob).filter(ContentBlob.sha256 == sha256).update(
+            {
+                ContentBlob.ref_count: ContentBlob.ref_count + 1,
+                ContentBlob.released_at: None
+            },
+            synchronize_session=False
+        )
+        if updated:
+            db.commit()
+            return get_content_blob(db, sha256)
+        
+        db.add(ContentBlob(
+            sha256=sha256,
+            storage_path=storage_path,
+            thumbnail_path=thumbnail_path,
+            derivative_widths=derivative_widths,
+            size_bytes=size_bytes,
+            ref_count=1
+        ))
+        try:
+            db.commit()
+            return get_content_blob(db, sha256)
+        except IntegrityError:
+            # Another worker inserted the same blob first, add a reference instead
+            db.rollback()
+    raise RuntimeError(f"Failed to acquire content blob {sha256}")
+
+
+def release_content_blob(db: Session, sha256: str) -> Optional[int]:
+    """
+    Drop one reference to a content blob
+    
+    Files are not deleted here; blobs at ref_count 0 are removed later by
+    garbage collection (app/utils/content_store.py).
+    
+    Args:
+        db: Database session
+        sha256: Content hash
+    
+    Returns:
+        Remaining reference count, or None if the blob does not exist
+    """
+    blob = db.query(ContentBlob).filter(ContentBlob.sha256 == sha256).with_for_update().first()
+    if not blob:
+        db.rollback()
+        return None
+    
+    blob.ref_count = max(blob.ref_count - 1, 0)
+    if blob.ref_count == 0:
+        blob.released_at = datetime.utcnow()
+    db.commit()
+    return blob.ref_count
+
+
+def get_unreferenced_blob_ids(db: Session, grace_minutes: int = 60, limit: int = 500) -> List[str]:
+    """
+    Get blobs whose last reference was dropped more than grace_minutes ago
+    
+    Args:
+        db: Database session
+        grace_minutes: Minimum time at ref_count 0 before deletion
+        limit: Maximum number of blobs returned
+    
+    Returns:
+        List of content hashes
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=grace_minutes)
+    rows = db.query(ContentBlob.sha256).filter(
+        and_(
+            ContentBlob.ref_count == 0,
+            ContentBlob.released_at < cutoff
+        )
+    ).limit(limit).all()
+    return [row[0] for row in rows]
+
+
+def lock_unreferenced_blob(db: Session, sha256: str) -> Optional[ContentBlob]:
+    """
+    Lock a blob for deletion if it is still unreferenced
+    
+    The row lock is held until the caller commits, so a concurrent
+    acquire_content_blob waits and then recreates the blob and its files.
+    
+    Args:
+        db: Database session
+        sha256: Content hash
+    
+    Returns:
+        Locked ContentBlob object or None if it was referenced again
+    """
+    return db.query(ContentBlob).filter(
+        and_(
+            ContentBlob.sha256 == sha256,
+            ContentBlob.ref_count == 0
+        )
+    ).with_for_update().first()
+
+
 # ==================== PHOTO SLOT ASSIGNMENT ====================
 
 def get_profile_with_family(db: Session, profile_id: int) -> Optional[Tuple[Profile, FamilyDetails]]:
@@ -346,6 +627,57 @@ def unassign_community_cert_from_family(db: Session, file_id: str) -> bool:
     return True
 
 
+# ==================== HOROSCOPE ASSIGNMENT ====================
+
+def get_astrology_file_id(db: Session, profile_id: int) -> Optional[str]:
+    """
+    Get horoscope file ID assigned to a profile
+    
+    Args:
+        db: Database session
+        profile_id: Profile ID
+    
+    Returns:
+        File ID or None if no horoscope is assigned
+    """
+    astrology = db.query(AstrologyDetails).filter(AstrologyDetails.profile_id == profile_id).first()
+    return astrology.file_id if astrology else None
+
+
+def assign_horoscope_to_astrology(
+    db: Session,
+    profile_id: int,
+    file_id: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Assign horoscope file to astrology_details
+    
+    Args:
+        db: Database session
+        profile_id: Profile ID
+        file_id: File ID to assign
+    
+    Returns:
+        Tuple[success, error_message]
+        - (True, None) if successful
+        - (False, error_msg) if a horoscope is already assigned
+    """
+    astrology = db.query(AstrologyDetails).filter(AstrologyDetails.profile_id == profile_id).first()
+    
+    if not astrology:
+        # Create astrology record if doesn't exist
+        astrology = AstrologyDetails(profile_id=profile_id)
+        db.add(astrology)
+        db.flush()
+    
+    if astrology.file_id is not None:
+        return False, "Horoscope file already uploaded for this profile"
+    
+    astrology.file_id = file_id
+    db.commit()
+    return True, None
+
+
 # ==================== HELPER FUNCTIONS ====================
 
 def get_profile_serial_number(db: Session, profile_id: int) -> Optional[str]:
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from ..models.partner_preferences import PartnerPreferences
 from ..schemas.partner_preferences import PartnerPreferencesCreate, PartnerPreferencesUpdate
+from ..utils.age import calculate_age
 from fastapi import HTTPException
 
 def create_partner_preferences(db: Session, preferences_data: PartnerPreferencesCreate):
@@ -227,8 +228,7 @@ def find_matching_profiles(db: Session, profile_id: int, skip: int = 0, limit: i
     
     # Age matching (if user's age is within preference range)
     if user_profile.birth_date:
-        from datetime import date
-        user_age = (date.today() - user_profile.birth_date).days // 365
+        user_age = calculate_age(user_profile.birth_date)
         query = query.filter(
             (PartnerPreferences.age_from.is_(None)) | (PartnerPreferences.age_from <= user_age)
         ).filter(
@@ -1,27 +1,109 @@
 # Dependency to get DB session
+import os
+
+from fastapi import Request
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from app.utils.db_pool import TimedAsyncQueuePool, TimedQueuePool, watch_engine
+from app.utils.read_routing import ReplicaRouter
+
 # 👇 GLOBAL CONFIG
-# Connection details
-MYSQL_USER = "manamalai"
-MYSQL_PASSWORD = "Chenagai_12345"
-MYSQL_HOST = "127.0.0.1"  # Localhost because of SSH tunnel
-MYSQL_PORT = 3306         # Local port forwarded to remote 3306
-MYSQL_DB = "manamalai_dev"
-
-# SQLAlchemy connection string
+# Connection details (environment overrides the development defaults)
+MYSQL_USER = os.getenv("MYSQL_USER", "manamalai")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "Chenagai_12345")
+MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")  # Localhost because of SSH tunnel
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))  # Local port forwarded to remote 3306
+MYSQL_DB = os.getenv("MYSQL_DB", "manamalai_dev")
+
+# Connection pool (per process: gunicorn workers x (size + overflow) must stay
+# below MySQL max_connections)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))      # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))      # Below MySQL wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # Replace dead connections on checkout
+# Async engine for async routes (separate pool, same limits): aiomysql or asyncmy
+ASYNC_DB_DRIVER = os.getenv("ASYNC_DB_DRIVER", "aiomysql")
+# Read replica for read-only routes (get_read_db); unset: all reads use the primary.
+# User, password and database default to the primary's
+MYSQL_REPLICA_HOST = os.getenv("MYSQL_REPLICA_HOST", "")
+MYSQL_REPLICA_PORT = int(os.getenv("MYSQL_REPLICA_PORT", str(MYSQL_PORT)))
+MYSQL_REPLICA_USER = os.getenv("MYSQL_REPLICA_USER", MYSQL_USER)
+MYSQL_REPLICA_PASSWORD = os.getenv("MYSQL_REPLICA_PASSWORD", MYSQL_PASSWORD)
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "3"))  # Seconds; fall back fast if it is down
+
+# SQLAlchemy connection strings
 connection_url = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+async_connection_url = f"mysql+{ASYNC_DB_DRIVER}://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+replica_connection_url = f"mysql+pymysql://{MYSQL_REPLICA_USER}:{MYSQL_REPLICA_PASSWORD}@{MYSQL_REPLICA_HOST}:{MYSQL_REPLICA_PORT}/{MYSQL_DB}"
 
-# Create engine and session
-engine = create_engine(connection_url)
+# Create engine and session (checkout waits are exposed at GET /admin/db/pool)
+engine = create_engine(
+    connection_url,
+    poolclass=TimedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
+watch_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Read replica engine and session (own pool, same limits); replica_router
+# falls back to the primary on lag and after the client's own writes
+read_engine = engine
+replica_router = None
+if MYSQL_REPLICA_HOST:
+    read_engine = create_engine(
+        replica_connection_url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={"connect_timeout": DB_REPLICA_CONNECT_TIMEOUT}
+    )
+    watch_engine(read_engine)
+    replica_router = ReplicaRouter(read_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async engine and session (async def routes: queries await on the event loop
+# instead of blocking it). expire_on_commit=False: attributes stay readable
+# after commit without an implicit (sync) refresh
+async_engine = create_async_engine(
+    async_connection_url,
+    poolclass=TimedAsyncQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
+watch_engine(async_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db(request: Request):
+    # Read-only routes: replica unless it lags or this client just wrote
+    use_replica = replica_router is not None and replica_router.use_replica(request)
+    db = ReadSessionLocal() if use_replica else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 # Import model submodules via package-relative imports so SQLAlchemy metadata is populated
 # without causing circular import issues when the package is imported by uvicorn.
@@ -9,6 +10,10 @@ from app.models import partner_preferences as models_partner_preferences
 from app.models import professional as models_professional
 from app.models import file as models_file
 import app.database as database
+from app.utils.file_handler import image_processor
+from app.utils.clamd import clamd_client
+from app.utils.content_store import run_garbage_collector
+from app.utils.db_pool import track_request_pool_wait
 from app.routers import (
     profile as profile_router,
     astrology as astrology_router,
@@ -18,6 +23,7 @@ from app.routers import (
     user as user_router,
     file as file_router,
     membership as membership_router,
+    admin as admin_router,
 )
 
 app = FastAPI()
@@ -43,4 +49,47 @@ app.include_router(partner_preferences_router.router)
 app.include_router(professional_router.router)
 app.include_router(user_router.router)
 app.include_router(file_router.router)
-app.include_router(membership_router.router)
\ No newline at end of file
+app.include_router(membership_router.router)
+app.include_router(admin_router.router)
+
+
+@app.middleware("http")
+async def record_db_pool_wait(request: Request, call_next):
+    # Attribute connection pool waits to the route that caused them (GET /admin/db/pool)
+    with track_request_pool_wait() as pool_wait:
+        try:
+            return await call_next(request)
+        finally:
+            route = request.scope.get("route")
+            pool_wait.route = f"{request.method} {route.path}" if route else None
+
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    # Pin a client's reads to the primary for a while after it writes (replica lag)
+    response = await call_next(request)
+    if database.replica_router:
+        database.replica_router.mark_write(request, response)
+    return response
+
+
+# Periodic deletion of unreferenced content-store blobs
+content_gc_task = None
+
+
+@app.on_event("startup")
+async def start_upload_queue():
+    # Start background upload workers and resume uploads left pending
+    global content_gc_task
+    await file_router.upload_queue.start()
+    content_gc_task = asyncio.create_task(run_garbage_collector())
+
+
+@app.on_event("shutdown")
+async def shutdown_background_workers():
+    # Stop upload workers first, then the image processing worker processes
+    await file_router.upload_queue.stop()
+    if content_gc_task:
+        content_gc_task.cancel()
+    image_processor.shutdown()
+    clamd_client.close()
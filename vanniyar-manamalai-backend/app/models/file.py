@@ -1,4 +1,7 @@
 from sqlalchemy import Column, String, BigInteger, Integer, ForeignKey, Enum, DateTime, CheckConstraint, Index
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
 from app.database import Base
 import enum
@@ -29,6 +32,9 @@ class File(Base):
         Index('idx_filekind_status', 'file_kind', 'processing_status', 'id'),
         # Index for duplicate detection by size and checksum
         Index('idx_size_checksum', 'size_bytes', 'checksum', 'id'),
+        # Prefix indexes for path lookups (storage reconciliation)
+        Index('idx_storage_path', 'storage_path', mysql_length=191),
+        Index('idx_thumbnail_path', 'thumbnail_path', mysql_length=191),
     )
     
     # Primary key: UUID v4
@@ -41,10 +47,12 @@ class File(Base):
     mime_type = Column(String(128), nullable=False)  # e.g., "image/jpeg", "application/pdf"
     size_bytes = Column(BigInteger, nullable=False)  # File size in bytes
     checksum = Column(String(64), nullable=True)  # SHA256 hash (for integrity and duplicate detection)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA256 of stored bytes (content_blobs key, photos only)
     
     # Image-specific metadata (NULL for PDFs)
     width = Column(Integer, nullable=True)  # Image width in pixels
     height = Column(Integer, nullable=True)  # Image height in pixels
+    perceptual_hash = Column(String(16), nullable=True)  # 64-bit dHash hex (photos, near-duplicate detection)
     
     # Generated assets
     thumbnail_path = Column(String(768), nullable=True)  # Thumbnail for images (e.g., "/thumbs/abc123_thumb.jpg")
@@ -56,6 +64,8 @@ class File(Base):
         nullable=False, 
         default=ProcessingStatusEnum.pending
     )
+    rejection_code = Column(String(32), nullable=True)  # ErrorCodeEnum value when rejected by the upload worker
+    rejection_message = Column(String(512), nullable=True)  # Reason shown by GET /files/{id}/status
     
     # Versioning (file revision history)
     version_of = Column(
@@ -72,3 +82,165 @@ class File(Base):
         server_default=func.current_timestamp(), 
         onupdate=func.current_timestamp()
     )
+
+
+class ContentBlob(Base):
+    """
+    Content-addressed photo store entry (one stored copy per distinct content)
+    - Files rows reference a blob through files.content_hash
+    - ref_count is the number of files rows using the blob
+    - Blobs at ref_count 0 are deleted by garbage collection after a grace period
+    """
+    __tablename__ = "content_blobs"
+    __table_args__ = (
+        # Index for garbage collection of unreferenced blobs
+        Index('idx_blobs_gc', 'ref_count', 'released_at'),
+    )
+
+    sha256 = Column(String(64), primary_key=True)  # SHA256 of stored bytes
+    storage_path = Column(String(768), nullable=False)  # e.g., "/srv/uploads/store/ab/cd/abcd....webp"
+    thumbnail_path = Column(String(768), nullable=True)  # e.g., "/srv/uploads/store/ab/cd/abcd..._thumb.webp"
+    derivative_widths = Column(String(64), nullable=True)  # Stored responsive widths, e.g., "150,320,640" (files: <sha256>_w<width>.webp)
+    size_bytes = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    released_at = Column(DateTime, nullable=True)  # When ref_count last dropped to 0
+
+    created_at = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        server_default=func.current_timestamp(),
+        onupdate=func.current_timestamp()
+    )
+
+
+class FileStats(Base):
+    """
+    Aggregate counts and bytes of files rows per (file_kind, processing_status)
+    - Maintained in the same transaction as every files insert, delete and
+      status/size change (see _track_file_stats below)
+    - /files/admin/statistics reads these few rows instead of scanning files
+    - Rebuilt and verified with one GROUP BY ... WITH ROLLUP
+      (app.crud.file.rebuild_file_stats)
+    """
+    __tablename__ = "file_stats"
+
+    file_kind = Column(Enum(FileKindEnum), primary_key=True)
+    processing_status = Column(Enum(ProcessingStatusEnum), primary_key=True)
+    file_count = Column(BigInteger, nullable=False, default=0)
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        server_default=func.current_timestamp(),
+        onupdate=func.current_timestamp()
+    )
+
+
+# ==================== FILE STATS MAINTENANCE ====================
+
+_STATS_ATTRS = ("file_kind", "processing_status", "size_bytes")
+
+
+def _enum_value(value):
+    return getattr(value, "value", value)
+
+
+def _file_stats_values(session, obj, old: bool):
+    """(file_kind, processing_status, size_bytes) before (old) or after this flush"""
+    state = inspect(obj)
+    values = []
+    missing = False
+    for attr in _STATS_ATTRS:
+        history = state.attrs[attr].history
+        if not old and history.added:
+            values.append(history.added[0])
+        elif history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            # Expired before it was changed: previous value is only in the database
+            values.append(None)
+            missing = True
+
+    if missing and not state.pending:
+        row = session.execute(
+            select(File.file_kind, File.processing_status, File.size_bytes).where(File.id == state.identity[0])
+        ).first()
+        if row is not None:
+            values = [value if value is not None else stored for value, stored in zip(values, row)]
+
+    kind, status, size = values
+    # Column default applies to new rows flushed without a status
+    status = status if status is not None else ProcessingStatusEnum.pending
+    return _enum_value(kind), _enum_value(status), size or 0
+
+
+def _track_file_stats(session, flush_context, instances):
+    """Apply file_stats deltas for files rows inserted, deleted or changed in this flush"""
+    deltas = {}
+
+    def add(key, count, size):
+        current = deltas.get(key, (0, 0))
+        deltas[key] = (current[0] + count, current[1] + size)
+
+    for obj in session.new:
+        if isinstance(obj, File):
+            kind, status, size = _file_stats_values(session, obj, old=False)
+            add((kind, status), 1, size)
+
+    for obj in session.deleted:
+        if isinstance(obj, File):
+            kind, status, size = _file_stats_values(session, obj, old=True)
+            add((kind, status), -1, -size)
+
+    for obj in session.dirty:
+        if not isinstance(obj, File) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[attr].history.added for attr in _STATS_ATTRS):
+            continue
+        old_kind, old_status, old_size = _file_stats_values(session, obj, old=True)
+        kind, status, size = _file_stats_values(session, obj, old=False)
+        add((old_kind, old_status), -1, -old_size)
+        add((kind, status), 1, size)
+
+    table = FileStats.__table__
+    mysql = session.get_bind(FileStats).dialect.name == "mysql"
+    # Fixed lock order across transactions (avoids deadlocks)
+    for (kind, status), (count, size) in sorted(deltas.items()):
+        if not count and not size:
+            continue
+        if mysql:
+            # One upsert: concurrent first writes of a (kind, status) pair
+            # cannot race into a duplicate-key error
+            session.execute(
+                mysql_insert(table).values(
+                    file_kind=kind, processing_status=status, file_count=count, total_bytes=size
+                ).on_duplicate_key_update(
+                    file_count=table.c.file_count + count,
+                    total_bytes=table.c.total_bytes + size,
+                    # onupdate is not applied to ON DUPLICATE KEY UPDATE
+                    updated_at=func.current_timestamp()
+                )
+            )
+            continue
+        # Other dialects (SQLite in development): update, insert if missing
+        key = (table.c.file_kind == kind) & (table.c.processing_status == status)
+        result = session.execute(
+            table.update().where(key).values(
+                file_count=table.c.file_count + count,
+                total_bytes=table.c.total_bytes + size
+            )
+        )
+        if result.rowcount == 0:
+            session.execute(
+                table.insert().values(
+                    file_kind=kind, processing_status=status, file_count=count, total_bytes=size
+                )
+            )
+
+
+event.listen(Session, "before_flush", _track_file_stats)
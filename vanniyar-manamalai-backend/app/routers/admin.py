@@ -0,0 +1,48 @@
+from fastapi import APIRouter
+import app.database as database
+from app.utils.db_pool import pool_metrics
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+@router.get("/db/pool")
+def get_db_pool_metrics():
+    """
+    Get database connection pool metrics (this worker process)
+
+    Purpose: Diagnose pool exhaustion and stale connections under gunicorn load
+
+    Configuration: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING (app/database.py)
+
+    Returns:
+    - pool / async_pool / read_pool (replica, if configured): pool_size,
+      checked_out, checked_in, overflow (negative until the pool is full),
+      max_overflow, timeout/recycle seconds, pre_ping
+    - waits: checkouts, timeouts, slow_checkouts, avg/max wait (ms),
+      connections opened and invalidated (failed pre-ping, recycled)
+    - histograms: pool.checkout wait, and per route request.<route>
+      pool_wait vs total request time (ms, p50/p95/p99)
+    """
+    return pool_metrics(database.engine, database.async_engine, database.read_engine)
+
+
+@router.get("/db/replica")
+def get_db_replica_status():
+    """
+    Get read-replica routing status (this worker process)
+
+    Purpose: Check that read-only routes are actually served by the replica
+
+    Configuration: MYSQL_REPLICA_HOST (app/database.py), REPLICA_MAX_LAG_SECONDS,
+    REPLICA_LAG_CHECK_SECONDS, READ_YOUR_WRITES_SECONDS (app/utils/read_routing.py)
+
+    Returns:
+    - configured: false when no replica is set (all reads use the primary)
+    - usable, lag_seconds, last_error: result of the last lag check
+    - routed: get_read_db sessions by target (replica, primary_recent_write,
+      primary_lag, primary_unavailable)
+    """
+    if database.replica_router is None:
+        return {"configured": False}
+    return database.replica_router.snapshot()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.astrology import (
     AstrologyDetailsCreate, 
     AstrologyDetailsUpdate, 
@@ -31,7 +31,7 @@ def create_new_astrology(astrology: AstrologyDetailsCreate, db: Session = Depend
     return create_astrology(db, astrology)
 
 @router.get("/{astrology_id}", response_model=AstrologyDetailsResponse)
-def read_astrology(astrology_id: int, db: Session = Depends(get_db)):
+def read_astrology(astrology_id: int, db: Session = Depends(get_read_db)):
     """
     Get astrology details by ID
     
@@ -46,7 +46,7 @@ def read_astrology(astrology_id: int, db: Session = Depends(get_db)):
     return db_astrology
 
 @router.get("/profile/{profile_id}", response_model=list[AstrologyDetailsResponse])
-def read_astrology_by_profile(profile_id: int, db: Session = Depends(get_db)):
+def read_astrology_by_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get all astrology details for a profile
     
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.family import (
     FamilyDetailsCreate, 
     FamilyDetailsUpdate, 
@@ -34,7 +34,7 @@ def create_new_family(family: FamilyDetailsCreate, db: Session = Depends(get_db)
     return create_family(db, family)
 
 @router.get("/{family_id}", response_model=FamilyDetailsResponse)
-def read_family(family_id: int, db: Session = Depends(get_db)):
+def read_family(family_id: int, db: Session = Depends(get_read_db)):
     """
     Get family details by ID
     
@@ -49,7 +49,7 @@ def read_family(family_id: int, db: Session = Depends(get_db)):
     return db_family
 
 @router.get("/profile/{profile_id}", response_model=list[FamilyDetailsResponse])
-def read_family_by_profile(profile_id: int, db: Session = Depends(get_db)):
+def read_family_by_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get all family details for a profile
     
@@ -231,7 +231,7 @@ def delete_family_by_profile(profile_id: int, db: Session = Depends(get_db)):
 # ==================== COMPUTED PROPERTIES ====================
 
 @router.get("/profile/{profile_id}/summary", response_model=FamilySummary)
-def get_family_summary(profile_id: int, db: Session = Depends(get_db)):
+def get_family_summary(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get computed family summary (total siblings, unmarried siblings, etc.)
     
@@ -286,7 +286,7 @@ def search_by_family_status(
     family_status: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by family economic status
@@ -321,7 +321,7 @@ def search_by_family_type(
     family_type: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by family structure type
@@ -355,7 +355,7 @@ def search_by_family_type(
 def search_unmarried_siblings(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles with unmarried siblings
@@ -1,33 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File as FastAPIFile, Query
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File as FastAPIFile, Query, Request, Response
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_async_db
+from app.crud import file_async
 from app.crud.file import (
     generate_file_id, calculate_checksum, create_file, get_file_by_id, 
     get_files_by_ids, update_file, delete_file, get_files_by_kind,
     get_files_by_status, get_ready_files, get_file_versions,
     find_duplicate_by_checksum, get_file_statistics, get_large_files,
     mark_file_as_ready, mark_file_as_rejected, mark_file_as_quarantined,
-    get_images_by_dimensions
+    get_images_by_dimensions, rebuild_file_stats, get_file_meta, get_file_metas,
+    invalidate_file_meta, get_file_meta_cache_stats
 )
 from app.crud.file_upload import (
     create_file_record, find_duplicate_by_checksum as find_dup,
     assign_photo_to_slot, unassign_photo_from_slot,
     get_profile_serial_number, find_available_photo_slot,
     get_profile_with_family, assign_community_cert_to_family,
-    unassign_community_cert_from_family
+    unassign_community_cert_from_family, get_astrology_file_id,
+    release_content_blob
 )
 from app.schemas.file import (
     FileCreate, FileUpdate, FileResponse, FileUploadRequest, 
     FileUploadResponse, FileMetadata, FileStatistics, 
     FileKindEnum, ProcessingStatusEnum
 )
-from app.schemas.file_upload import FileUploadResponse as PhotoUploadResponse, FileUploadErrorResponse, ErrorCodeEnum, FileDeleteResponse
+from app.schemas.file_upload import FileUploadResponse as PhotoUploadResponse, FileUploadErrorResponse, ErrorCodeEnum, FileDeleteResponse, FileStatusResponse
+from app.schemas.file_upload import ThumbnailBatchRequest, ThumbnailBatchResponse, ThumbnailPayload
 from app.utils.file_handler import (
-    validate_file_size, validate_mime_type, calculate_checksum as calc_checksum,
-    scan_file_with_clamav, convert_to_webp, generate_thumbnail,
+    validate_mime_type, validate_file_header, stream_upload_to_memory, MAX_IMAGE_PIXELS,
     ensure_directory, save_file_to_disk, delete_file_from_disk,
-    generate_photo_filename, image_to_pdf, validate_pdf_file
+    image_processor, nearest_derivative_width, PHOTO_DERIVATIVE_WIDTHS
 )
+from app.models.file import ProcessingStatusEnum as ModelStatusEnum
+from app.utils.upload_processor import UploadProcessingQueue, UploadKindEnum, write_job_manifest
+from app.utils.content_store import derivative_path_for
+from app.utils.derivative_cache import derivative_cache
+from app.utils.file_serving import serve_file, versioned_url, make_etag, multipart_mixed_response
+from app.utils.stage_timing import StageTimer, upload_timings, server_timing_header, UPLOAD_TIMING_HEADER
+from app.utils.storage import UPLOAD_ROOT, get_storage, key_for_path
 from typing import List, Optional
 import os
 import shutil
@@ -35,27 +46,23 @@ from pathlib import Path
 import uuid
 import io
 import platform
+import asyncio
+import base64
 
 # ==================== CONFIGURATION ====================
 
 # Detect operating system
 SYSTEM = platform.system()  # 'Windows', 'Linux', 'Darwin' (macOS)
 
-# Define upload paths based on operating system
-if SYSTEM == 'Windows':
-    # Windows paths (use relative or absolute Windows paths)
-    BASE_UPLOAD_DIR = Path("./uploads")  # or use: Path("C:\\uploads")
-    PHOTOS_DIR = BASE_UPLOAD_DIR / "photos"
-    QUARANTINE_DIR = BASE_UPLOAD_DIR / "quarantine"
-    THUMBNAIL_DIR = BASE_UPLOAD_DIR / "thumbnails"
-    COMMUNITY_DIR = BASE_UPLOAD_DIR / "community"
-else:
-    # Linux/Ubuntu paths
-    BASE_UPLOAD_DIR = Path("/srv/uploads")  # or use: Path("/home/user/uploads")
-    PHOTOS_DIR = BASE_UPLOAD_DIR / "photos"
-    QUARANTINE_DIR = BASE_UPLOAD_DIR / "quarantine"
-    THUMBNAIL_DIR = BASE_UPLOAD_DIR / "thumbnails"
-    COMMUNITY_DIR = BASE_UPLOAD_DIR / "community"
+# Upload root comes from app.utils.storage (UPLOAD_ROOT env, ./uploads on Windows,
+# /srv/uploads elsewhere); with STORAGE_BACKEND=s3 these paths are also the object keys
+BASE_UPLOAD_DIR = UPLOAD_ROOT
+PHOTOS_DIR = BASE_UPLOAD_DIR / "photos"
+QUARANTINE_DIR = BASE_UPLOAD_DIR / "quarantine"
+THUMBNAIL_DIR = BASE_UPLOAD_DIR / "thumbnails"
+COMMUNITY_DIR = BASE_UPLOAD_DIR / "community"
+HOROSCOPE_DIR = BASE_UPLOAD_DIR / "horoscope"
+STORE_DIR = BASE_UPLOAD_DIR / "store"  # Content-addressed photos/thumbnails
 
 # Legacy aliases for backward compatibility
 UPLOAD_DIR = BASE_UPLOAD_DIR
@@ -66,6 +73,8 @@ PHOTOS_DIR.mkdir(parents=True, exist_ok=True)
 QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
 THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
 COMMUNITY_DIR.mkdir(parents=True, exist_ok=True)
+HOROSCOPE_DIR.mkdir(parents=True, exist_ok=True)
+STORE_DIR.mkdir(parents=True, exist_ok=True)
 
 # Print configuration for debugging
 # print(f"[FILE UPLOAD CONFIG] OS: {SYSTEM}")
@@ -77,13 +86,176 @@ COMMUNITY_DIR.mkdir(parents=True, exist_ok=True)
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+# Background processing for accepted uploads (started in app.main on startup)
+upload_queue = UploadProcessingQueue(QUARANTINE_DIR)
+
+
+def _new_quarantine_path():
+    """
+    Generate a file ID and its quarantine path
+
+    Returns:
+        Tuple[file_id, quarantine_path]
+    """
+    file_id = str(uuid.uuid4())
+    return file_id, str(QUARANTINE_DIR / f"{file_id}.bin")
+
+
+async def _ingest_upload(file: UploadFile, request: Request, timer: StageTimer, max_size_mb: int = 10):
+    """
+    Read an upload into memory, returning an error response if it fails
+
+    Returns:
+        Tuple[size_bytes, content, checksum, error_response]
+    """
+    # Read, size check and SHA256 happen in one pass; nothing is written to disk
+    with timer.stage("ingest"):
+        size_bytes, content, checksum, ingest_error = await stream_upload_to_memory(
+            file,
+            max_size_mb=max_size_mb,
+            content_length=request.headers.get("content-length")
+        )
+    if ingest_error == "SIZE_EXCEEDED":
+        return size_bytes, None, None, PhotoUploadResponse(
+            status="error",
+            code=ErrorCodeEnum.SIZE_EXCEEDED,
+            message=f"File size exceeds {max_size_mb}MB limit"
+        )
+    if ingest_error == "EMPTY_FILE":
+        return size_bytes, None, None, PhotoUploadResponse(
+            status="error",
+            code=ErrorCodeEnum.PROCESSING_ERROR,
+            message="File is empty"
+        )
+    if ingest_error:
+        return size_bytes, None, None, PhotoUploadResponse(
+            status="error",
+            code=ErrorCodeEnum.PROCESSING_ERROR,
+            message=f"Failed to read file: {ingest_error}"
+        )
+    return size_bytes, content, checksum, None
+
+
+def _validate_upload_header(content: bytes, allowed_types: list, timer: StageTimer):
+    """
+    Sniff the upload's type and check image dimensions from the header
+
+    Runs on the in-memory bytes (header parse only, no pixel decode), before
+    the scan/convert stages.
+
+    Returns:
+        Tuple[mime_type, error_response]
+    """
+    with timer.stage("header_validation"):
+        info, header_error = validate_file_header(content, allowed_types)
+    if not header_error:
+        return info["mime_type"], None
+
+    if header_error == "IMAGE_TOO_LARGE":
+        return None, PhotoUploadResponse(
+            status="error",
+            code=ErrorCodeEnum.SIZE_EXCEEDED,
+            message=f"Image dimensions exceed {MAX_IMAGE_PIXELS // 1_000_000} megapixels"
+        )
+    return None, PhotoUploadResponse(
+        status="error",
+        code=ErrorCodeEnum.INVALID_FILE_TYPE,
+        message="File content does not match an allowed type" if header_error == "INVALID_FILE_TYPE"
+        else "File is not a valid image"
+    )
+
+
+async def _accept_upload(
+    db: AsyncSession,
+    timer: StageTimer,
+    file_id: str,
+    quarantine_path: str,
+    content: bytes,
+    size_bytes: int,
+    upload_kind: UploadKindEnum,
+    profile_id: int,
+    original_name: str,
+    content_type: str,
+    final_mime_type: str,
+    checksum: str,
+    storage_dir: Path,
+    thumbnail_dir: Optional[Path] = None
+):
+    """
+    Create a 'pending' file record for an upload and queue processing
+
+    The bytes travel to the worker in memory while the queue's memory budget
+    allows; otherwise they are spooled to quarantine with a job manifest
+    (atomic writes), as they are for restart recovery.
+
+    Returns:
+        Tuple[file_id, error_message]
+    """
+    job = {
+        "file_id": file_id,
+        "upload_kind": upload_kind.value,
+        "profile_id": profile_id,
+        "quarantine_path": quarantine_path,
+        "content_type": content_type,
+        "storage_dir": str(storage_dir),
+        "thumbnail_dir": str(thumbnail_dir) if thumbnail_dir else None,
+    }
+    in_memory = upload_queue.reserve_memory(size_bytes)
+    if not in_memory:
+        with timer.stage("spool"):
+            saved, save_error = await asyncio.to_thread(save_file_to_disk, content, quarantine_path)
+            if saved:
+                saved, save_error = write_job_manifest(job)
+        if not saved:
+            _, _ = delete_file_from_disk(quarantine_path)
+            return None, f"Failed to save file: {save_error}"
+
+    try:
+        # Raw bytes stay in memory (or quarantine) until the worker stores the final file;
+        # storage_path names the quarantine slot either way (see _recover_pending)
+        with timer.stage("db_insert"):
+            await file_async.create_file_record(
+                db,
+                file_id=file_id,
+                original_name=original_name,
+                mime_type=final_mime_type,
+                size_bytes=size_bytes,
+                checksum=checksum,
+                storage_path=quarantine_path,
+                processing_status=ModelStatusEnum.pending
+            )
+    except Exception as e:
+        await db.rollback()
+        if in_memory:
+            upload_queue.release_memory(size_bytes)
+        else:
+            _, _ = delete_file_from_disk(quarantine_path)
+            _, _ = delete_file_from_disk(str(Path(quarantine_path).with_suffix(".json")))
+        return None, f"Failed to create database record: {str(e)}"
+
+    if in_memory:
+        job["_content"] = content
+    with timer.stage("enqueue"):
+        await upload_queue.enqueue(job)
+    return file_id, None
+
+
+def _finish_upload_timing(timer: StageTimer, response: Response, upload_kind: UploadKindEnum) -> None:
+    """Record the request-side stages and add the Server-Timing debug header"""
+    upload_timings.observe(f"request.{upload_kind.value}", timer)
+    if UPLOAD_TIMING_HEADER:
+        response.headers["Server-Timing"] = timer.server_timing()
+
+
 # ==================== FILE UPLOAD ====================
 
-@router.post("/upload/profile-photo", response_model=PhotoUploadResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/upload/profile-photo", response_model=PhotoUploadResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_profile_photo(
+    request: Request,
+    response: Response,
     file: UploadFile = FastAPIFile(...),
     profile_id: int = Query(..., description="Profile ID"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Upload profile photo with validation, virus scanning, and WebP conversion.
@@ -91,23 +263,31 @@ async def upload_profile_photo(
     Purpose: Handle family photo uploads for matrimony profiles
     
     Workflow:
-    1. Validate file size (max 10MB)
-    2. Validate MIME type (JPEG, PNG, WebP only)
-    3. Calculate SHA256 checksum for duplicate detection
-    4. Check for existing duplicate file
-    5. Save to quarantine directory
-    6. Scan for viruses with ClamAV (with fallback to clamscan)
-    7. Convert to WebP with EXIF preservation
-    8. Generate thumbnail (150x150 WebP)
-    9. Determine available photo slot (1 or 2)
-    10. Move file to permanent storage
-    11. Create database record
-    12. Assign to family_details photo slot
-    13. Return FileUploadResponse with file_id and thumbnail_url
+    1. Validate MIME type (JPEG, PNG, WebP only)
+    2. Check that a photo slot is free (fail fast)
+    3. Read into memory in chunks, enforcing the 10MB limit (Content-Length
+       and running byte count) and calculating SHA256 in the same pass
+       Then sniff magic bytes and read dimensions from the header (no decode);
+       reject mislabelled files and images over MAX_IMAGE_PIXELS
+    4. Check for existing duplicate file already assigned to this profile
+    5. Create database record with processing_status 'pending' (bytes stay in
+       memory; spooled to quarantine with a job manifest past the memory budget)
+    6. Queue background processing and return 202 with file_id and status_url
+    
+    Background worker (app/utils/upload_processor.py):
+    - Status 'scanning': scan for viruses with clamd
+    - Reuse the stored copy if identical content was already processed, otherwise
+      convert to WebP with EXIF preservation and generate thumbnail (150x150 WebP);
+      responsive sizes are generated on demand by GET /files/{id}/image?w=
+    - Determine available photo slot (1 or 2) and reference the content store
+      copy (/srv/uploads/store/ab/cd/<sha256>.webp)
+    - Assign to family_details photo slot
+    - Status 'ready' (or 'rejected' on any failure)
     
     Error Handling:
     - SIZE_EXCEEDED: File > 10MB
     - VIRUS_FOUND: Virus detected during scan
+    - SCAN_TIMEOUT / SCANNING_ERROR: Virus scan could not be completed
     - INVALID_FILE_TYPE: Not JPEG, PNG, or WebP
     - DUPLICATE_DETECTED: Identical file already exists
     - NO_FREE_SLOT: Already have 2 photos (max allowed)
@@ -115,19 +295,29 @@ async def upload_profile_photo(
     
     Security:
     - File size validation (10MB limit)
-    - MIME type whitelist (image/jpeg, image/png, image/webp only)
+    - MIME type whitelist (image/jpeg, image/png, image/webp only), checked
+      against the file's magic bytes, not just the client Content-Type
+    - Decompression-bomb guard (MAX_IMAGE_PIXELS, default 50 MP)
     - SHA256 duplicate detection
     - ClamAV virus scanning with fallback
     - EXIF data preserved (important for image metadata)
     - WebP conversion for efficient storage
     
+    Timing:
+    - Each stage above is timed into GET /files/admin/upload-timings histograms;
+      with UPLOAD_TIMING_HEADER=true the response (and the status poll, once
+      processed) carries a Server-Timing header with the breakdown
+    
     Returns:
-    - Success: {status: 'success', file_id, thumbnail_url, profile_id}
+    - Accepted: {status: 'success', file_id, processing_status: 'pending', status_url, profile_id}
+      Poll GET /files/{file_id}/status until 'ready' for thumbnail_url
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
+    timer = StageTimer()
     try:
         # Get profile to verify it exists and get serial number
-        profile, family = get_profile_with_family(db, profile_id)
+        with timer.stage("profile_lookup"):
+            profile, family = await file_async.get_profile_with_family(db, profile_id)
         if not profile:
             return PhotoUploadResponse(
                 status="error",
@@ -135,25 +325,6 @@ async def upload_profile_photo(
                 message=f"Profile {profile_id} not found"
             )
 
-        # Read file content
-        file_content = await file.read()
-        if not file_content:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="File is empty"
-            )
-
-        # Validate file size (10MB max for images)
-        size_ok, size_error = validate_file_size(file_content, max_size_mb=10)
-        if not size_ok:
-            print(f"[UPLOAD PHOTO] File size validation failed: {size_error}")
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.SIZE_EXCEEDED,
-                message=size_error
-            )
-
         # Validate MIME type (only JPEG, PNG, WebP)
         allowed_mimes = ['image/jpeg', 'image/png', 'image/webp']
         mime_ok, mime_error = validate_mime_type(file.content_type, allowed_types=allowed_mimes)
@@ -164,20 +335,37 @@ async def upload_profile_photo(
                 message=mime_error
             )
 
-        # Calculate checksum for duplicate detection
-        checksum = calc_checksum(file_content)
-        if not checksum:
+        # Fail fast if both photo slots are already taken
+        with timer.stage("slot_check"):
+            _, slot_error = await file_async.find_available_photo_slot(db, profile_id)
+        if slot_error:
             return PhotoUploadResponse(
                 status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Failed to calculate checksum"
+                code=ErrorCodeEnum.NO_FREE_SLOT,
+                message=slot_error
             )
 
+        # Read into memory: size limit (10MB) and SHA256 in one pass (no quarantine write)
+        file_id, quarantine_path = _new_quarantine_path()
+        size_bytes, content, checksum, error_response = await _ingest_upload(file, request, timer, max_size_mb=10)
+        if error_response:
+            print(f"[UPLOAD PHOTO] Ingestion failed: {error_response.message}")
+            return error_response
+
+        # Magic bytes and header dimensions (no pixel decode) before scan/convert
+        content_type, error_response = _validate_upload_header(content, allowed_mimes, timer)
+        if error_response:
+            print(f"[UPLOAD PHOTO] Header validation failed: {error_response.message}")
+            return error_response
+
         # Check for existing duplicate file
-        existing_file = find_dup(db, checksum)
+        with timer.stage("dedup_query"):
+            existing_file = await file_async.find_duplicate_by_checksum(db, checksum, profile_id)
         if existing_file:
             # Return existing file's ID instead of creating duplicate
-            thumbnail_url = f"/files/{existing_file.id}/thumbnail" if existing_file.thumbnail_path else None
+            thumbnail_url = versioned_url(
+                f"/files/{existing_file.id}/thumbnail", existing_file.content_hash or existing_file.checksum
+            ) if existing_file.thumbnail_path else None
             return PhotoUploadResponse(
                 status="success",
                 file_id=existing_file.id,
@@ -186,153 +374,37 @@ async def upload_profile_photo(
                 message="File already exists (duplicate detected)"
             )
 
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
-        
-        # Create directories (ensure they exist)
-        quarantine_dir = QUARANTINE_DIR
-        ensure_directory(str(quarantine_dir))
-        
-        photos_dir = PHOTOS_DIR
-        ensure_directory(str(photos_dir))
-        
-        thumbnails_dir = THUMBNAIL_DIR
-        ensure_directory(str(thumbnails_dir))
-        
-        # Save to quarantine directory first
-        quarantine_path = str(quarantine_dir / f"{file_id}.bin")
-        saved, save_error = save_file_to_disk(file_content, quarantine_path)
-        if not saved:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save file: {save_error}"
-            )
-
-        # Scan for viruses
-        clean, virus_error = scan_file_with_clamav(quarantine_path)
-        if not clean:
-            # Delete quarantined file
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.VIRUS_FOUND,
-                message=virus_error or "Virus detected"
-            )
-
-        # Convert to WebP and preserve EXIF
-        webp_bytes, convert_error = convert_to_webp(file_content, quality=85)
-        if convert_error or not webp_bytes:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to convert to WebP: {convert_error}"
-            )
-
-        # Generate thumbnail
-        thumb_bytes, thumb_error = generate_thumbnail(webp_bytes, size=(150, 150))
-        if thumb_error or not thumb_bytes:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to generate thumbnail: {thumb_error}"
-            )
-
-        # Find available photo slot (1 or 2)
-        slot_num, slot_error = find_available_photo_slot(db, profile_id)
-        if slot_error:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.NO_FREE_SLOT,
-                message=slot_error
-            )
-
-        # Generate filename: {serial_number}_photo_{slot}.webp
-        serial_number = profile.serial_number
-        if not serial_number:
-            serial_number = str(profile.id)
-
-        filename = f"{serial_number}_photo_{slot_num}.webp"
-        storage_path = str(photos_dir / filename)
-        thumbnail_path = str(thumbnails_dir / f"{serial_number}_photo_{slot_num}_thumb.webp")
-
-        # Save WebP file to permanent storage
-        saved, save_error = save_file_to_disk(webp_bytes, storage_path)
-        if not saved:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save WebP file: {save_error}"
-            )
-
-        # Save thumbnail
-        saved, save_error = save_file_to_disk(thumb_bytes, thumbnail_path)
-        if not saved:
-            _, _ = delete_file_from_disk(quarantine_path)
-            _, _ = delete_file_from_disk(storage_path)
+        # Queue scan/convert/thumbnail/slot assignment (bytes in memory or spooled)
+        file_id, queue_error = await _accept_upload(
+            db,
+            timer,
+            file_id=file_id,
+            quarantine_path=quarantine_path,
+            content=content,
+            size_bytes=size_bytes,
+            upload_kind=UploadKindEnum.photo,
+            profile_id=profile_id,
+            original_name=file.filename or "photo.webp",
+            content_type=content_type,
+            final_mime_type="image/webp",
+            checksum=checksum,
+            storage_dir=STORE_DIR
+        )
+        if queue_error:
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save thumbnail: {save_error}"
+                message=queue_error
             )
 
-        # Delete quarantine file (no longer needed)
-        _, _ = delete_file_from_disk(quarantine_path)
-        
-        # Create database file record
-        from app.models.file import File, FileKindEnum as ModelFileKindEnum, ProcessingStatusEnum as ModelStatusEnum
-        
-        try:
-            file_obj = File(
-                id=file_id,
-                original_name=file.filename or "photo.webp",
-                file_kind=ModelFileKindEnum.image,
-                storage_path=storage_path,
-                thumbnail_path=thumbnail_path,
-                mime_type="image/webp",
-                size_bytes=len(webp_bytes),
-                checksum=checksum,
-                processing_status=ModelStatusEnum.ready
-            )
-            db.add(file_obj)
-            db.commit()
-            db.refresh(file_obj)
-        except Exception as e:
-            # Cleanup on DB error
-            _, _ = delete_file_from_disk(storage_path)
-            _, _ = delete_file_from_disk(thumbnail_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to create database record: {str(e)}"
-            )
-        
-        # Assign to family_details photo slot
-        assigned = assign_photo_to_slot(db, profile_id, file_id, slot_num)
-        if not assigned:
-            # Cleanup on assignment error
-            _, _ = delete_file_from_disk(storage_path)
-            _, _ = delete_file_from_disk(thumbnail_path)
-            db.delete(file_obj)
-            db.commit()
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Failed to assign photo slot"
-            )
-        
-        # Success response
-        thumbnail_url = f"/files/{file_id}/thumbnail"
+        # Accepted response (poll status_url until 'ready')
         return PhotoUploadResponse(
             status="success",
             file_id=file_id,
-            thumbnail_url=thumbnail_url,
             profile_id=profile_id,
-            message="Photo uploaded successfully"
+            processing_status=ProcessingStatusEnum.pending.value,
+            status_url=f"/files/{file_id}/status",
+            message="Photo accepted for processing"
         )
     
     except Exception as e:
@@ -341,13 +413,15 @@ async def upload_profile_photo(
             code=ErrorCodeEnum.PROCESSING_ERROR,
             message=f"Unexpected error: {str(e)}"
         )
+    finally:
+        _finish_upload_timing(timer, response, UploadKindEnum.photo)
 
 
 @router.delete("/{file_id}", response_model=FileDeleteResponse)
 async def delete_profile_photo(
     file_id: str,
     profile_id: int = Query(..., description="Profile ID"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete profile photo and unassign from family_details.
@@ -358,10 +432,11 @@ async def delete_profile_photo(
     1. Get file record by ID
     2. Verify file exists
     3. Verify file belongs to profile (optional but recommended)
-    4. Delete physical file from disk
-    5. Delete thumbnail from disk
-    6. Unassign from family_details photo slot
-    7. Delete database file record
+    4. Legacy files: delete physical file and thumbnail from disk
+    5. Unassign from family_details photo slot
+    6. Delete database file record
+    7. Content-store photos: release the blob reference (stored copy is
+       garbage collected once unreferenced, see app/utils/content_store.py)
     8. Return success response
     
     Error Handling:
@@ -373,10 +448,8 @@ async def delete_profile_photo(
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
     try:
-        from app.models.file import File
-        
         # Get file record
-        db_file = db.query(File).filter(File.id == file_id).first()
+        db_file = await file_async.get_file_by_id(db, file_id)
         if not db_file:
             return FileDeleteResponse(
                 status="error",
@@ -384,34 +457,45 @@ async def delete_profile_photo(
                 message=f"File {file_id} not found"
             )
         
-        # Delete physical file from storage
-        if db_file.storage_path and os.path.exists(db_file.storage_path):
-            try:
-                _, _ = delete_file_from_disk(db_file.storage_path)
-            except Exception as e:
-                return FileDeleteResponse(
-                    status="error",
-                    code=ErrorCodeEnum.PROCESSING_ERROR,
-                    message=f"Failed to delete file from disk: {str(e)}"
-                )
-        
-        # Delete thumbnail
-        if db_file.thumbnail_path and os.path.exists(db_file.thumbnail_path):
-            try:
-                _, _ = delete_file_from_disk(db_file.thumbnail_path)
-            except Exception as e:
-                # Non-fatal, continue with deletion
-                print(f"Warning: Failed to delete thumbnail: {e}")
+        # Content-store photos are released after the record is deleted;
+        # legacy per-profile files are deleted from disk here
+        content_hash = db_file.content_hash
+        if not content_hash:
+            # Legacy per-profile files: delete physical file from storage
+            storage = get_storage()
+            if db_file.storage_path:
+                deleted, delete_error = await storage.delete(key_for_path(db_file.storage_path))
+                if not deleted:
+                    return FileDeleteResponse(
+                        status="error",
+                        code=ErrorCodeEnum.PROCESSING_ERROR,
+                        message=f"Failed to delete file from storage: {delete_error}"
+                    )
+            
+            # Delete thumbnail
+            if db_file.thumbnail_path:
+                deleted, delete_error = await storage.delete(key_for_path(db_file.thumbnail_path))
+                if not deleted:
+                    # Non-fatal, continue with deletion
+                    print(f"Warning: Failed to delete thumbnail: {delete_error}")
         
         # Unassign from family_details
-        unassigned = unassign_photo_from_slot(db, file_id)
+        unassigned = await file_async.unassign_photo_from_slot(db, file_id)
         if not unassigned:
             # Still delete the file record even if unassignment failed
             print(f"Warning: Failed to unassign photo slot")
         
         # Delete database record
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
+        invalidate_file_meta(file_id)
+        from app.utils.near_duplicates import near_duplicate_index
+        near_duplicate_index.discard(file_id)
+        
+        # Drop the blob reference; garbage collection removes the stored copy
+        # once no other file uses it
+        if content_hash:
+            await file_async.release_content_blob(db, content_hash)
         
         return FileDeleteResponse(
             status="success",
@@ -429,11 +513,13 @@ async def delete_profile_photo(
 
 # ==================== COMMUNITY CERTIFICATE UPLOAD ====================
 
-@router.post("/upload/comm-cert", response_model=PhotoUploadResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/upload/comm-cert", response_model=PhotoUploadResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_community_certificate(
+    request: Request,
+    response: Response,
     file: UploadFile = FastAPIFile(...),
     profile_id: int = Query(..., description="Profile ID"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Upload community certificate with validation, virus scanning, and PDF conversion.
@@ -441,23 +527,28 @@ async def upload_community_certificate(
     Purpose: Handle community certificate uploads (PDF or image files)
     
     Workflow:
-    1. Validate file size (max 10MB)
-    2. Validate MIME type (PDF, JPEG, PNG, GIF, WebP)
-    3. Calculate SHA256 checksum for duplicate detection
+    1. Validate MIME type (PDF, JPEG, PNG, GIF, WebP)
+    2. Check if certificate already assigned to this profile
+    3. Read into memory in chunks, enforcing the 10MB limit (Content-Length
+       and running byte count) and calculating SHA256 in the same pass
+       Then sniff magic bytes and read dimensions from the header (no decode);
+       reject mislabelled files and images over MAX_IMAGE_PIXELS
     4. Check for existing duplicate file
-    5. Save to quarantine directory
-    6. Scan for viruses with ClamAV
-    7. Convert image to PDF if needed (preserve original if already PDF)
-    8. Validate PDF format
-    9. Check if certificate already assigned to this profile
-    10. Move file to permanent storage
-    11. Create database record
-    12. Auto-assign to family_details.community_file_id
-    13. Return FileUploadResponse with file_id
+    5. Create database record with processing_status 'pending' (bytes stay in
+       memory; spooled to quarantine with a job manifest past the memory budget)
+    6. Queue background processing and return 202 with file_id and status_url
+    
+    Background worker (app/utils/upload_processor.py):
+    - Status 'scanning': scan for viruses with ClamAV
+    - Convert image to PDF if needed (preserve original if already PDF)
+    - Validate PDF format and move file to permanent storage
+    - Auto-assign to family_details.community_file_id
+    - Status 'ready' (or 'rejected' on any failure)
     
     Error Handling:
     - SIZE_EXCEEDED: File > 10MB
     - VIRUS_FOUND: Virus detected during scan
+    - SCAN_TIMEOUT / SCANNING_ERROR: Virus scan could not be completed
     - INVALID_FILE_TYPE: Not PDF or accepted image format
     - DUPLICATE_DETECTED: Identical file already exists
     - COMMUNITY_FILE_EXISTS: Profile already has certificate
@@ -471,12 +562,14 @@ async def upload_community_certificate(
     - PDF validation
     
     Returns:
-    - Success: {status: 'success', file_id, filename, profile_id}
+    - Accepted: {status: 'success', file_id, filename, processing_status: 'pending', status_url, profile_id}
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
+    timer = StageTimer()
     try:
         # Get profile to verify it exists
-        profile, family = get_profile_with_family(db, profile_id)
+        with timer.stage("profile_lookup"):
+            profile, family = await file_async.get_profile_with_family(db, profile_id)
         if not profile:
             return PhotoUploadResponse(
                 status="error",
@@ -484,25 +577,6 @@ async def upload_community_certificate(
                 message=f"Profile {profile_id} not found"
             )
 
-        # Read file content
-        file_content = await file.read()
-        if not file_content:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="File is empty"
-            )
-
-        # Validate file size (10MB max)
-        size_ok, size_error = validate_file_size(file_content, max_size_mb=10)
-        if not size_ok:
-            print(f"[UPLOAD COMMUNITY CERT] File size validation failed: {size_error}")
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.SIZE_EXCEEDED,
-                message="File size exceeds 10MB limit"
-            )
-        print(f"[UPLOAD COMMUNITY CERT] File size validation passed")
         # Validate MIME type (PDF and images)
         allowed_mimes = ['application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/webp']
         mime_ok, mime_error = validate_mime_type(file.content_type, allowed_types=allowed_mimes)
@@ -513,156 +587,77 @@ async def upload_community_certificate(
                 message="File must be PDF or image (JPEG, PNG, GIF, WebP)"
             )
         print(f"[UPLOAD COMMUNITY CERT] MIME type validation passed")
-        # Calculate checksum for duplicate detection
-        checksum = calc_checksum(file_content)
-        if not checksum:
+        # Check if profile already has a community certificate
+        if family and family.community_file_id:
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Failed to calculate checksum"
+                message="Community certificate already uploaded for this profile"
             )
+
+        # Read into memory: size limit (10MB) and SHA256 in one pass (no quarantine write)
+        file_id, quarantine_path = _new_quarantine_path()
+        size_bytes, content, checksum, error_response = await _ingest_upload(file, request, timer, max_size_mb=10)
+        if error_response:
+            print(f"[UPLOAD COMMUNITY CERT] Ingestion failed: {error_response.message}")
+            return error_response
+
+        # Magic bytes and header dimensions (no pixel decode) before scan/convert
+        content_type, error_response = _validate_upload_header(content, allowed_mimes, timer)
+        if error_response:
+            print(f"[UPLOAD COMMUNITY CERT] Header validation failed: {error_response.message}")
+            return error_response
         print(f"[UPLOAD COMMUNITY CERT] Checksum calculated: {checksum}")
         # Check for existing duplicate file
-        existing_file = find_dup(db, checksum)
+        with timer.stage("dedup_query"):
+            existing_file = await file_async.find_duplicate_by_checksum(db, checksum, profile_id)
         print(f"[UPLOAD COMMUNITY CERT] Checking for duplicate files: {existing_file}")
         if existing_file:
-            # Return existing file's ID instead of creating duplicate
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.DUPLICATE_DETECTED,
                 message="This file already exists in the system"
             )
         print(f"[UPLOAD COMMUNITY CERT] No duplicate file found")
-        # Check if profile already has a community certificate
-        if family and family.community_file_id:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Community certificate already uploaded for this profile"
-            )
-
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
-        print(f"[UPLOAD COMMUNITY CERT] Generated file ID: {file_id}")
-        # Create directories
-        quarantine_dir = QUARANTINE_DIR
-        ensure_directory(str(quarantine_dir))
-        
-        community_dir = COMMUNITY_DIR
-        ensure_directory(str(community_dir))
-        
-        # Save to quarantine directory first
-        quarantine_path = str(quarantine_dir / f"{file_id}.bin")
-        saved, save_error = save_file_to_disk(file_content, quarantine_path)
-        if not saved:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save file: {save_error}"
-            )
 
-        # Scan for viruses
-        clean, virus_error = scan_file_with_clamav(quarantine_path)
-        if not clean:
-            # Delete quarantined file
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.VIRUS_FOUND,
-                message="File failed virus scan"
-            )
-
-        # Convert to PDF if image
-        pdf_bytes = file_content
+        # Images are converted to PDF by the background worker
         final_filename = file.filename or "community_certificate.pdf"
-        final_mime_type = file.content_type
-        print(f"[UPLOAD COMMUNITY CERT] File MIME type: {file.content_type}")
-        if file.content_type and file.content_type.startswith('image/'):
-            # Convert image to PDF
-            pdf_bytes, convert_error = image_to_pdf(file_content, file.content_type)
-            if convert_error or not pdf_bytes:
-                _, _ = delete_file_from_disk(quarantine_path)
-                return PhotoUploadResponse(
-                    status="error",
-                    code=ErrorCodeEnum.PROCESSING_ERROR,
-                    message=f"Failed to convert image to PDF: {convert_error}"
-                )
+        if content_type.startswith('image/'):
             final_filename = f"{Path(final_filename).stem}.pdf"
-            final_mime_type = "application/pdf"
-        print(f"[UPLOAD COMMUNITY CERT] Converted to PDF if needed")
-        # Validate PDF format
-        pdf_valid, pdf_error = validate_pdf_file(pdf_bytes)
-        if not pdf_valid:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"PDF validation failed: {pdf_error}"
-            )
-        print(f"[UPLOAD COMMUNITY CERT] PDF validation passed")
-        # Generate filename: {profile_id}_community_certificate.pdf
-        filename = f"{profile_id}_community_certificate.pdf"
-        storage_path = str(community_dir / filename)
-        print(f"[UPLOAD COMMUNITY CERT] Final filename: {filename}")
-        # Save PDF to permanent storage
-        saved, save_error = save_file_to_disk(pdf_bytes, storage_path)
-        if not saved:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save PDF file: {save_error}"
-            )
-        print(f"[UPLOAD COMMUNITY CERT] Saved PDF to permanent storage")
-        # Delete quarantine file (no longer needed)
-        _, _ = delete_file_from_disk(quarantine_path)
-        
-        # Create database file record
-        from app.models.file import File, FileKindEnum as ModelFileKindEnum, ProcessingStatusEnum as ModelStatusEnum
-        
-        try:
-            file_obj = File(
-                id=file_id,
-                original_name=final_filename,
-                file_kind=ModelFileKindEnum.pdf,
-                storage_path=storage_path,
-                mime_type=final_mime_type,
-                size_bytes=len(pdf_bytes),
-                checksum=checksum,
-                processing_status=ModelStatusEnum.ready
-            )
-            db.add(file_obj)
-            db.commit()
-            db.refresh(file_obj)
-        except Exception as e:
-            # Cleanup on DB error
-            _, _ = delete_file_from_disk(storage_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to create database record: {str(e)}"
-            )
-        print(f"[UPLOAD COMMUNITY CERT] Created database record")
-        # Assign to family_details.community_file_id
-        assigned, error_msg = assign_community_cert_to_family(db, profile_id, file_id)
-        if not assigned:
-            # Cleanup on assignment error
-            _, _ = delete_file_from_disk(storage_path)
-            db.delete(file_obj)
-            db.commit()
+
+        # Queue scan/convert/assignment (bytes in memory or spooled)
+        file_id, queue_error = await _accept_upload(
+            db,
+            timer,
+            file_id=file_id,
+            quarantine_path=quarantine_path,
+            content=content,
+            size_bytes=size_bytes,
+            upload_kind=UploadKindEnum.community_certificate,
+            profile_id=profile_id,
+            original_name=final_filename,
+            content_type=content_type,
+            final_mime_type="application/pdf",
+            checksum=checksum,
+            storage_dir=COMMUNITY_DIR,
+            thumbnail_dir=THUMBNAIL_DIR
+        )
+        if queue_error:
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=error_msg or "Failed to assign community certificate"
+                message=queue_error
             )
-        print(f"[UPLOAD COMMUNITY CERT] Assigned community certificate to profile")
-        # Success response
+        print(f"[UPLOAD COMMUNITY CERT] Queued file ID: {file_id}")
+        # Accepted response (poll status_url until 'ready')
         return PhotoUploadResponse(
             status="success",
             file_id=file_id,
             filename=final_filename,
             profile_id=profile_id,
-            message="Community certificate uploaded successfully"
+            processing_status=ProcessingStatusEnum.pending.value,
+            status_url=f"/files/{file_id}/status",
+            message="Community certificate accepted for processing"
         )
     
     except Exception as e:
@@ -671,13 +666,15 @@ async def upload_community_certificate(
             code=ErrorCodeEnum.PROCESSING_ERROR,
             message=f"Unexpected error: {str(e)}"
         )
+    finally:
+        _finish_upload_timing(timer, response, UploadKindEnum.community_certificate)
 
 
 @router.delete("/delete/comm-cert/{file_id}", response_model=FileDeleteResponse)
 async def delete_community_certificate(
     file_id: str,
     profile_id: int = Query(..., description="Profile ID"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete community certificate and auto-unlink from family_details.
@@ -701,10 +698,8 @@ async def delete_community_certificate(
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
     try:
-        from app.models.file import File
-        
         # Get file record
-        db_file = db.query(File).filter(File.id == file_id).first()
+        db_file = await file_async.get_file_by_id(db, file_id)
         if not db_file:
             return FileDeleteResponse(
                 status="error",
@@ -713,25 +708,30 @@ async def delete_community_certificate(
             )
         
         # Delete physical file from storage
-        if db_file.storage_path and os.path.exists(db_file.storage_path):
-            try:
-                _, _ = delete_file_from_disk(db_file.storage_path)
-            except Exception as e:
+        storage = get_storage()
+        if db_file.storage_path:
+            deleted, delete_error = await storage.delete(key_for_path(db_file.storage_path))
+            if not deleted:
                 return FileDeleteResponse(
                     status="error",
                     code=ErrorCodeEnum.PROCESSING_ERROR,
-                    message=f"Failed to delete file from disk: {str(e)}"
+                    message=f"Failed to delete file from storage: {delete_error}"
                 )
         
+        # Delete first-page preview
+        if db_file.thumbnail_path:
+            _, _ = await storage.delete(key_for_path(db_file.thumbnail_path))
+        
         # Auto-unlink from family_details
-        unlinked = unassign_community_cert_from_family(db, file_id)
+        unlinked = await file_async.unassign_community_cert_from_family(db, file_id)
         if not unlinked:
             # Still delete the file record even if unlinking failed
             print(f"Warning: Failed to unlink community certificate from family")
         
         # Delete database record
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
+        invalidate_file_meta(file_id)
         
         return FileDeleteResponse(
             status="success",
@@ -748,14 +748,18 @@ async def delete_community_certificate(
 
 
 @router.get("/{file_id}/comm-cert")
-def get_community_certificate(file_id: str, db: Session = Depends(get_db)):
+async def get_community_certificate(file_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Get community certificate file
     
     Purpose: Retrieve and serve community certificate
     
     Returns the certificate file (PDF) for download/preview.
-    Backend returns FileResponse with certificate file from disk.
+    Backend returns the file from disk (or X-Accel-Redirect to nginx when
+    FILE_SERVE_MODE=x-accel) with a strong ETag; If-None-Match -> 304.
+    Range requests are supported (206 Partial Content, If-Range against the
+    ETag), so interrupted downloads resume; PDFs are stored linearized when
+    pikepdf is installed, so viewers can show page one early.
     
     Response Type:
     - Media Type: application/pdf
@@ -764,69 +768,236 @@ def get_community_certificate(file_id: str, db: Session = Depends(get_db)):
     Error Handling:
     - 404 File not found: Invalid file_id
     - 404 Certificate not available: File exists but not a certificate
-    - 404 Certificate not found on disk: File missing from storage
+    - 404 File not found on disk: File missing from storage
     
     Use Cases:
     - Download community certificate
     - View/preview certificate
     - Verify certificate
     """
-    from fastapi.responses import FileResponse
+    file_meta = await file_async.get_file_meta(db, file_id)
+    
+    if file_meta is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Pending uploads still point at unscanned bytes in quarantine
+    if not file_meta.storage_path or file_meta.processing_status != ModelStatusEnum.ready:
+        raise HTTPException(status_code=404, detail="Certificate not available")
+    
+    return serve_file(
+        request,
+        path=file_meta.storage_path,
+        media_type="application/pdf",
+        checksum=file_meta.checksum,
+        private=True
+    )
+
+@router.get("/{file_id}/status", response_model=FileStatusResponse)
+def get_upload_status(file_id: str, http_response: Response, db: Session = Depends(get_db)):
+    """
+    Get processing status of an uploaded file
+    
+    Purpose: Poll an upload accepted with 202 until it is processed
+    
+    Status values:
+    - pending: Accepted (held in memory or quarantine), waiting for a worker
+    - scanning: Virus scan / conversion in progress
+    - ready: Processed and assigned (thumbnail_url set for photos)
+    - rejected: Failed scan or processing (code/message when known)
     
+    With UPLOAD_TIMING_HEADER=true, a Server-Timing header carries the
+    worker's per-stage breakdown once processing has finished (only on the
+    process that handled the job).
+    
+    Error Handling:
+    - 404 File not found: Invalid file_id
+    """
     db_file = get_file_by_id(db, file_id)
     
     if db_file is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    if not db_file.storage_path:
-        raise HTTPException(status_code=404, detail="Certificate not available")
+    processing_status = getattr(db_file.processing_status, "value", db_file.processing_status)
+    response = FileStatusResponse(file_id=file_id, processing_status=processing_status)
+    
+    if processing_status == ProcessingStatusEnum.ready.value and db_file.thumbnail_path:
+        response.thumbnail_url = versioned_url(f"/files/{file_id}/thumbnail", db_file.content_hash or db_file.checksum)
+    elif processing_status == ProcessingStatusEnum.rejected.value:
+        # Reason recorded by the upload worker (files rejected elsewhere have none)
+        if db_file.rejection_code:
+            response.code = ErrorCodeEnum(db_file.rejection_code)
+            response.message = db_file.rejection_message
+    
+    if UPLOAD_TIMING_HEADER:
+        breakdown = upload_timings.get_breakdown(file_id)
+        if breakdown:
+            http_response.headers["Server-Timing"] = server_timing_header(breakdown)
+    
+    return response
+
+
+@router.post("/thumbnails/batch", response_model=ThumbnailBatchResponse)
+async def get_thumbnails_batch(
+    batch: ThumbnailBatchRequest,
+    format: str = Query("json", pattern="^(json|multipart)$", description="json (base64 map) or multipart"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get many thumbnails in one response
+    
+    Purpose: Load all thumbnails of a recommendation grid with one request
+    instead of one GET /files/{id}/thumbnail per card
     
-    if not os.path.exists(db_file.storage_path):
-        raise HTTPException(status_code=404, detail="Certificate file not found on disk")
+    Request Body:
+    - file_ids: Up to 100 file IDs
     
-    return FileResponse(
-        path=db_file.storage_path,
-        media_type="application/pdf"
+    Response:
+    - format=json: {thumbnails: {file_id: {mime_type, etag, data (base64 WebP)}}, missing: [file_id]}
+    - format=multipart: multipart/mixed, one image/webp part per thumbnail
+      (Content-ID: <file_id>, ETag)
+    
+    Metadata comes from the file metadata cache, with a single IN (...)
+    query for misses; files that are unknown, not ready or missing on disk
+    are listed in 'missing' (JSON) or omitted.
+    """
+    file_ids = list(dict.fromkeys(batch.file_ids))
+    file_metas = [
+        file_meta for file_meta in (await file_async.get_file_metas(db, file_ids)).values()
+        if file_meta.thumbnail_path and file_meta.processing_status == ModelStatusEnum.ready
+    ]
+    
+    # One storage call for all thumbnails (a single worker thread on local disk)
+    keys = {file_meta.id: key_for_path(file_meta.thumbnail_path) for file_meta in file_metas}
+    stored = await get_storage().get_many(keys.values())
+    contents = {file_id: stored[key] for file_id, key in keys.items() if key in stored}
+    etags = {
+        file_meta.id: make_etag(file_meta.content_hash or file_meta.checksum, "thumb")
+        for file_meta in file_metas
+    }
+    
+    if format == "multipart":
+        return multipart_mixed_response([
+            (file_id, "image/webp", etags.get(file_id), contents[file_id])
+            for file_id in file_ids if file_id in contents
+        ])
+    
+    return ThumbnailBatchResponse(
+        thumbnails={
+            file_id: ThumbnailPayload(
+                etag=etags.get(file_id),
+                data=base64.b64encode(contents[file_id]).decode("ascii")
+            )
+            for file_id in file_ids if file_id in contents
+        },
+        missing=[file_id for file_id in file_ids if file_id not in contents]
     )
 
+
 @router.get("/{file_id}/thumbnail")
-def get_thumbnail(file_id: str, db: Session = Depends(get_db)):
+async def get_thumbnail(file_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Get file thumbnail
     
     Purpose: Serve thumbnail for image preview
     
+    Caching:
+    - Strong ETag from the content hash; If-None-Match -> 304
+    - Cache-Control immutable when requested with ?v=<hash prefix> (as in status thumbnail_url)
+    - FILE_SERVE_MODE=x-accel: bytes are sent by nginx via X-Accel-Redirect
+    
     Use Cases:
     - Gallery thumbnails
     - Profile photo preview
-    - PDF first page preview
-    """
-    from fastapi.responses import FileResponse
+    - PDF first page preview (certificates/horoscopes, generated by the upload worker)
     
-    db_file = get_file_by_id(db, file_id)
+    Metadata of ready files is cached in memory (app/crud/file.py), so
+    repeat hits need no database access.
+    """
+    file_meta = await file_async.get_file_meta(db, file_id)
     
-    if db_file is None:
+    if file_meta is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    if not db_file.thumbnail_path:
+    if not file_meta.thumbnail_path:
         raise HTTPException(status_code=404, detail="Thumbnail not available")
     
-    if not os.path.exists(db_file.thumbnail_path):
-        raise HTTPException(status_code=404, detail="Thumbnail not found on disk")
+    return serve_file(
+        request,
+        path=file_meta.thumbnail_path,
+        media_type="image/webp",
+        checksum=file_meta.content_hash or file_meta.checksum,
+        variant="thumb",
+        # Certificate/horoscope previews are never publicly cacheable
+        private=file_meta.file_kind == FileKindEnum.pdf
+    )
+
+
+@router.get("/{file_id}/image")
+async def get_image(
+    file_id: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096, description="Display width in pixels"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get photo resized to the nearest standard width
+    
+    Purpose: Serve responsive photo sizes so cards don't download full-size images
     
-    return FileResponse(
-        path=db_file.thumbnail_path,
-        media_type="image/webp"
+    Sizes:
+    - w is rounded up to the next PHOTO_DERIVATIVE_WIDTHS entry (default 150/320/640/1280)
+    - Original WebP when w is omitted or not smaller than the original
+    
+    Sizes are generated on first request and kept in a size-capped disk
+    cache (app/utils/derivative_cache.py); a burst of identical requests
+    triggers a single resize.
+    
+    Caching: strong ETag per size, 304 on If-None-Match, immutable with ?v=<hash prefix>
+    
+    Example:
+    - <img src="/files/{id}/image?w=320" srcset="/files/{id}/image?w=640 2x">
+    """
+    file_meta = await file_async.get_file_meta(db, file_id)
+    
+    if file_meta is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if file_meta.file_kind != FileKindEnum.image or file_meta.processing_status != ModelStatusEnum.ready:
+        raise HTTPException(status_code=404, detail="Image not available")
+    
+    path = file_meta.storage_path
+    if not path:
+        raise HTTPException(status_code=404, detail="Image not found on disk")
+    
+    variant = ""
+    width = nearest_derivative_width(PHOTO_DERIVATIVE_WIDTHS, w)
+    if width and (not file_meta.width or width < file_meta.width):
+        if width in file_meta.derivative_widths:
+            # Generated at upload time (older uploads)
+            path, variant = derivative_path_for(path, width), f"w{width}"
+        else:
+            cached_path = await derivative_cache.get_or_create(file_meta.content_hash or file_meta.id, width, path)
+            if cached_path:
+                path, variant = cached_path, f"w{width}"
+    
+    return serve_file(
+        request,
+        path=path,
+        media_type="image/webp",
+        checksum=file_meta.content_hash or file_meta.checksum,
+        variant=variant
     )
 
 
 # ==================== HOROSCOPE FILE UPLOAD ====================
 
-@router.post("/upload/horoscope", response_model=PhotoUploadResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/upload/horoscope", response_model=PhotoUploadResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_horoscope(
+    request: Request,
+    response: Response,
     file: UploadFile = FastAPIFile(...),
     profile_id: int = Query(..., description="Profile ID"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Upload horoscope file with validation, virus scanning, and PDF conversion.
@@ -834,23 +1005,28 @@ async def upload_horoscope(
     Purpose: Handle horoscope uploads (PDF or image files)
     
     Workflow:
-    1. Validate file size (max 10MB)
-    2. Validate MIME type (PDF, JPEG, PNG, GIF, WebP)
-    3. Calculate SHA256 checksum for duplicate detection
+    1. Validate MIME type (PDF, JPEG, PNG, GIF, WebP)
+    2. Check if horoscope already assigned to this profile
+    3. Read into memory in chunks, enforcing the 10MB limit (Content-Length
+       and running byte count) and calculating SHA256 in the same pass
+       Then sniff magic bytes and read dimensions from the header (no decode);
+       reject mislabelled files and images over MAX_IMAGE_PIXELS
     4. Check for existing duplicate file
-    5. Save to quarantine directory
-    6. Scan for viruses with ClamAV
-    7. Convert image to PDF if needed (preserve original if already PDF)
-    8. Validate PDF format
-    9. Check if horoscope already assigned to this profile
-    10. Move file to permanent storage
-    11. Create database record
-    12. Auto-assign to astrology_details.file_id
-    13. Return FileUploadResponse with file_id
+    5. Create database record with processing_status 'pending' (bytes stay in
+       memory; spooled to quarantine with a job manifest past the memory budget)
+    6. Queue background processing and return 202 with file_id and status_url
+    
+    Background worker (app/utils/upload_processor.py):
+    - Status 'scanning': scan for viruses with ClamAV
+    - Convert image to PDF if needed (preserve original if already PDF)
+    - Validate PDF format and move file to permanent storage
+    - Auto-assign to astrology_details.file_id
+    - Status 'ready' (or 'rejected' on any failure)
     
     Error Handling:
     - SIZE_EXCEEDED: File > 10MB
     - VIRUS_FOUND: Virus detected during scan
+    - SCAN_TIMEOUT / SCANNING_ERROR: Virus scan could not be completed
     - INVALID_FILE_TYPE: Not PDF or accepted image format
     - DUPLICATE_DETECTED: Identical file already exists
     - PROCESSING_ERROR: Conversion, storage, or DB error
@@ -863,12 +1039,14 @@ async def upload_horoscope(
     - PDF validation
     
     Returns:
-    - Success: {status: 'success', file_id, filename, profile_id}
+    - Accepted: {status: 'success', file_id, filename, processing_status: 'pending', status_url, profile_id}
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
+    timer = StageTimer()
     try:
         # Get profile to verify it exists and get serial number
-        profile, family = get_profile_with_family(db, profile_id)
+        with timer.stage("profile_lookup"):
+            profile, family = await file_async.get_profile_with_family(db, profile_id)
         if not profile:
             return PhotoUploadResponse(
                 status="error",
@@ -876,26 +1054,6 @@ async def upload_horoscope(
                 message=f"Profile {profile_id} not found"
             )
 
-        # Read file content
-        file_content = await file.read()
-        if not file_content:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="File is empty"
-            )
-
-        # Validate file size (10MB max)
-        size_ok, size_error = validate_file_size(file_content, max_size_mb=10)
-        if not size_ok:
-            print(f"[UPLOAD HOROSCOPE] File size validation failed: {size_error}")
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.SIZE_EXCEEDED,
-                message="File size exceeds 10MB limit"
-            )
-        print(f"[UPLOAD HOROSCOPE] File size validation passed")
-
         # Validate MIME type (PDF and images)
         allowed_mimes = ['application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/webp']
         mime_ok, mime_error = validate_mime_type(file.content_type, allowed_types=allowed_mimes)
@@ -907,18 +1065,31 @@ async def upload_horoscope(
             )
         print(f"[UPLOAD HOROSCOPE] MIME type validation passed")
 
-        # Calculate checksum for duplicate detection
-        checksum = calc_checksum(file_content)
-        if not checksum:
+        # Check if profile already has a horoscope file
+        if await file_async.get_astrology_file_id(db, profile_id):
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Failed to calculate checksum"
+                message="Horoscope file already uploaded for this profile"
             )
+
+        # Read into memory: size limit (10MB) and SHA256 in one pass (no quarantine write)
+        file_id, quarantine_path = _new_quarantine_path()
+        size_bytes, content, checksum, error_response = await _ingest_upload(file, request, timer, max_size_mb=10)
+        if error_response:
+            print(f"[UPLOAD HOROSCOPE] Ingestion failed: {error_response.message}")
+            return error_response
+
+        # Magic bytes and header dimensions (no pixel decode) before scan/convert
+        content_type, error_response = _validate_upload_header(content, allowed_mimes, timer)
+        if error_response:
+            print(f"[UPLOAD HOROSCOPE] Header validation failed: {error_response.message}")
+            return error_response
         print(f"[UPLOAD HOROSCOPE] Checksum calculated: {checksum}")
 
         # Check for existing duplicate file
-        existing_file = find_dup(db, checksum)
+        with timer.stage("dedup_query"):
+            existing_file = await file_async.find_duplicate_by_checksum(db, checksum, profile_id)
         print(f"[UPLOAD HOROSCOPE] Checking for duplicate files: {existing_file}")
         if existing_file:
             # Return existing file error instead of creating duplicate
@@ -929,163 +1100,45 @@ async def upload_horoscope(
             )
         print(f"[UPLOAD HOROSCOPE] No duplicate file found")
 
-        # Check if profile already has a horoscope file
-        from app.models.astrology import AstrologyDetails
-        existing_astrology = db.query(AstrologyDetails).filter(AstrologyDetails.profile_id == profile_id).first()
-        if existing_astrology and existing_astrology.file_id:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message="Horoscope file already uploaded for this profile"
-            )
-
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
-        print(f"[UPLOAD HOROSCOPE] Generated file ID: {file_id}")
-
-        # Create directories
-        quarantine_dir = QUARANTINE_DIR
-        ensure_directory(str(quarantine_dir))
-        
-        # Create horoscope directory if not exists
-        horoscope_dir = BASE_UPLOAD_DIR / "horoscope"
-        horoscope_dir.mkdir(parents=True, exist_ok=True)
-        ensure_directory(str(horoscope_dir))
-        
-        # Save to quarantine directory first
-        quarantine_path = str(quarantine_dir / f"{file_id}.bin")
-        saved, save_error = save_file_to_disk(file_content, quarantine_path)
-        if not saved:
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save file: {save_error}"
-            )
-
-        # Scan for viruses
-        clean, virus_error = scan_file_with_clamav(quarantine_path)
-        if not clean:
-            # Delete quarantined file
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.VIRUS_FOUND,
-                message="File failed virus scan"
-            )
-
-        # Convert to PDF if image
-        pdf_bytes = file_content
+        # Images are converted to PDF by the background worker
         final_filename = file.filename or "horoscope.pdf"
-        final_mime_type = file.content_type
-        print(f"[UPLOAD HOROSCOPE] File MIME type: {file.content_type}")
-
-        if file.content_type and file.content_type.startswith('image/'):
-            # Convert image to PDF
-            pdf_bytes, convert_error = image_to_pdf(file_content, file.content_type)
-            if convert_error or not pdf_bytes:
-                _, _ = delete_file_from_disk(quarantine_path)
-                return PhotoUploadResponse(
-                    status="error",
-                    code=ErrorCodeEnum.PROCESSING_ERROR,
-                    message=f"Failed to convert image to PDF: {convert_error}"
-                )
+        if content_type.startswith('image/'):
             final_filename = f"{Path(final_filename).stem}.pdf"
-            final_mime_type = "application/pdf"
-        print(f"[UPLOAD HOROSCOPE] Converted to PDF if needed")
-
-        # Validate PDF format
-        pdf_valid, pdf_error = validate_pdf_file(pdf_bytes)
-        if not pdf_valid:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"PDF validation failed: {pdf_error}"
-            )
-        print(f"[UPLOAD HOROSCOPE] PDF validation passed")
-
-        # Generate filename: {serial_number}_horoscope.pdf
-        serial_number = profile.serial_number
-        if not serial_number:
-            serial_number = str(profile.id)
-        
-        filename = f"{serial_number}_horoscope.pdf"
-        storage_path = str(horoscope_dir / filename)
-        print(f"[UPLOAD HOROSCOPE] Final filename: {filename}")
-
-        # Save PDF to permanent storage
-        saved, save_error = save_file_to_disk(pdf_bytes, storage_path)
-        if not saved:
-            _, _ = delete_file_from_disk(quarantine_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to save PDF file: {save_error}"
-            )
-        print(f"[UPLOAD HOROSCOPE] Saved PDF to permanent storage")
-
-        # Delete quarantine file (no longer needed)
-        _, _ = delete_file_from_disk(quarantine_path)
-        
-        # Create database file record
-        from app.models.file import File, FileKindEnum as ModelFileKindEnum, ProcessingStatusEnum as ModelStatusEnum
-        
-        try:
-            file_obj = File(
-                id=file_id,
-                original_name=final_filename,
-                file_kind=ModelFileKindEnum.pdf,
-                storage_path=storage_path,
-                mime_type=final_mime_type,
-                size_bytes=len(pdf_bytes),
-                checksum=checksum,
-                processing_status=ModelStatusEnum.ready
-            )
-            db.add(file_obj)
-            db.commit()
-            db.refresh(file_obj)
-        except Exception as e:
-            # Cleanup on DB error
-            _, _ = delete_file_from_disk(storage_path)
-            return PhotoUploadResponse(
-                status="error",
-                code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to create database record: {str(e)}"
-            )
-        print(f"[UPLOAD HOROSCOPE] Created database record")
 
-        # Assign to astrology_details.file_id
-        try:
-            if existing_astrology:
-                # Update existing astrology record
-                existing_astrology.file_id = file_id
-            else:
-                # Create new astrology record if not exists
-                astrology = AstrologyDetails(
-                    profile_id=profile_id,
-                    file_id=file_id
-                )
-                db.add(astrology)
-            db.commit()
-        except Exception as e:
-            # Cleanup on assignment error
-            _, _ = delete_file_from_disk(storage_path)
-            db.delete(file_obj)
-            db.commit()
+        # Queue scan/convert/assignment (bytes in memory or spooled)
+        file_id, queue_error = await _accept_upload(
+            db,
+            timer,
+            file_id=file_id,
+            quarantine_path=quarantine_path,
+            content=content,
+            size_bytes=size_bytes,
+            upload_kind=UploadKindEnum.horoscope,
+            profile_id=profile_id,
+            original_name=final_filename,
+            content_type=content_type,
+            final_mime_type="application/pdf",
+            checksum=checksum,
+            storage_dir=HOROSCOPE_DIR,
+            thumbnail_dir=THUMBNAIL_DIR
+        )
+        if queue_error:
             return PhotoUploadResponse(
                 status="error",
                 code=ErrorCodeEnum.PROCESSING_ERROR,
-                message=f"Failed to assign horoscope file: {str(e)}"
+                message=queue_error
             )
-        print(f"[UPLOAD HOROSCOPE] Assigned horoscope file to profile")
+        print(f"[UPLOAD HOROSCOPE] Queued file ID: {file_id}")
 
-        # Success response
+        # Accepted response (poll status_url until 'ready')
         return PhotoUploadResponse(
             status="success",
             file_id=file_id,
             filename=final_filename,
             profile_id=profile_id,
-            message="Horoscope file uploaded successfully"
+            processing_status=ProcessingStatusEnum.pending.value,
+            status_url=f"/files/{file_id}/status",
+            message="Horoscope file accepted for processing"
         )
     
     except Exception as e:
@@ -1094,12 +1147,14 @@ async def upload_horoscope(
             code=ErrorCodeEnum.PROCESSING_ERROR,
             message=f"Unexpected error: {str(e)}"
         )
+    finally:
+        _finish_upload_timing(timer, response, UploadKindEnum.horoscope)
 
 
 @router.delete("/delete/horoscope/{file_id}", response_model=FileDeleteResponse)
 async def delete_horoscope(
     file_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete horoscope file and auto-unlink from astrology_details.
@@ -1123,11 +1178,8 @@ async def delete_horoscope(
     - Error: {status: 'error', code: ErrorCodeEnum, message: str}
     """
     try:
-        from app.models.file import File
-        from app.models.astrology import AstrologyDetails
-        
         # Get file record
-        db_file = db.query(File).filter(File.id == file_id).first()
+        db_file = await file_async.get_file_by_id(db, file_id)
         if not db_file:
             return FileDeleteResponse(
                 status="error",
@@ -1136,29 +1188,31 @@ async def delete_horoscope(
             )
         
         # Delete physical file from storage
-        if db_file.storage_path and os.path.exists(db_file.storage_path):
-            try:
-                _, _ = delete_file_from_disk(db_file.storage_path)
-            except Exception as e:
+        storage = get_storage()
+        if db_file.storage_path:
+            deleted, delete_error = await storage.delete(key_for_path(db_file.storage_path))
+            if not deleted:
                 return FileDeleteResponse(
                     status="error",
                     code=ErrorCodeEnum.PROCESSING_ERROR,
-                    message=f"Failed to delete file from disk: {str(e)}"
+                    message=f"Failed to delete file from storage: {delete_error}"
                 )
         
+        # Delete first-page preview
+        if db_file.thumbnail_path:
+            _, _ = await storage.delete(key_for_path(db_file.thumbnail_path))
+        
         # Auto-unlink from astrology_details
         try:
-            astrology_record = db.query(AstrologyDetails).filter(AstrologyDetails.file_id == file_id).first()
-            if astrology_record:
-                astrology_record.file_id = None
-                db.commit()
+            await file_async.unassign_horoscope_from_astrology(db, file_id)
         except Exception as e:
             # Still delete the file record even if unlinking failed
             print(f"Warning: Failed to unlink horoscope from astrology: {e}")
         
         # Delete database record
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
+        invalidate_file_meta(file_id)
         
         return FileDeleteResponse(
             status="success",
@@ -1175,14 +1229,18 @@ async def delete_horoscope(
 
 
 @router.get("/{file_id}/horoscope")
-def get_horoscope(file_id: str, db: Session = Depends(get_db)):
+async def get_horoscope(file_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Get horoscope file
     
     Purpose: Retrieve and serve horoscope file
     
     Returns the horoscope file (PDF) for download/preview.
-    Backend returns FileResponse with horoscope file from disk.
+    Backend returns the file from disk (or X-Accel-Redirect to nginx when
+    FILE_SERVE_MODE=x-accel) with a strong ETag; If-None-Match -> 304.
+    Range requests are supported (206 Partial Content, If-Range against the
+    ETag), so interrupted downloads resume; PDFs are stored linearized when
+    pikepdf is installed, so viewers can show page one early.
     
     Response Type:
     - Media Type: application/pdf
@@ -1191,29 +1249,28 @@ def get_horoscope(file_id: str, db: Session = Depends(get_db)):
     Error Handling:
     - 404 File not found: Invalid file_id
     - 404 Horoscope not available: File exists but not a horoscope
-    - 404 Horoscope not found on disk: File missing from storage
+    - 404 File not found on disk: File missing from storage
     
     Use Cases:
     - Download horoscope file
     - View/preview horoscope
     - Verify horoscope
     """
-    from fastapi.responses import FileResponse
+    file_meta = await file_async.get_file_meta(db, file_id)
     
-    db_file = get_file_by_id(db, file_id)
-    
-    if db_file is None:
+    if file_meta is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    if not db_file.storage_path:
+    # Pending uploads still point at unscanned bytes in quarantine
+    if not file_meta.storage_path or file_meta.processing_status != ModelStatusEnum.ready:
         raise HTTPException(status_code=404, detail="Horoscope not available")
     
-    if not os.path.exists(db_file.storage_path):
-        raise HTTPException(status_code=404, detail="Horoscope file not found on disk")
-    
-    return FileResponse(
-        path=db_file.storage_path,
-        media_type="application/pdf"
+    return serve_file(
+        request,
+        path=file_meta.storage_path,
+        media_type="application/pdf",
+        checksum=file_meta.checksum,
+        private=True
     )
 
 
@@ -1232,6 +1289,8 @@ def get_statistics(db: Session = Depends(get_db)):
     - Files by kind
     - Files by status
     - Pending/rejected counts
+    
+    Served from the file_stats aggregate table (constant cost).
     """
     stats = get_file_statistics(db)
     
@@ -1245,3 +1304,126 @@ def get_statistics(db: Session = Depends(get_db)):
         rejected_files=stats["rejected_files"]
     )
 
+
+@router.post("/admin/statistics/rebuild")
+def rebuild_statistics(apply: bool = Query(True, description="Replace file_stats (false: verify only)"), db: Session = Depends(get_db)):
+    """
+    Recompute file statistics from the files table
+    
+    Purpose: Verify (and repair) the file_stats aggregate behind /files/admin/statistics
+    
+    One GROUP BY file_kind, processing_status WITH ROLLUP pass over files.
+    
+    Returns:
+    - drift: Kind/status pairs where file_stats differed from files
+    - total_files / total_size_bytes: Grand totals from the ROLLUP row
+    - applied: Whether file_stats was replaced
+    """
+    return rebuild_file_stats(db, apply=apply)
+
+
+@router.get("/admin/image-pool")
+def get_image_pool_metrics():
+    """
+    Get image processing pool metrics
+
+    Purpose: Monitor Pillow work offloaded from upload routes
+
+    Returns:
+    - queue_depth: Tasks waiting for a worker
+    - in_flight: Tasks submitted to the pool
+    - tasks: Per-task count, failures and avg/max/last timings (ms)
+    """
+    return image_processor.metrics()
+
+
+@router.get("/admin/derivative-cache")
+def get_derivative_cache_metrics():
+    """
+    Get on-demand derivative cache metrics
+
+    Purpose: Monitor disk usage and hit rate of resized photos
+
+    Returns:
+    - entries / bytes / max_bytes: Cached files and size cap (DERIVATIVE_CACHE_MAX_MB)
+    - in_flight: Resizes currently running
+    - hits / misses / evictions: Counters since startup (this worker)
+    """
+    return derivative_cache.metrics()
+
+
+@router.get("/admin/file-meta-cache")
+def get_file_meta_cache_metrics():
+    """
+    Get file metadata cache metrics
+
+    Purpose: Monitor the in-memory cache used by the file-serving routes
+
+    Returns:
+    - entries / max_entries: Cached ready files and cap (FILE_META_CACHE_SIZE)
+    - ttl_seconds: Entry lifetime (FILE_META_CACHE_TTL)
+    - hits / misses: Counters since startup (this worker)
+    """
+    return get_file_meta_cache_stats()
+
+
+@router.get("/admin/near-duplicates")
+def get_near_duplicate_photos(
+    max_distance: int = Query(6, ge=0, le=16, description="Maximum Hamming distance between dHashes"),
+    limit: int = Query(200, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """
+    List near-duplicate photo pairs
+
+    Purpose: Moderation - find the same photo (resized, re-compressed, lightly
+    edited) uploaded by different profiles
+
+    Returns:
+    - pairs: file_id / other_file_id, Hamming distance, owning profile IDs and
+      same_profile (pairs within one profile are usually harmless)
+    - index: Size and age of this worker's BK-tree index
+    """
+    from app.utils.near_duplicates import near_duplicate_index
+
+    pairs = near_duplicate_index.report(db, max_distance=max_distance, limit=limit)
+    return {"pairs": pairs, "index": near_duplicate_index.metrics()}
+
+
+@router.get("/admin/upload-timings")
+def get_upload_timing_metrics(format: str = Query("json", pattern="^(json|prometheus)$")):
+    """
+    Get per-stage upload timing histograms
+
+    Purpose: Find the dominant upload stage (ClamAV scan, WebP encode, disk I/O, DB)
+
+    Series (this worker process, since startup):
+    - request.<kind>: Route stages (profile_lookup, slot_check, ingest,
+      header_validation, dedup_query, spool (over the memory budget only), db_insert, enqueue, total)
+    - worker.<kind>: Background stages (queue_wait, claim, scan, reuse_lookup,
+      convert with convert.decode / convert.webp_encode / convert.thumbnail
+      measured inside the pool, profile_lock, slot_lookup, disk_write,
+      slot_assign, db_update, cleanup, total)
+
+    Returns:
+    - json: {pipeline: {stage: {count, sum_ms, avg_ms, max_ms, p50_ms, p95_ms,
+      p99_ms, buckets}}}, stages ordered by total time spent
+    - prometheus: upload_stage_duration_seconds histogram in text format
+    """
+    if format == "prometheus":
+        return Response(content=upload_timings.prometheus_text(), media_type="text/plain; version=0.0.4")
+    return upload_timings.metrics()
+
+
+@router.get("/admin/upload-queue")
+def get_upload_queue_metrics():
+    """
+    Get background upload queue metrics
+
+    Purpose: Monitor uploads waiting for scan/conversion in this worker process
+
+    Returns:
+    - queued: Jobs waiting for a worker task
+    - processed / rejected: Jobs finished since startup
+    """
+    return upload_queue.metrics()
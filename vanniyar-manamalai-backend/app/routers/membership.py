@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.membership import (
     MembershipCreateRequest,
     MembershipUpdateRequest,
@@ -79,7 +79,7 @@ def create_new_membership(
 @router.get("/{profile_id}", response_model=MembershipResponse)
 def get_membership_by_profile(
     profile_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get membership details by profile_id
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.partner_preferences import (
     PartnerPreferencesCreate, 
     PartnerPreferencesUpdate, 
@@ -42,7 +42,7 @@ def create_new_partner_preferences(preferences: PartnerPreferencesCreate, db: Se
     return create_partner_preferences(db, preferences)
 
 @router.get("/{preferences_id}", response_model=PartnerPreferencesResponse)
-def read_preferences(preferences_id: int, db: Session = Depends(get_db)):
+def read_preferences(preferences_id: int, db: Session = Depends(get_read_db)):
     """
     Get partner preferences by ID
     
@@ -57,7 +57,7 @@ def read_preferences(preferences_id: int, db: Session = Depends(get_db)):
     return db_preferences
 
 @router.get("/profile/{profile_id}", response_model=list[PartnerPreferencesResponse])
-def read_preferences_by_profile(profile_id: int, db: Session = Depends(get_db)):
+def read_preferences_by_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get all partner preferences for a profile
     
@@ -280,7 +280,7 @@ def get_matching_profiles(
     profile_id: int, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles that match user's partner preferences
@@ -339,7 +339,7 @@ def search_by_age_range(
     age_to: int, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find preferences looking for specific age range
@@ -370,7 +370,7 @@ def search_by_height_range(
     height_to: int, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find preferences looking for specific height range
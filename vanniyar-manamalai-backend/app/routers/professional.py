@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.professional import (
     ProfessionalDetailsCreate, 
     ProfessionalDetailsUpdate, 
@@ -44,7 +44,7 @@ def create_new_professional(professional: ProfessionalDetailsCreate, db: Session
     return create_professional(db, professional)
 
 @router.get("/{professional_id}", response_model=ProfessionalDetailsResponse)
-def read_professional(professional_id: int, db: Session = Depends(get_db)):
+def read_professional(professional_id: int, db: Session = Depends(get_read_db)):
     """
     Get professional details by ID
     
@@ -59,7 +59,7 @@ def read_professional(professional_id: int, db: Session = Depends(get_db)):
     return db_professional
 
 @router.get("/profile/{profile_id}", response_model=list[ProfessionalDetailsResponse])
-def read_professional_by_profile(profile_id: int, db: Session = Depends(get_db)):
+def read_professional_by_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get all professional details for a profile
     
@@ -280,7 +280,7 @@ def get_professional_options():
     return ProfessionalOptions()
 
 @router.get("/profile/{profile_id}/summary", response_model=ProfessionalSummary)
-def get_professional_summary(profile_id: int, db: Session = Depends(get_db)):
+def get_professional_summary(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get computed professional summary
     
@@ -335,7 +335,7 @@ def search_by_education(
     education: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by education qualification
@@ -370,7 +370,7 @@ def search_by_occupation(
     occupation: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by occupation
@@ -404,7 +404,7 @@ def search_by_employment_type(
     employment_type: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by employment type
@@ -443,7 +443,7 @@ def search_by_work_location(
     work_location: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles by work location
@@ -478,7 +478,7 @@ def search_by_work_location(
 def search_advanced_degrees(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Find profiles with advanced/additional qualifications
@@ -3,7 +3,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas.profile import ProfileCreate, ProfileUpdate, ProfileResponse
 from app.schemas.complete_profile import CompleteProfileResponse
 from app.schemas.recommendation import RecommendedProfileResponse
@@ -50,7 +50,7 @@ def validate_admin(login: AdminLoginRequest):
 # ===================== Count Endpoints =====================
 
 @router.get("/Approved_list/count", response_model=ProfileCountResponse)
-def get_approved_profiles_count(db: Session = Depends(get_db)):
+def get_approved_profiles_count(db: Session = Depends(get_read_db)):
     """
     Get count of approved profiles (is_verified == 1)
     """
@@ -66,7 +66,7 @@ def get_approved_profiles_count(db: Session = Depends(get_db)):
 
 
 @router.get("/Unapproved_list/count", response_model=ProfileCountResponse)
-def get_unapproved_profiles_count(db: Session = Depends(get_db)):
+def get_unapproved_profiles_count(db: Session = Depends(get_read_db)):
     """
     Get count of unapproved profiles (is_verified == 0)
     """
@@ -82,7 +82,7 @@ def get_unapproved_profiles_count(db: Session = Depends(get_db)):
 
 
 @router.get("/exipred_list/count", response_model=ProfileCountResponse)
-def get_expired_profiles_count(db: Session = Depends(get_db)):
+def get_expired_profiles_count(db: Session = Depends(get_read_db)):
     """
     Get count of expired profiles (membership expired or missing)
     """
@@ -100,7 +100,7 @@ def get_expired_profiles_count(db: Session = Depends(get_db)):
 
 # ===================== Custom Profile List Endpoints =====================
 @router.get("/Approved_list/all", response_model=None)
-def get_approved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
+def get_approved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_read_db)):
     """
     Get all approved profiles (is_verified == 1)
     """
@@ -136,7 +136,7 @@ def get_approved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, g
 
 
 @router.get("/Unapproved_list/all", response_model=None)
-def get_unapproved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
+def get_unapproved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_read_db)):
     """
     Get all unapproved profiles (is_verified == 0)
     """
@@ -171,7 +171,7 @@ def get_unapproved_profiles(limit: int = Query(20, ge=1), offset: int = Query(0,
 
 
 @router.get("/exipred_list/all", response_model=None)
-def get_expired_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
+def get_expired_profiles(limit: int = Query(20, ge=1), offset: int = Query(0, ge=0), db: Session = Depends(get_read_db)):
     """
     Get all expired profiles (membership expired or missing)
     """
@@ -227,7 +227,7 @@ def create_new_profile(profile: ProfileCreate, db: Session = Depends(get_db)):
     return create_profile(db, profile)
 
 @router.get("/{profile_id}", response_model=ProfileResponse)
-def read_profile(profile_id: int, db: Session = Depends(get_db)):
+def read_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get profile by ID
     Purpose: View complete profile details
@@ -240,7 +240,7 @@ def read_profile(profile_id: int, db: Session = Depends(get_db)):
     return db_profile
 
 @router.get("/", response_model=list[ProfileResponse])
-def read_profiles(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_profiles(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get all profiles with pagination
     Purpose: List profiles for browsing/matching
@@ -314,7 +314,7 @@ def delete_profile_route(profile_id: int, db: Session = Depends(get_db)):
 # ============================================================================
 
 @router.get("/complete/{profile_id}", response_model=CompleteProfileResponse)
-def get_complete_profile(profile_id: int, db: Session = Depends(get_db)):
+def get_complete_profile(profile_id: int, db: Session = Depends(get_read_db)):
     """
     Get complete profile with all related information
     
@@ -345,7 +345,7 @@ def get_complete_profile(profile_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/complete-list/all", response_model=list[CompleteProfileResponse])
-def get_all_complete_profiles(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_all_complete_profiles(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get all complete profiles with pagination
     
@@ -364,7 +364,7 @@ def get_all_complete_profiles(skip: int = 0, limit: int = 100, db: Session = Dep
     return get_all_profiles_complete(db, skip=skip, limit=limit)
 
 @router.get("/recommendations/{profile_id}", response_model=list[RecommendedProfileResponse])
-def get_recommended_profiles_route(profile_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_recommended_profiles_route(profile_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get recommended profiles for a specific profile
     
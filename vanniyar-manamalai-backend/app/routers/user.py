@@ -1,7 +1,7 @@
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.crud import user as crud_user
 from app.schemas.user import (
     UserCreate, 
@@ -432,7 +432,7 @@ def is_user_by_mobile(mobile: str, db: Session = Depends(get_db)):
 # ==================== ADMIN/SEARCH ENDPOINTS ====================
 
 @router.get("/admin/all", response_model=list[UserResponse])
-def get_all_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_all_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get all users (admin operation)
     
@@ -442,7 +442,7 @@ def get_all_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
     return crud_user.get_all_users(db, skip, limit)
 
 @router.get("/admin/gender/{gender}", response_model=list[UserResponse])
-def get_users_by_gender(gender: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_users_by_gender(gender: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get users by gender
     
@@ -451,7 +451,7 @@ def get_users_by_gender(gender: str, skip: int = 0, limit: int = 100, db: Sessio
     return crud_user.get_users_by_gender(db, gender, skip, limit)
 
 @router.get("/admin/verified", response_model=list[UserResponse])
-def get_verified_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_verified_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get verified users only
     
@@ -460,7 +460,7 @@ def get_verified_users(skip: int = 0, limit: int = 100, db: Session = Depends(ge
     return crud_user.get_verified_users(db, skip, limit)
 
 @router.get("/admin/with-profile", response_model=list[UserResponse])
-def get_users_with_profile(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_users_with_profile(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get users who have created profiles
     
@@ -469,7 +469,7 @@ def get_users_with_profile(skip: int = 0, limit: int = 100, db: Session = Depend
     return crud_user.get_users_with_profile(db, skip, limit)
 
 @router.get("/admin/without-profile", response_model=list[UserResponse])
-def get_users_without_profile(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_users_without_profile(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get users who haven't created profiles
     
@@ -5,7 +5,7 @@ Handles request/response validation for profile photo uploads
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, List, Optional
 from enum import Enum
 
 
@@ -13,6 +13,8 @@ class ErrorCodeEnum(str, Enum):
     """Error codes for file upload failures"""
     SIZE_EXCEEDED = "SIZE_EXCEEDED"
     VIRUS_FOUND = "VIRUS_FOUND"
+    SCAN_TIMEOUT = "SCAN_TIMEOUT"
+    SCANNING_ERROR = "SCANNING_ERROR"
     DUPLICATE_DETECTED = "DUPLICATE_DETECTED"
     NO_FREE_SLOT = "NO_FREE_SLOT"
     INVALID_FILE_TYPE = "INVALID_FILE_TYPE"
@@ -22,9 +24,10 @@ class ErrorCodeEnum(str, Enum):
 
 
 class FileUploadResponse(BaseModel):
-    """Successful file upload response"""
+    """File upload response (status 'error' carries code and message)"""
     status: str = "success"
-    file_id: str
+    file_id: Optional[str] = None
+    code: Optional[ErrorCodeEnum] = None
     thumbnail_url: Optional[str] = None
     filename: Optional[str] = None
     profile_id: Optional[int] = None
@@ -32,12 +35,40 @@ class FileUploadResponse(BaseModel):
     mime_type: Optional[str] = None
     size_bytes: Optional[int] = None
     processing_status: str = "ready"
+    status_url: Optional[str] = None
     message: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
+class FileStatusResponse(BaseModel):
+    """Processing status of an accepted upload"""
+    file_id: str
+    processing_status: str
+    thumbnail_url: Optional[str] = None
+    code: Optional[ErrorCodeEnum] = None
+    message: Optional[str] = None
+
+
+class ThumbnailBatchRequest(BaseModel):
+    """Batch thumbnail request (e.g., all cards of a recommendation page)"""
+    file_ids: List[str] = Field(..., min_length=1, max_length=100)
+
+
+class ThumbnailPayload(BaseModel):
+    """One thumbnail in a batch response"""
+    mime_type: str = "image/webp"
+    etag: Optional[str] = None
+    data: str  # base64-encoded WebP
+
+
+class ThumbnailBatchResponse(BaseModel):
+    """Batch thumbnail response (JSON format)"""
+    thumbnails: Dict[str, ThumbnailPayload] = {}
+    missing: List[str] = []
+
+
 class FileUploadErrorResponse(BaseModel):
     """Failed file upload response"""
     status: str = "error"
@@ -0,0 +1,27 @@
+# app/utils/age.py
+"""
+Age calculation helpers for profile matching
+- Exact age from birth_date (same rule as the vw_user_profiles_complete view)
+"""
+
+from datetime import date
+from typing import Optional
+
+
+# ==================== AGE CALCULATION ====================
+
+def calculate_age(birth_date: date, today: Optional[date] = None) -> int:
+    """
+    Calculate age in completed years
+
+    Args:
+        birth_date: Date of birth
+        today: Reference date (default: date.today())
+
+    Returns:
+        Age in years, identical to the view formula
+        YEAR(CURDATE()) - YEAR(birth_date) - (DATE_FORMAT(birth_date, '%m%d') > DATE_FORMAT(CURDATE(), '%m%d'))
+    """
+    today = today or date.today()
+    return today.year - birth_date.year - ((birth_date.month, birth_date.day) > (today.month, today.day))
+
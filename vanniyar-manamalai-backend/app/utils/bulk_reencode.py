@@ -0,0 +1,516 @@
+# app/utils/bulk_reencode.py
+"""
+Bulk re-encode of stored photos with new WebP encoder settings
+- Walks ready image files rows in id order, batch by batch (keyset
+  pagination, no OFFSET); only rows and stored copies that existed when the
+  run started are visited, and a stored copy shared by several rows is
+  encoded once, so re-encoded copies are never encoded twice
+- Each batch is re-encoded on a process pool; workers publish the new WebP
+  and thumbnail to the content store themselves (temp file + fsync +
+  hardlink, never a half-written file under a final name) and return only
+  sizes and paths
+- The main process then moves every files row of the old copy to the new
+  one (storage_path, thumbnail_path, content_hash, size_bytes) and drops the
+  old copy's references; content store garbage collection deletes it later
+- Photos stored before the content store (no content_hash / no
+  content_blobs row, per-profile storage_path) are migrated into it: the
+  re-encoded copy is published to the store, the row takes a blob
+  reference, and the old per-profile file and thumbnail are deleted
+- Progress is checkpointed after every batch; a rerun with the same settings
+  resumes after the last finished batch
+- Throttles for running beside live traffic: --max-rate (photos/second),
+  --max-load (pause while the 1-minute load average is higher) and --nice
+  (pool worker priority)
+
+Original uploads are not kept, so the stored WebP is the source: every run
+is a lossy-to-lossy generation. By default a copy is only replaced when the
+new encoding is smaller (--keep-larger replaces regardless).
+
+Run:
+    python -m app.utils.bulk_reencode --quality 80 --method 4 --dry-run
+    python -m app.utils.bulk_reencode --quality 80 --method 4 --workers 2 --max-rate 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import case, func
+
+from app.database import SessionLocal
+from app.models.file import File, ContentBlob, FileKindEnum, ProcessingStatusEnum
+from app.utils.content_store import STORE_DIR, content_path_for, publish_to_store
+from app.utils.file_handler import (
+    convert_photo_with_derivatives, delete_file_from_disk,
+    PHOTO_WEBP_QUALITY, PHOTO_WEBP_METHOD, PHOTO_THUMBNAIL_SIZE
+)
+from app.utils.storage import UPLOAD_ROOT, require_local_storage
+
+
+# ==================== CONFIGURATION ====================
+
+# Local disk only: bulk_reencode exits unless STORAGE_BACKEND=local
+BASE_UPLOAD_DIR = str(UPLOAD_ROOT)
+
+REENCODE_CHECKPOINT = os.path.join(BASE_UPLOAD_DIR, "reencode.checkpoint.json")
+REENCODE_BATCH_SIZE = 50
+REENCODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+
+# ==================== WORKER ====================
+
+def _init_worker(nice: int) -> None:
+    """Lower pool worker priority so live requests win the CPU"""
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def reencode_photo(
+    storage_path: str,
+    old_size: int,
+    quality: int,
+    method: int,
+    store_dir: str,
+    keep_larger: bool = False,
+    dry_run: bool = False
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Re-encode one stored photo, content store copy or legacy file (runs in a pool worker)
+
+    Args:
+        storage_path: Current stored WebP
+        old_size: Current stored size in bytes
+        quality: New WebP quality
+        method: New WebP method (0-6)
+        store_dir: Content store root
+        keep_larger: Publish even if the new encoding is not smaller
+        dry_run: Encode and measure only
+
+    Returns:
+        Tuple[result, error_message]
+        result: {"sha256", "size_bytes", "storage_path", "thumbnail_path",
+                 "replace", "seconds"}; replace is False when the current copy is kept
+    """
+    started = time.perf_counter()
+    converted, convert_error = convert_photo_with_derivatives(
+        storage_path, quality=quality, thumbnail_size=PHOTO_THUMBNAIL_SIZE, widths=(), method=method
+    )
+    if convert_error or not converted:
+        return None, convert_error or "CONVERSION_ERROR"
+
+    sha256 = hashlib.sha256(converted["webp"]).hexdigest()
+    result = {
+        "sha256": sha256,
+        "size_bytes": len(converted["webp"]),
+        "storage_path": content_path_for(sha256, ".webp", store_dir),
+        "thumbnail_path": content_path_for(sha256, "_thumb.webp", store_dir),
+    }
+    # Identical output (already at these settings) is never a replacement
+    unchanged = os.path.basename(storage_path).startswith(sha256)
+    result["replace"] = not unchanged and (keep_larger or result["size_bytes"] < old_size)
+    if result["replace"] and not dry_run:
+        for content, path in ((converted["webp"], result["storage_path"]),
+                              (converted["thumbnail"], result["thumbnail_path"])):
+            saved, save_error = publish_to_store(content, path)
+            if not saved:
+                return None, save_error
+    result["seconds"] = time.perf_counter() - started
+    return result, None
+
+
+# ==================== DATABASE ====================
+
+def _next_batch(db, after: str, created_before: datetime, batch_size: int) -> list:
+    """
+    Next ready photos in files.id order, with their content store copy if any
+
+    blob_path / blob_created_at are None for legacy photos (stored before
+    the content store, or without a content_blobs row).
+    """
+    return (
+        db.query(
+            File.id, File.content_hash, File.storage_path, File.size_bytes,
+            ContentBlob.storage_path.label("blob_path"),
+            ContentBlob.size_bytes.label("blob_size_bytes"),
+            ContentBlob.created_at.label("blob_created_at")
+        )
+        .outerjoin(ContentBlob, ContentBlob.sha256 == File.content_hash)
+        .filter(
+            File.id > after,
+            File.created_at < created_before,
+            File.file_kind == FileKindEnum.image,
+            File.processing_status == ProcessingStatusEnum.ready
+        )
+        .order_by(File.id)
+        .limit(batch_size)
+        .all()
+    )
+
+
+def _switch_blob(db, old_sha256: str, result: dict) -> int:
+    """
+    Point every files row of old_sha256 at the re-encoded copy
+
+    The old blob loses those references (ref_count 0 -> garbage collected
+    after the grace period); the new blob gains them.
+
+    Returns:
+        Number of files rows moved
+    """
+    old_blob = db.query(ContentBlob).filter(ContentBlob.sha256 == old_sha256).with_for_update().first()
+    files = db.query(File).filter(File.content_hash == old_sha256).with_for_update().all()
+    if not old_blob or not files:
+        db.rollback()
+        return 0
+
+    new_blob = db.query(ContentBlob).filter(ContentBlob.sha256 == result["sha256"]).with_for_update().first()
+    if new_blob:
+        new_blob.ref_count += len(files)
+        new_blob.released_at = None
+    else:
+        db.add(ContentBlob(
+            sha256=result["sha256"],
+            storage_path=result["storage_path"],
+            thumbnail_path=result["thumbnail_path"],
+            size_bytes=result["size_bytes"],
+            ref_count=len(files)
+        ))
+
+    now = datetime.utcnow()
+    file_ids = [db_file.id for db_file in files]
+    for db_file in files:
+        # ORM updates so file_stats follows the size change
+        db_file.content_hash = result["sha256"]
+        db_file.storage_path = result["storage_path"]
+        db_file.thumbnail_path = result["thumbnail_path"]
+        db_file.size_bytes = result["size_bytes"]
+        db_file.updated_at = now
+
+    old_blob.ref_count = max(old_blob.ref_count - len(files), 0)
+    if old_blob.ref_count == 0:
+        old_blob.released_at = now
+    db.commit()
+
+    from app.crud.file import invalidate_file_meta
+    for file_id in file_ids:
+        invalidate_file_meta(file_id)
+    return len(file_ids)
+
+
+def _discard_unreferenced(db, result: dict) -> None:
+    """Remove published files that no blob row ended up referencing"""
+    if not db.query(ContentBlob.sha256).filter(ContentBlob.sha256 == result["sha256"]).first():
+        _, _ = delete_file_from_disk(result["storage_path"])
+        _, _ = delete_file_from_disk(result["thumbnail_path"])
+
+
+def _migrate_legacy(db, file_id: str, old_storage_path: str, result: dict) -> int:
+    """
+    Move a legacy photo onto its re-encoded content store copy
+
+    The row takes a reference to the blob (created if needed); the old
+    per-profile file and thumbnail are deleted once the row is committed.
+
+    Returns:
+        1 if the row was moved, 0 if it changed since it was read
+    """
+    db_file = db.query(File).filter(File.id == file_id).with_for_update().first()
+    # Deleted, replaced or already migrated since the batch was read
+    if not db_file or db_file.storage_path != old_storage_path:
+        db.rollback()
+        return 0
+
+    blob = db.query(ContentBlob).filter(ContentBlob.sha256 == result["sha256"]).with_for_update().first()
+    if blob:
+        blob.ref_count += 1
+        blob.released_at = None
+    else:
+        db.add(ContentBlob(
+            sha256=result["sha256"],
+            storage_path=result["storage_path"],
+            thumbnail_path=result["thumbnail_path"],
+            size_bytes=result["size_bytes"],
+            ref_count=1
+        ))
+
+    old_thumbnail_path = db_file.thumbnail_path
+    # ORM update so file_stats follows the size change
+    db_file.content_hash = result["sha256"]
+    db_file.storage_path = result["storage_path"]
+    db_file.thumbnail_path = result["thumbnail_path"]
+    db_file.size_bytes = result["size_bytes"]
+    db_file.updated_at = datetime.utcnow()
+    db.commit()
+
+    from app.crud.file import invalidate_file_meta
+    invalidate_file_meta(file_id)
+
+    for path in (old_storage_path, old_thumbnail_path):
+        if path and path not in (result["storage_path"], result["thumbnail_path"]):
+            deleted, delete_error = delete_file_from_disk(path)
+            if not deleted:
+                print(f"[REENCODE] Migrated {file_id} but could not delete {path}: {delete_error}")
+    return 1
+
+
+# ==================== CHECKPOINT ====================
+
+def _load_checkpoint(path: str, settings: dict, restart: bool, started_at: datetime) -> dict:
+    fresh = {"settings": settings, "last_file_id": "", "started_at": started_at.isoformat(), "counters": {}}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if "last_file_id" not in checkpoint:
+        raise SystemExit(f"Checkpoint {path} is from an older version of this tool; use --restart")
+    if checkpoint.get("settings") != settings:
+        raise SystemExit(
+            f"Checkpoint {path} was written for {checkpoint.get('settings')}; "
+            f"use --restart to start over with {settings}"
+        )
+    return checkpoint
+
+
+def _save_checkpoint(path: str, checkpoint: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ==================== THROTTLE ====================
+
+def _wait_for_load(max_load: Optional[float]) -> None:
+    if not max_load or not hasattr(os, "getloadavg"):
+        return
+    while os.getloadavg()[0] > max_load:
+        time.sleep(5)
+
+
+# ==================== ENTRY POINT ====================
+
+def bulk_reencode(
+    quality: int = PHOTO_WEBP_QUALITY,
+    method: int = PHOTO_WEBP_METHOD,
+    workers: int = REENCODE_WORKERS,
+    batch_size: int = REENCODE_BATCH_SIZE,
+    max_rate: Optional[float] = None,
+    max_load: Optional[float] = None,
+    nice: int = 10,
+    keep_larger: bool = False,
+    dry_run: bool = False,
+    checkpoint_path: str = REENCODE_CHECKPOINT,
+    restart: bool = False,
+    store_dir: str = str(STORE_DIR),
+    limit: Optional[int] = None
+) -> dict:
+    """
+    Re-encode every stored photo with new encoder settings
+
+    Args:
+        quality: WebP quality
+        method: WebP method (0 fast - 6 smallest)
+        workers: Pool processes
+        batch_size: Photos per batch (one checkpoint per batch)
+        max_rate: Maximum photos per second (None: unthrottled)
+        max_load: Pause while the 1-minute load average exceeds this
+        nice: Priority increment for pool workers
+        keep_larger: Replace copies even when the new encoding is larger
+        dry_run: Encode and report savings without writing anything
+        checkpoint_path: Progress file (ignored for dry runs)
+        restart: Ignore an existing checkpoint
+        store_dir: Content store root
+        limit: Stop after this many photos (this run)
+
+    Returns:
+        Counters: processed, replaced, skipped, failed, files_updated,
+        migrated, bytes_before, bytes_after, bytes_saved, photos_per_second, elapsed_seconds
+    """
+    require_local_storage("bulk_reencode")
+    settings = {"quality": quality, "method": method, "keep_larger": keep_larger}
+    db = SessionLocal()
+    # Database clock, comparable with files / content_blobs created_at
+    db_now = db.query(func.current_timestamp()).scalar()
+    if isinstance(db_now, str):
+        db_now = datetime.fromisoformat(db_now)
+    checkpoint = _load_checkpoint(checkpoint_path, settings, restart or dry_run, db_now)
+    created_before = datetime.fromisoformat(checkpoint["started_at"])
+    counters = {
+        "processed": 0, "replaced": 0, "skipped": 0, "failed": 0, "files_updated": 0, "migrated": 0,
+        "bytes_before": 0, "bytes_after": 0, **checkpoint["counters"]
+    }
+    last_file_id = checkpoint["last_file_id"]
+    if last_file_id:
+        print(f"[REENCODE] Resuming after file {last_file_id} ({counters['processed']} photos done)")
+    # Stored copies already visited this run (shared by several files rows)
+    seen_blobs = set()
+
+    started = time.monotonic()
+    run_processed = 0
+    min_interval = 1.0 / max_rate if max_rate else 0.0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(nice,)) as pool:
+            while limit is None or run_processed < limit:
+                size = batch_size if limit is None else min(batch_size, limit - run_processed)
+                batch = _next_batch(db, last_file_id, created_before, size)
+                db.rollback()  # no transaction held while encoding
+                if not batch:
+                    break
+
+                _wait_for_load(max_load)
+                futures = []
+                for row in batch:
+                    if row.blob_path:
+                        # Copies created by this run (or after it started) are already encoded
+                        if row.content_hash in seen_blobs or row.blob_created_at >= created_before:
+                            continue
+                        seen_blobs.add(row.content_hash)
+                        source_path, source_size = row.blob_path, row.blob_size_bytes
+                    else:
+                        source_path, source_size = row.storage_path, row.size_bytes
+                    submitted_at = time.monotonic()
+                    futures.append((row, source_size, pool.submit(
+                        reencode_photo, source_path, source_size, quality, method,
+                        store_dir, keep_larger, dry_run
+                    )))
+                    # Rate limit submissions (the pool never runs ahead of max_rate)
+                    if min_interval:
+                        time.sleep(max(0.0, min_interval - (time.monotonic() - submitted_at)))
+
+                for row, source_size, future in futures:
+                    counters["processed"] += 1
+                    name = row.content_hash if row.blob_path else f"file {row.id} (legacy)"
+                    try:
+                        result, error = future.result()
+                    except Exception as e:
+                        result, error = None, str(e)
+                    if error:
+                        counters["failed"] += 1
+                        print(f"[REENCODE] {name}: {error}")
+                        continue
+                    if not result["replace"]:
+                        counters["skipped"] += 1
+                        continue
+                    if not dry_run:
+                        try:
+                            if row.blob_path:
+                                moved = _switch_blob(db, row.content_hash, result)
+                            else:
+                                moved = _migrate_legacy(db, row.id, row.storage_path, result)
+                                counters["migrated"] += moved
+                            counters["files_updated"] += moved
+                        except Exception as e:
+                            db.rollback()
+                            counters["failed"] += 1
+                            print(f"[REENCODE] Failed to update rows of {name}: {e}")
+                            _discard_unreferenced(db, result)
+                            db.rollback()
+                            continue
+                        _discard_unreferenced(db, result)
+                        db.rollback()
+
+                    counters["replaced"] += 1
+                    counters["bytes_before"] += source_size
+                    counters["bytes_after"] += result["size_bytes"]
+
+                run_processed += len(batch)
+                last_file_id = batch[-1].id
+                if not dry_run:
+                    checkpoint["last_file_id"] = last_file_id
+                    checkpoint["counters"] = counters
+                    _save_checkpoint(checkpoint_path, checkpoint)
+
+                elapsed = time.monotonic() - started
+                print(
+                    f"[REENCODE] {counters['processed']} photos, {counters['replaced']} replaced, "
+                    f"{counters['skipped']} skipped, {counters['failed']} failed, "
+                    f"{(counters['bytes_before'] - counters['bytes_after']) / 1_048_576:.2f} MB saved, "
+                    f"{run_processed / elapsed:.1f} photos/s"
+                )
+    finally:
+        db.close()
+
+    elapsed = time.monotonic() - started
+    counters["bytes_saved"] = counters["bytes_before"] - counters["bytes_after"]
+    counters["photos_per_second"] = round(run_processed / elapsed, 2) if elapsed else 0.0
+    counters["elapsed_seconds"] = round(elapsed, 2)
+    return counters
+
+
+def count_stored_photos(db) -> Tuple[int, int]:
+    """
+    Ready photos a full run covers
+
+    Returns:
+        Tuple[photo_count, legacy_count]; legacy photos are migrated into the content store
+    """
+    photos, legacy = (
+        db.query(
+            func.count(File.id),
+            func.coalesce(func.sum(case((ContentBlob.sha256.is_(None), 1), else_=0)), 0)
+        )
+        .outerjoin(ContentBlob, ContentBlob.sha256 == File.content_hash)
+        .filter(
+            File.file_kind == FileKindEnum.image,
+            File.processing_status == ProcessingStatusEnum.ready
+        )
+        .one()
+    )
+    return photos, legacy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode stored photos with new WebP settings")
+    parser.add_argument("--quality", type=int, default=PHOTO_WEBP_QUALITY)
+    parser.add_argument("--method", type=int, default=PHOTO_WEBP_METHOD, choices=range(7))
+    parser.add_argument("--workers", type=int, default=REENCODE_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=REENCODE_BATCH_SIZE)
+    parser.add_argument("--max-rate", type=float, default=None, help="Maximum photos per second")
+    parser.add_argument("--max-load", type=float, default=None, help="Pause while load average is above this")
+    parser.add_argument("--nice", type=int, default=10, help="Priority increment for pool workers")
+    parser.add_argument("--keep-larger", action="store_true", help="Replace copies even if the new encoding is larger")
+    parser.add_argument("--dry-run", action="store_true", help="Encode and report savings only")
+    parser.add_argument("--checkpoint", default=REENCODE_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many photos")
+    args = parser.parse_args()
+    require_local_storage("bulk_reencode")
+
+    db = SessionLocal()
+    try:
+        photos, legacy = count_stored_photos(db)
+        print(f"[REENCODE] {photos} stored photos ({legacy} legacy, migrated into the content store); "
+              f"quality={args.quality} method={args.method}")
+    finally:
+        db.close()
+
+    result = bulk_reencode(
+        quality=args.quality,
+        method=args.method,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_rate=args.max_rate,
+        max_load=args.max_load,
+        nice=args.nice,
+        keep_larger=args.keep_larger,
+        dry_run=args.dry_run,
+        checkpoint_path=args.checkpoint,
+        restart=args.restart,
+        limit=args.limit
+    )
+    saved_pct = 100 * result["bytes_saved"] / result["bytes_before"] if result["bytes_before"] else 0.0
+    print(
+        f"[REENCODE] Done{' (dry run)' if args.dry_run else ''}: {result['processed']} photos, "
+        f"{result['replaced']} replaced ({result['files_updated']} files rows, {result['migrated']} migrated), "
+        f"{result['skipped']} skipped, "
+        f"{result['failed']} failed; {result['bytes_saved']} bytes saved ({saved_pct:.1f}%); "
+        f"{result['photos_per_second']} photos/s in {result['elapsed_seconds']}s"
+    )
@@ -0,0 +1,248 @@
+# app/utils/clamd.py
+"""
+Native clamd client (INSTREAM protocol)
+- Talks to a running clamd over its unix socket or TCP port
+- Keeps a small pool of IDSESSION connections instead of spawning
+  clamdscan/clamscan per file
+- Scans from memory (bytes) or streams a file in chunks
+- Configurable fail-open / fail-closed policy when clamd is unavailable
+"""
+
+import os
+import platform
+import queue
+import socket
+import struct
+from typing import Optional, Tuple, Union
+
+
+# ==================== CONFIGURATION ====================
+
+# TCP mode if CLAMD_HOST is set, otherwise unix socket (Linux default path)
+CLAMD_SOCKET = os.getenv("CLAMD_SOCKET", "/var/run/clamav/clamd.ctl")
+CLAMD_HOST = os.getenv("CLAMD_HOST") or ("127.0.0.1" if platform.system() == "Windows" else None)
+CLAMD_PORT = int(os.getenv("CLAMD_PORT", "3310"))
+CLAMD_TIMEOUT = float(os.getenv("CLAMD_TIMEOUT", "30"))
+CLAMD_POOL_SIZE = int(os.getenv("CLAMD_POOL_SIZE", "4"))
+# Must not exceed clamd's StreamMaxLength chunk handling; 64KB is safe
+CLAMD_CHUNK_SIZE = 64 * 1024
+# When clamd cannot be reached or errors: "open" lets the upload through
+# (previous behaviour without ClamAV installed), "closed" rejects it
+CLAMAV_FAILURE_POLICY = os.getenv("CLAMAV_FAILURE_POLICY", "open").lower()
+
+
+class ClamdError(Exception):
+    """clamd unreachable, timed out or returned an ERROR reply"""
+
+
+class _ClamdSession:
+    """One persistent IDSESSION connection to clamd"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.request_id = 0
+        self._buffer = b""
+
+    def send_command(self, command: bytes) -> None:
+        # 'z' prefix: null-terminated commands and replies
+        self.sock.sendall(b"z" + command + b"\0")
+        self.request_id += 1
+
+    def send_chunk(self, data: bytes) -> None:
+        self.sock.sendall(struct.pack("!L", len(data)) + data)
+
+    def read_reply(self) -> str:
+        while b"\0" not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ClamdError("clamd closed the connection")
+            self._buffer += data
+        reply, self._buffer = self._buffer.split(b"\0", 1)
+        text = reply.decode("utf-8", errors="replace")
+        # Session replies are prefixed with "<request id>: "
+        prefix, sep, rest = text.partition(": ")
+        if sep and prefix.isdigit():
+            return rest
+        return text
+
+    def close(self) -> None:
+        try:
+            self.sock.sendall(b"zEND\0")
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ClamdClient:
+    """
+    Thread-safe clamd client with a small connection pool
+
+    Usage:
+        client = ClamdClient(socket_path="/var/run/clamav/clamd.ctl")
+        is_safe, error = client.scan_bytes(file_content)
+        is_safe, error = client.scan_file("/srv/uploads/quarantine/abc.bin")
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = CLAMD_SOCKET,
+        host: Optional[str] = CLAMD_HOST,
+        port: int = CLAMD_PORT,
+        timeout: float = CLAMD_TIMEOUT,
+        pool_size: int = CLAMD_POOL_SIZE,
+        failure_policy: str = CLAMAV_FAILURE_POLICY
+    ):
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.fail_open = failure_policy != "closed"
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    # ---------- connections ----------
+
+    def _connect(self) -> _ClamdSession:
+        try:
+            if self.host:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            else:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+        except OSError as e:
+            raise ClamdError(f"cannot connect to clamd: {e}")
+        session = _ClamdSession(sock)
+        session.send_command(b"IDSESSION")
+        return session
+
+    def _acquire(self) -> _ClamdSession:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, session: _ClamdSession) -> None:
+        try:
+            self._idle.put_nowait(session)
+        except queue.Full:
+            session.close()
+
+    def _run(self, func) -> str:
+        # Retry once on a fresh connection: pooled sessions may have been
+        # closed by clamd (IdleTimeout) since they were last used
+        for attempt in range(2):
+            session = self._acquire()
+            try:
+                reply = func(session)
+            except (ConnectionError, ClamdError) as e:
+                session.close()
+                if attempt == 1:
+                    raise ClamdError(str(e))
+                continue
+            except OSError:
+                # Timeouts (stalled clamd) and errors reading the source are
+                # not connection problems: no retry, the caller decides
+                session.close()
+                raise
+            self._release(session)
+            return reply
+        raise ClamdError("clamd request failed")
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # ---------- commands ----------
+
+    def ping(self) -> bool:
+        """Return True if clamd answers PING with PONG"""
+        def _ping(session):
+            session.send_command(b"PING")
+            return session.read_reply()
+        try:
+            return self._run(_ping) == "PONG"
+        except ClamdError:
+            return False
+
+    def _instream(self, chunks) -> str:
+        def _scan(session):
+            session.send_command(b"INSTREAM")
+            for chunk in chunks():
+                if chunk:
+                    session.send_chunk(chunk)
+            session.send_chunk(b"")
+            return session.read_reply()
+        return self._run(_scan)
+
+    def _interpret(self, reply: str) -> Tuple[bool, Optional[str]]:
+        # Replies: "stream: OK", "stream: <signature> FOUND", "<message> ERROR"
+        if reply.endswith("OK"):
+            return True, None
+        if reply.endswith("FOUND"):
+            print(f"[CLAMD] Virus found: {reply}")
+            return False, "VIRUS_FOUND"
+        return self._on_failure(f"clamd error reply: {reply}")
+
+    def _on_failure(self, message: str) -> Tuple[bool, Optional[str]]:
+        if self.fail_open:
+            print(f"WARNING: {message}; skipping virus scan (fail-open)")
+            return True, None
+        print(f"[CLAMD] {message}; rejecting file (fail-closed)")
+        return False, "SCANNING_ERROR"
+
+    def scan_bytes(self, file_content: Union[bytes, memoryview]) -> Tuple[bool, Optional[str]]:
+        """
+        Scan in-memory content without writing a file
+
+        Returns:
+            Tuple[is_safe, error_message]
+        """
+        view = memoryview(file_content)
+
+        def chunks():
+            for offset in range(0, len(view), CLAMD_CHUNK_SIZE):
+                yield bytes(view[offset:offset + CLAMD_CHUNK_SIZE])
+
+        try:
+            return self._interpret(self._instream(chunks))
+        except socket.timeout:
+            # Rejected whatever the failure policy: a stalled scan is not "unavailable"
+            return False, "SCAN_TIMEOUT"
+        except (OSError, ClamdError) as e:
+            return self._on_failure(str(e))
+
+    def scan_file(self, file_path: str) -> Tuple[bool, Optional[str]]:
+        """
+        Stream a file to clamd in chunks (clamd needs no access to the path)
+
+        Returns:
+            Tuple[is_safe, error_message]
+        """
+        def chunks():
+            with open(file_path, "rb") as f:
+                while True:
+                    chunk = f.read(CLAMD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        try:
+            return self._interpret(self._instream(chunks))
+        except socket.timeout:
+            return False, "SCAN_TIMEOUT"
+        except FileNotFoundError:
+            return False, "SCANNING_ERROR"
+        except (OSError, ClamdError) as e:
+            return self._on_failure(str(e))
+
+
+# Shared client used by file_handler.scan_file_with_clamav
+clamd_client = ClamdClient()
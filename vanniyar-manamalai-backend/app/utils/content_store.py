@@ -0,0 +1,180 @@
+# app/utils/content_store.py
+"""
+Content-addressed photo store
+- Stored photos live at {STORE_DIR}/{sha[0:2]}/{sha[2:4]}/{sha}.webp
+  (thumbnail: {sha}_thumb.webp; responsive sizes are generated on demand,
+  see app/utils/derivative_cache.py)
+- Files are published with a hardlink from a temp file, so concurrent
+  writers of identical content end up sharing one copy and a half-written
+  file is never visible under its final name
+- Reference counts live in content_blobs; deletes only decrement them and
+  a periodic garbage collector removes blobs unreferenced for a grace period
+- The upload worker writes through app.utils.storage (local disk or S3);
+  publish_to_store is the synchronous local-disk writer used by CLI tools
+"""
+
+import asyncio
+import os
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.database import SessionLocal
+from app.crud.file_upload import get_unreferenced_blob_ids, lock_unreferenced_blob
+from app.utils.derivative_cache import discard_cached_sizes
+from app.utils.storage import UPLOAD_ROOT, get_storage, key_for_path, run_sync
+
+
+# ==================== CONFIGURATION ====================
+
+STORE_DIR = UPLOAD_ROOT / "store"
+
+# Unreferenced blobs are kept this long before deletion (a re-upload inside
+# the window reuses the stored copy)
+CONTENT_GC_GRACE_MINUTES = int(os.getenv("CONTENT_GC_GRACE_MINUTES", "60"))
+CONTENT_GC_INTERVAL_SECONDS = int(os.getenv("CONTENT_GC_INTERVAL_SECONDS", "900"))
+
+
+# ==================== PATHS ====================
+
+def content_path_for(sha256: str, suffix: str = ".webp", store_dir: Path = STORE_DIR) -> str:
+    """
+    Sharded store path for a content hash
+
+    Args:
+        sha256: SHA256 hex digest of the stored bytes
+        suffix: Filename suffix (e.g., ".webp", "_thumb.webp")
+        store_dir: Store root directory
+
+    Returns:
+        Path like /srv/uploads/store/ab/cd/abcd...ef.webp
+    """
+    return str(Path(store_dir) / sha256[0:2] / sha256[2:4] / f"{sha256}{suffix}")
+
+
+def derivative_path_for(storage_path: str, width: int) -> str:
+    """
+    Path of a responsive size stored next to a blob
+
+    Args:
+        storage_path: Blob path (.../<sha256>.webp)
+        width: Derivative width in pixels
+
+    Returns:
+        Path like /srv/uploads/store/ab/cd/abcd...ef_w640.webp
+    """
+    return f"{os.path.splitext(storage_path)[0]}_w{width}.webp"
+
+
+def blob_derivative_widths(blob) -> List[int]:
+    """Widths stored for a blob (parsed from content_blobs.derivative_widths)"""
+    if not blob or not blob.derivative_widths:
+        return []
+    return [int(width) for width in blob.derivative_widths.split(",") if width]
+
+
+# ==================== PUBLISH ====================
+
+def publish_to_store(content: bytes, path: str) -> Tuple[bool, Optional[str]]:
+    """
+    Write content to its store path unless an identical copy is already there
+
+    Content is written to a temp file in the same directory and hardlinked
+    to the final name. If the name already exists (same hash, same bytes),
+    the existing copy is kept and the temp file is dropped.
+
+    Args:
+        content: Bytes to store
+        path: Store path from content_path_for()
+
+    Returns:
+        Tuple[success, error_message]
+    """
+    if os.path.exists(path):
+        return True, None
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            # Identical content stored concurrently by another worker
+            pass
+        return True, None
+    except Exception as e:
+        return False, str(e)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+# ==================== GARBAGE COLLECTION ====================
+
+def collect_garbage(db, grace_minutes: int = CONTENT_GC_GRACE_MINUTES, limit: int = 500) -> dict:
+    """
+    Delete blobs (files and rows) that have had no references for grace_minutes
+
+    Args:
+        db: Database session
+        grace_minutes: Minimum time at ref_count 0 before deletion
+        limit: Maximum blobs deleted per run
+
+    Returns:
+        Dict with deleted blob count and freed bytes
+    """
+    deleted = 0
+    freed_bytes = 0
+
+    for sha256 in get_unreferenced_blob_ids(db, grace_minutes=grace_minutes, limit=limit):
+        blob = lock_unreferenced_blob(db, sha256)
+        if not blob:
+            # Referenced again since the candidate list was built
+            db.rollback()
+            continue
+        try:
+            paths = [blob.storage_path, blob.thumbnail_path] + [
+                derivative_path_for(blob.storage_path, width) for width in blob_derivative_widths(blob)
+            ]
+            storage = get_storage()
+            for path in paths:
+                if path:
+                    removed, remove_error = run_sync(storage.delete(key_for_path(path)))
+                    if not removed:
+                        raise OSError(remove_error)
+            discard_cached_sizes(sha256)
+            freed_bytes += blob.size_bytes or 0
+            db.delete(blob)
+            db.commit()
+            deleted += 1
+        except Exception as e:
+            db.rollback()
+            print(f"[CONTENT STORE] Failed to collect blob {sha256}: {e}")
+
+    if deleted:
+        print(f"[CONTENT STORE] Garbage collected {deleted} blobs ({freed_bytes} bytes)")
+    return {"deleted": deleted, "freed_bytes": freed_bytes}
+
+
+def _collect_garbage_once() -> dict:
+    db = SessionLocal()
+    try:
+        return collect_garbage(db)
+    finally:
+        db.close()
+
+
+async def run_garbage_collector(interval_seconds: int = CONTENT_GC_INTERVAL_SECONDS) -> None:
+    """Periodically collect unreferenced blobs (started in app.main on startup)"""
+    while True:
+        try:
+            await asyncio.to_thread(_collect_garbage_once)
+        except Exception as e:
+            print(f"[CONTENT STORE] Garbage collection failed: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,204 @@
+# app/utils/db_pool.py
+"""
+Database connection pool instrumentation
+- TimedQueuePool is SQLAlchemy's QueuePool with the time spent acquiring a
+  connection (waiting for a free one, opening a new one, pre-ping) measured
+  on every checkout
+- Waits are aggregated per process (histogram, timeouts, opened and
+  invalidated connections) and exposed by GET /admin/db/pool
+- track_request_pool_wait() attributes waits to the HTTP request that caused
+  them (histograms request.<route>: pool_wait and the request's total)
+
+Usage (app/database.py):
+    engine = create_engine(url, poolclass=TimedQueuePool, pool_size=..., ...)
+    async_engine = create_async_engine(url, poolclass=TimedAsyncQueuePool, ...)
+    watch_engine(engine)
+"""
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.utils.stage_timing import StageHistograms, StageTimer
+
+
+# ==================== CONFIGURATION ====================
+
+# Log checkouts that waited longer than this (milliseconds)
+DB_POOL_SLOW_WAIT_MS = float(os.getenv("DB_POOL_SLOW_WAIT_MS", "100"))
+
+# Pool waits of the current HTTP request (RequestPoolWait, shared with the
+# threadpool threads that run sync dependencies of the request)
+_request_pool_wait: contextvars.ContextVar = contextvars.ContextVar("request_pool_wait", default=None)
+
+
+# ==================== STATS ====================
+
+class PoolWaitStats:
+    """Process-wide checkout wait statistics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.connections_opened = 0
+        self.connections_invalidated = 0
+        # pool.checkout for every checkout, request.<route> for HTTP requests
+        self.histograms = StageHistograms()
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            if timed_out:
+                self.timeouts += 1
+            if seconds * 1000 >= DB_POOL_SLOW_WAIT_MS:
+                self.slow_checkouts += 1
+        self.histograms.observe_value("pool.checkout", "wait", seconds)
+
+        tracked = _request_pool_wait.get()
+        if tracked is not None:
+            tracked.add(seconds)
+
+    def on_connect(self, *args) -> None:
+        with self._lock:
+            self.connections_opened += 1
+
+    def on_invalidate(self, *args) -> None:
+        with self._lock:
+            self.connections_invalidated += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "slow_wait_threshold_ms": DB_POOL_SLOW_WAIT_MS,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "connections_opened": self.connections_opened,
+                "connections_invalidated": self.connections_invalidated,
+            }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each checkout took"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_wait_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            print(f"[DB POOL] Checkout timed out: {self.status()}")
+            raise
+        waited = time.perf_counter() - started
+        pool_wait_stats.record_wait(waited)
+        if waited * 1000 >= DB_POOL_SLOW_WAIT_MS:
+            print(f"[DB POOL] Slow checkout {waited * 1000:.1f}ms: {self.status()}")
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    """QueuePool for the sync engine"""
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    """Pool for the async engine (asyncio-aware queue, same metrics)"""
+
+
+def watch_engine(engine) -> None:
+    """Count connections opened and invalidated (stale, failed pre-ping) by an engine's pool"""
+    # Async engines emit pool events on their sync facade
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "connect", pool_wait_stats.on_connect)
+    event.listen(engine, "invalidate", pool_wait_stats.on_invalidate)
+
+
+# ==================== REQUEST TRACKING ====================
+
+class RequestPoolWait:
+    """Pool waits caused by one request (route is set once routing has run)"""
+
+    def __init__(self):
+        self.timer = StageTimer()
+        self.seconds = 0.0
+        self.checkouts = 0
+        self.route: Optional[str] = None
+
+    def add(self, seconds: float) -> None:
+        # Called from threadpool threads too; += on floats/ints under the GIL is
+        # good enough for a per-request diagnostic
+        self.seconds += seconds
+        self.checkouts += 1
+
+
+@contextlib.contextmanager
+def track_request_pool_wait():
+    """
+    Accumulate pool waits caused while handling one request
+
+    Yields:
+        RequestPoolWait, filled in as the request runs; requests that used the
+        database are recorded as request.<route> (pool_wait and total)
+    """
+    tracked = RequestPoolWait()
+    token = _request_pool_wait.set(tracked)
+    try:
+        yield tracked
+    finally:
+        _request_pool_wait.reset(token)
+        if tracked.checkouts and tracked.route:
+            tracked.timer.record("pool_wait", tracked.seconds)
+            pool_wait_stats.histograms.observe(f"request.{tracked.route}", tracked.timer)
+
+
+def _pool_occupancy(engine) -> dict:
+    pool = engine.pool
+    occupancy = {"status": pool.status()}
+    if isinstance(pool, QueuePool):
+        occupancy.update({
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # Negative until the pool has opened pool_size connections
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout_seconds": pool.timeout(),
+            "recycle_seconds": pool._recycle,
+            "pre_ping": pool._pre_ping,
+        })
+    return occupancy
+
+
+def pool_metrics(engine, async_engine=None, read_engine=None) -> dict:
+    """
+    Pool occupancy and checkout wait statistics for GET /admin/db/pool
+
+    Waits and histograms cover all engines (primary, async, read replica).
+
+    Returns:
+        Dict with configuration, current occupancy, wait totals and histograms
+    """
+    metrics = {"pool": _pool_occupancy(engine)}
+    if async_engine is not None:
+        metrics["async_pool"] = _pool_occupancy(async_engine)
+    if read_engine is not None and read_engine is not engine:
+        metrics["read_pool"] = _pool_occupancy(read_engine)
+    metrics["waits"] = pool_wait_stats.snapshot()
+    metrics["histograms"] = pool_wait_stats.histograms.metrics()
+    return metrics
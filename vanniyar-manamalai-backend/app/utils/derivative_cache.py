@@ -0,0 +1,227 @@
+# app/utils/derivative_cache.py
+"""
+On-demand photo derivative cache
+- Responsive sizes are generated on first request instead of at upload
+- Single-flight: concurrent requests for the same size share one resize
+- Cached on disk under {CACHE_DIR}/{key[0:2]}/{key[2:4]}/{key}_w{width}.webp
+- Size-capped with LRU eviction tracked by the application:
+  /srv/uploads is mounted noatime (scripts/1_image.sh), so recency is kept
+  in memory and mirrored to mtime (throttled) for restarts and other workers
+- The cache is always on local disk; with a remote storage backend the
+  source photo is downloaded once per resize
+"""
+
+import asyncio
+import glob
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.utils.file_handler import generate_photo_derivatives, image_processor
+from app.utils.storage import UPLOAD_ROOT, get_storage, key_for_path
+
+
+# ==================== CONFIGURATION ====================
+
+CACHE_DIR = UPLOAD_ROOT / "cache"
+
+DERIVATIVE_CACHE_MAX_MB = int(os.getenv("DERIVATIVE_CACHE_MAX_MB", "2048"))
+# Minimum seconds between mtime updates for the same cached file
+TOUCH_INTERVAL_SECONDS = 300
+# Minimum seconds between rescans of the cache directory before evicting
+RESCAN_INTERVAL_SECONDS = 60
+
+
+class DerivativeCache:
+    """
+    Disk cache of resized photos with single-flight generation
+
+    Usage:
+        path = await derivative_cache.get_or_create(content_hash, 320, storage_path)
+        # None -> serve the original
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = DERIVATIVE_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()  # path -> [size_bytes, last_touch], oldest first
+        self._total_bytes = 0
+        self._inflight = {}
+        self._loaded = False
+        self._last_scan = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    # ---------- paths ----------
+
+    def path_for(self, key: str, width: int) -> str:
+        return str(self.cache_dir / key[0:2] / key[2:4] / f"{key}_w{width}.webp")
+
+    # ---------- LRU accounting ----------
+
+    def _scan(self) -> OrderedDict:
+        """Read cached files ordered by mtime (last use, see _touch)"""
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".webp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        return OrderedDict((path, [size, mtime]) for mtime, path, size in entries)
+
+    async def _rescan(self) -> None:
+        index = await asyncio.to_thread(self._scan)
+        # Keep in-memory recency for entries this process already knows about
+        for path in list(self._index):
+            if path in index:
+                index.move_to_end(path)
+        self._index = index
+        self._total_bytes = sum(size for size, _ in index.values())
+        self._last_scan = time.monotonic()
+        self._loaded = True
+
+    def _touch(self, path: str) -> None:
+        entry = self._index[path]
+        self._index.move_to_end(path)
+        now = time.time()
+        if now - entry[1] >= TOUCH_INTERVAL_SECONDS:
+            entry[1] = now
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _add(self, path: str, size: int) -> None:
+        if path in self._index:
+            self._total_bytes -= self._index[path][0]
+        self._index[path] = [size, time.time()]
+        self._total_bytes += size
+
+    async def _evict(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Other workers also write here; refresh the view before deleting
+        if time.monotonic() - self._last_scan >= RESCAN_INTERVAL_SECONDS:
+            await self._rescan()
+        while self._total_bytes > self.max_bytes and self._index:
+            path, (size, _) = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self._evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # ---------- generation ----------
+
+    @staticmethod
+    def _write_atomic(content: bytes, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    async def _generate(self, width: int, source_path: str, path: str) -> Optional[str]:
+        storage = get_storage()
+        source_key = key_for_path(source_path)
+        # Local files are opened by the pool worker; remote objects are downloaded first
+        source = storage.local_path(source_key) or await storage.get(source_key)
+        if source is None:
+            return None
+        derivatives, error = await image_processor.run(generate_photo_derivatives, source, widths=(width,))
+        content = (derivatives or {}).get(width)
+        if error or not content:
+            # Source narrower than width (serve original) or decode failed
+            return None
+        await asyncio.to_thread(self._write_atomic, content, path)
+        self._add(path, len(content))
+        await self._evict()
+        return path if path in self._index else None
+
+    async def get_or_create(self, key: str, width: int, source_path: str) -> Optional[str]:
+        """
+        Get the cached derivative path, generating it on first request
+
+        Args:
+            key: Cache key (content hash, or file ID for legacy files)
+            width: Target width in pixels
+            source_path: Stored path of the full-size image to resize from
+
+        Returns:
+            Path to the cached WebP, or None to serve the original
+        """
+        if not self._loaded:
+            await self._rescan()
+
+        path = self.path_for(key, width)
+        if path in self._index:
+            if os.path.exists(path):
+                self._hits += 1
+                self._touch(path)
+                return path
+            # Evicted by another worker
+            self._total_bytes -= self._index.pop(path)[0]
+        elif os.path.exists(path):
+            # Generated by another worker since the last scan
+            self._hits += 1
+            self._add(path, os.path.getsize(path))
+            return path
+
+        # Single-flight: later requests await the resize already running.
+        # The task is shielded so a client disconnect does not cancel it.
+        task = self._inflight.get(path)
+        if task is None:
+            self._misses += 1
+            task = asyncio.ensure_future(self._generate_once(width, source_path, path))
+            self._inflight[path] = task
+        return await asyncio.shield(task)
+
+    async def _generate_once(self, width: int, source_path: str, path: str) -> Optional[str]:
+        try:
+            return await self._generate(width, source_path, path)
+        except Exception as e:
+            print(f"[DERIVATIVE CACHE] Failed to generate {path}: {e}")
+            return None
+        finally:
+            self._inflight.pop(path, None)
+
+    def metrics(self) -> dict:
+        """Cache usage and hit counters (for admin monitoring)"""
+        return {
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._inflight),
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
+
+
+def discard_cached_sizes(key: str, cache_dir: Path = CACHE_DIR) -> None:
+    """
+    Delete every cached size for a key (e.g., when its blob is garbage collected)
+
+    Only files are removed; stale index entries are dropped on next access or rescan.
+    """
+    pattern = str(Path(cache_dir) / key[0:2] / key[2:4] / f"{key}_w*.webp")
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Shared cache used by /files/{id}/image
+derivative_cache = DerivativeCache()
@@ -0,0 +1,156 @@
+# app/utils/fake_clamd.py
+"""
+Minimal fake clamd server for local development and tests
+- Speaks the subset of the clamd protocol used by app.utils.clamd:
+  PING, VERSION, INSTREAM, IDSESSION, END (n/z command prefixes)
+- Reports "FOUND" for streams containing the EICAR test string,
+  "OK" otherwise
+- Listens on a unix socket or TCP port
+
+Run:
+    python -m app.utils.fake_clamd --port 3310
+    python -m app.utils.fake_clamd --socket /tmp/clamd.sock
+"""
+
+import argparse
+import os
+import socketserver
+import struct
+import threading
+from typing import Optional
+
+
+EICAR_SIGNATURE = b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE"
+# clamd default StreamMaxLength is 25M
+STREAM_MAX_LENGTH = 25 * 1024 * 1024
+
+
+class _ClamdHandler(socketserver.BaseRequestHandler):
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data += chunk
+        return data
+
+    def _read_command(self) -> Optional[bytes]:
+        # Commands are "z<NAME>\0" or "n<NAME>\n"
+        prefix = self.request.recv(1)
+        if not prefix:
+            return None
+        terminator = b"\0" if prefix == b"z" else b"\n"
+        command = b""
+        while True:
+            ch = self.request.recv(1)
+            if not ch:
+                return None
+            if ch == terminator:
+                return command
+            command += ch
+
+    def _instream(self) -> str:
+        total = 0
+        tail = b""
+        found = False
+        while True:
+            (length,) = struct.unpack("!L", self._recv_exact(4))
+            if length == 0:
+                break
+            chunk = self._recv_exact(length)
+            total += length
+            if total > STREAM_MAX_LENGTH:
+                return "INSTREAM size limit exceeded. ERROR"
+            # Keep a small tail so signatures split across chunks are found
+            found = found or EICAR_SIGNATURE in (tail + chunk)
+            tail = chunk[-len(EICAR_SIGNATURE):]
+        return "stream: Eicar-Test-Signature FOUND" if found else "stream: OK"
+
+    def handle(self):
+        in_session = False
+        request_id = 0
+        try:
+            while True:
+                command = self._read_command()
+                if command is None:
+                    return
+
+                if command == b"IDSESSION":
+                    in_session = True
+                    continue
+                if command == b"END":
+                    return
+
+                request_id += 1
+                if command == b"PING":
+                    reply = "PONG"
+                elif command == b"VERSION":
+                    reply = "ClamAV 0.0.0-fake"
+                elif command == b"INSTREAM":
+                    reply = self._instream()
+                else:
+                    reply = "UNKNOWN COMMAND"
+
+                if in_session:
+                    reply = f"{request_id}: {reply}"
+                self.request.sendall(reply.encode() + b"\0")
+
+                if not in_session:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_fake_clamd(
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 0
+) -> socketserver.BaseServer:
+    """
+    Start a fake clamd server in a background thread
+
+    Args:
+        socket_path: Unix socket path (TCP is used when None)
+        host: TCP host
+        port: TCP port (0 picks a free port, see server.server_address)
+
+    Returns:
+        Running server (call server.shutdown() to stop it)
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _ThreadingUnixServer(socket_path, _ClamdHandler)
+    else:
+        server = _ThreadingTCPServer((host, port), _ClamdHandler)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake clamd server")
+    parser.add_argument("--socket", help="Unix socket path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3310)
+    args = parser.parse_args()
+
+    server = start_fake_clamd(args.socket, args.host, args.port)
+    where = args.socket or f"{args.host}:{server.server_address[1]}"
+    print(f"Fake clamd listening on {where}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,42 +1,49 @@
 # app/utils/file_handler.py
 """
 File handling utilities for photo upload and processing
-- Virus scanning
+- Virus scanning (persistent clamd connection)
 - Image conversion
+- Responsive photo sizes (width ladder from one decode)
+- Perceptual hashes (dHash) for near-duplicate photo detection
 - Checksum calculation
-- File validation
+- File validation (magic-byte sniffing, header-only dimension check)
+- PDF linearization ("fast web view", optional pikepdf)
+- PDF first-page previews (optional pypdfium2, no poppler needed)
+- Streaming upload ingestion (size limit + SHA256 in one pass)
+- Image processing pool (keeps Pillow work off the event loop)
 """
 
+import asyncio
 import hashlib
 import os
-import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Tuple, Optional
-from PIL import Image
+from typing import Tuple, Optional, Callable, Any, Union
+from PIL import Image, ImageOps
 import io
 import uuid
 
+from app.utils.clamd import clamd_client
 
-# ==================== FILE VALIDATION ====================
+try:
+    # Optional: PDF linearization (pip install pikepdf); uploads are stored as-is without it
+    import pikepdf
+except ImportError:
+    pikepdf = None
 
-def validate_file_size(file_content: bytes, max_size_mb: int = 10) -> Tuple[bool, Optional[str]]:
-    """
-    Validate file size
-    
-    Args:
-        file_content: File bytes
-        max_size_mb: Maximum allowed size in MB
-    
-    Returns:
-        Tuple[is_valid, error_message]
-    """
-    max_bytes = max_size_mb * 1024 * 1024
-    if len(file_content) > max_bytes:
-        print(f"File size {len(file_content)} exceeds max allowed {max_bytes}")
-        return False, "SIZE_EXCEEDED"
-    return True, None
+try:
+    # Optional: PDF page rendering (pip install pypdfium2); falls back to the
+    # first page's embedded image via pikepdf (scanned documents)
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
 
 
+# ==================== FILE VALIDATION ====================
+
 def validate_mime_type(mime_type: str, allowed_types: list = None) -> Tuple[bool, Optional[str]]:
     """
     Validate file MIME type
@@ -62,6 +69,89 @@ def validate_mime_type(mime_type: str, allowed_types: list = None) -> Tuple[bool
     return True, None
 
 
+# Decompression-bomb guard: largest image (width x height) accepted for
+# decoding. Also applied to Pillow itself, so worker processes refuse to
+# decode anything more than twice this size even if pre-validation is skipped.
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Bytes read for type sniffing
+SNIFF_BYTES = 32
+
+
+def sniff_mime_type(header: bytes) -> Optional[str]:
+    """
+    Detect the file type from its magic bytes
+    
+    Args:
+        header: First bytes of the file (SNIFF_BYTES is enough)
+    
+    Returns:
+        MIME type (image/jpeg, image/png, image/gif, image/webp, application/pdf) or None
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header.startswith(b'%PDF-'):
+        return 'application/pdf'
+    return None
+
+
+def validate_file_header(source: Union[bytes, str], allowed_types: list) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Validate an uploaded file from its header, without decoding pixels
+    
+    Args:
+        source: Uploaded bytes or path to the uploaded file (quarantine)
+        allowed_types: Accepted MIME types
+    
+    Returns:
+        Tuple[info, error_message]
+        - ({"mime_type", "width", "height"}, None) if valid (no dimensions for PDF)
+        - (None, "INVALID_FILE_TYPE" | "INVALID_IMAGE" | "IMAGE_TOO_LARGE") if rejected
+    
+    Purpose: Reject junk, mislabelled and decompression-bomb uploads before
+    the virus scan and conversion. The detected type replaces the
+    client-supplied Content-Type.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        header = bytes(source[:SNIFF_BYTES])
+    else:
+        try:
+            with open(source, 'rb') as f:
+                header = f.read(SNIFF_BYTES)
+        except OSError:
+            return None, "INVALID_FILE_TYPE"
+    
+    mime_type = sniff_mime_type(header)
+    if mime_type is None or mime_type not in allowed_types:
+        return None, "INVALID_FILE_TYPE"
+    
+    if mime_type == 'application/pdf':
+        return {"mime_type": mime_type, "width": None, "height": None}, None
+    
+    try:
+        # Image.open parses the header only; pixels are decoded on load()
+        with _open_image(source) as img:
+            width, height = img.size
+            image_format = img.format
+    except Image.DecompressionBombError:
+        return None, "IMAGE_TOO_LARGE"
+    except Exception:
+        return None, "INVALID_IMAGE"
+    
+    if Image.MIME.get(image_format) != mime_type or width <= 0 or height <= 0:
+        return None, "INVALID_IMAGE"
+    if width * height > MAX_IMAGE_PIXELS:
+        return None, "IMAGE_TOO_LARGE"
+    return {"mime_type": mime_type, "width": width, "height": height}, None
+
+
 # ==================== CHECKSUM & DUPLICATE DETECTION ====================
 
 def calculate_checksum(file_content: bytes) -> str:
@@ -77,160 +167,336 @@ def calculate_checksum(file_content: bytes) -> str:
     return hashlib.sha256(file_content).hexdigest()
 
 
+# ==================== STREAMING INGESTION ====================
+
+# Read size per chunk when ingesting uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Allowance for multipart boundaries/headers when checking request Content-Length
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+
+def _declared_size_exceeded(upload_file, max_bytes: int, content_length) -> Optional[int]:
+    """Declared size (request Content-Length / UploadFile.size) if it is over the limit"""
+    try:
+        declared = int(content_length) if content_length is not None else None
+    except (TypeError, ValueError):
+        declared = None
+    if declared is not None and declared > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        print(f"Content-Length {declared} exceeds max allowed {max_bytes}")
+        return declared
+    known_size = getattr(upload_file, "size", None)
+    if known_size is not None and known_size > max_bytes:
+        print(f"File size {known_size} exceeds max allowed {max_bytes}")
+        return known_size
+    return None
+
+
+async def stream_upload_to_memory(
+    upload_file,
+    max_size_mb: int = 10,
+    content_length: Optional[Union[int, str]] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> Tuple[int, Optional[bytes], Optional[str], Optional[str]]:
+    """
+    Read an UploadFile into memory in chunks, hashing as it goes
+    
+    Only chunk_size bytes are read at a time. The size limit is enforced
+    before reading (request Content-Length / UploadFile.size) and again on
+    the running byte count, so oversized uploads stop early.
+    
+    Args:
+        upload_file: FastAPI UploadFile
+        max_size_mb: Maximum allowed size in MB
+        content_length: Request Content-Length header, if known
+        chunk_size: Bytes read per chunk
+    
+    Returns:
+        Tuple[size_bytes, content, checksum, error_message]
+        - (size, bytes, sha256_hex, None) if successful
+        - (size, None, None, "SIZE_EXCEEDED" | "EMPTY_FILE" | "READ_ERROR") if failed
+    """
+    max_bytes = max_size_mb * 1024 * 1024
+    
+    declared_size = _declared_size_exceeded(upload_file, max_bytes, content_length)
+    if declared_size is not None:
+        return declared_size, None, None, "SIZE_EXCEEDED"
+    
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    try:
+        while True:
+            chunk = await upload_file.read(chunk_size)
+            if not chunk:
+                break
+            if len(buffer) + len(chunk) > max_bytes:
+                print(f"File size exceeds max allowed {max_bytes}, aborting upload")
+                return len(buffer) + len(chunk), None, None, "SIZE_EXCEEDED"
+            hasher.update(chunk)
+            buffer += chunk
+    except Exception as e:
+        print(f"Error reading upload: {e}")
+        return len(buffer), None, None, "READ_ERROR"
+    
+    if not buffer:
+        return 0, None, None, "EMPTY_FILE"
+    return len(buffer), bytes(buffer), hasher.hexdigest(), None
+
+
 # ==================== VIRUS SCANNING ====================
 
 def scan_file_with_clamav(file_path: str) -> Tuple[bool, Optional[str]]:
     """
-    Scan file for viruses using ClamAV
+    Scan file for viruses using the clamd daemon (INSTREAM over a pooled socket)
     
     Args:
-        file_path: Path to file to scan
+        file_path: Path to file to scan (streamed to clamd, so clamd needs no read access)
     
     Returns:
         Tuple[is_safe, error_message]
         is_safe: True if no virus found, False if virus detected
+        If clamd is unavailable the result follows CLAMAV_FAILURE_POLICY (open/closed)
     """
-    try:
-        # Try using clamdscan (daemon mode, faster)
-        result = subprocess.run(
-            ['clamdscan', '--no-summary', '--remove', file_path],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+    return clamd_client.scan_file(file_path)
+
+
+def scan_bytes_with_clamav(file_content: bytes) -> Tuple[bool, Optional[str]]:
+    """
+    Scan in-memory content for viruses without writing a quarantine file
+    
+    Args:
+        file_content: File bytes
+    
+    Returns:
+        Tuple[is_safe, error_message]
+    """
+    return clamd_client.scan_bytes(file_content)
+
+
+# ==================== IMAGE CONVERSION ====================
+
+# Encoder settings for stored photos (new uploads; app/utils/bulk_reencode.py
+# applies changed settings to photos already stored)
+PHOTO_WEBP_QUALITY = int(os.getenv("PHOTO_WEBP_QUALITY", "85"))
+PHOTO_WEBP_METHOD = int(os.getenv("PHOTO_WEBP_METHOD", "6"))  # 0 (fast) - 6 (smallest)
+PHOTO_THUMBNAIL_SIZE = (150, 150)
+
+
+def _open_image(source: Union[bytes, str]) -> Image.Image:
+    """Open an image from bytes or from a file path (avoids loading the file into memory)"""
+    if isinstance(source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+# ==================== RESPONSIVE DERIVATIVES ====================
+
+# Widths (px) generated for every photo, e.g. PHOTO_DERIVATIVE_WIDTHS="150,320,640,1280"
+PHOTO_DERIVATIVE_WIDTHS = tuple(sorted(
+    int(width) for width in os.getenv("PHOTO_DERIVATIVE_WIDTHS", "150,320,640,1280").split(",") if width.strip()
+))
+
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Composite transparent images on white and return an RGB image"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _resize_ladder(img: Image.Image, widths, quality: int = 80) -> dict:
+    """
+    Encode a width ladder from one decoded image
+    
+    Largest width first; each step starts from the previous result and
+    uses reduce() (integer box downscale) before the final LANCZOS resize,
+    so no step resamples the full-size image more than once.
+    
+    Returns:
+        Dict {width: webp_bytes} for widths smaller than the image
+    """
+    derivatives = {}
+    current = img
+    for width in sorted(widths, reverse=True):
+        if width >= img.width:
+            # Never upscale; the original serves these requests
+            continue
+        factor = current.width // (width * 2)
+        if factor >= 2:
+            current = current.reduce(factor)
+        height = max(1, round(img.height * width / img.width))
+        current = current.resize((width, height), Image.Resampling.LANCZOS)
         
-        if result.returncode == 0:
-            # File is clean
-            return True, None
-        elif result.returncode == 1:
-            # Virus found
-            return False, "VIRUS_FOUND"
-        else:
-            # Scanning error
-            return False, "SCANNING_ERROR"
-            
-    except FileNotFoundError:
-        # ClamAV not installed, try clamscan instead
-        try:
-            result = subprocess.run(
-                ['clamscan', '--no-summary', '--remove', file_path],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if result.returncode == 0:
-                return True, None
-            elif result.returncode == 1:
-                return False, "VIRUS_FOUND"
-            else:
-                return False, "SCANNING_ERROR"
-                
-        except FileNotFoundError:
-            # ClamAV not available, skip scanning with warning
-            print("WARNING: ClamAV not installed, skipping virus scan")
-            return True, None
-        except subprocess.TimeoutExpired:
-            # Scan timed out
-            return False, "SCAN_TIMEOUT"
-    except subprocess.TimeoutExpired:
-        return False, "SCAN_TIMEOUT"
+        buffer = io.BytesIO()
+        current.save(buffer, format='WebP', quality=quality, method=4)
+        derivatives[width] = buffer.getvalue()
+    return derivatives
+
+
+def generate_photo_derivatives(
+    file_content: Union[bytes, str],
+    widths=PHOTO_DERIVATIVE_WIDTHS,
+    quality: int = 80
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Generate responsive WebP sizes from an existing image
+    
+    JPEG sources are decoded with draft() at the smallest DCT scale that
+    still covers the largest requested width.
+    
+    Args:
+        file_content: Image bytes or path to the image file
+        widths: Target widths in pixels
+        quality: WebP quality
+    
+    Returns:
+        Tuple[{width: webp_bytes}, error_message]
+    """
+    try:
+        img = _open_image(file_content)
+        original_width = img.width
+        if widths and img.format == 'JPEG':
+            target_width = min(max(widths), original_width)
+            scale = target_width / original_width
+            img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+        img = _flatten_to_rgb(img)
+        # Ladder relative to the original size, even if draft decoded smaller
+        widths = [width for width in widths if width < original_width]
+        return _resize_ladder(img, widths, quality), None
     except Exception as e:
-        print(f"Error during virus scan: {e}")
-        # Don't block upload if scanning fails
-        return True, None
+        print(f"Error generating photo derivatives: {e}")
+        return None, "DERIVATIVE_ERROR"
 
 
-# ==================== IMAGE CONVERSION ====================
+# ==================== PERCEPTUAL HASH ====================
 
-def convert_to_webp(file_content: bytes, quality: int = 85) -> Tuple[bytes, Optional[str]]:
+def _dhash(img: Image.Image) -> str:
+    """
+    64-bit difference hash of an image as 16 hex characters
+    
+    The image is reduced to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right neighbour. Re-saved, recompressed or
+    resized copies of a photo differ by only a few bits (Hamming distance).
     """
-    Convert image to WebP format, preserving EXIF data
+    small = img.convert('L').resize((9, 8), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def compute_perceptual_hash(source: Union[bytes, str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Compute the dHash of an image file (e.g., a stored thumbnail)
     
     Args:
-        file_content: Original image bytes
-        quality: WebP quality (1-100, default 85)
+        source: Image bytes or path
     
     Returns:
-        Tuple[webp_bytes, error_message]
+        Tuple[hash_hex, error_message]
     """
     try:
-        # Open image from bytes
-        img = Image.open(io.BytesIO(file_content))
-        
-        # Preserve EXIF data if available
-        exif_data = None
-        try:
-            exif_data = img.info.get('exif')
-        except Exception:
-            pass
+        img = _open_image(source)
+        img.draft('L', (64, 64))
+        return _dhash(img), None
+    except Exception as e:
+        return None, f"Perceptual hash failed: {str(e)}"
 
-        # Convert to RGB if necessary (for RGBA images)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # Create white background
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
+
+def convert_photo_with_derivatives(
+    file_content: Union[bytes, str],
+    quality: int = PHOTO_WEBP_QUALITY,
+    thumbnail_size: Tuple[int, int] = PHOTO_THUMBNAIL_SIZE,
+    widths=PHOTO_DERIVATIVE_WIDTHS,
+    method: int = PHOTO_WEBP_METHOD
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Convert a photo to WebP and produce its thumbnail and width ladder from one decode
+    
+    Args:
+        file_content: Original image bytes or path to the image file
+        quality: WebP quality for the full-size image
+        thumbnail_size: Thumbnail bounding box
+        widths: Responsive widths in pixels
+        method: WebP encoder effort (0 fast - 6 smallest output)
+    
+    Returns:
+        Tuple[result, error_message]
+        result: {"webp": bytes, "thumbnail": bytes, "derivatives": {width: bytes},
+                 "width": int, "height": int, "perceptual_hash": str,
+                 "timings": {"decode"|"webp_encode"|"derivatives"|"thumbnail": seconds}}
+    """
+    try:
+        started = time.perf_counter()
+        img = _open_image(file_content)
+        exif_data = img.info.get('exif')
+        img = _flatten_to_rgb(img)
+        img.load()
+        timings = {"decode": time.perf_counter() - started}
         
-        # Save as WebP
+        # Full-size WebP (EXIF preserved)
+        started = time.perf_counter()
         webp_buffer = io.BytesIO()
-        kwargs = {
-            'format': 'WebP',
-            'quality': quality,
-            'method': 6  # Slow but better compression
-        }
-        
-        # Add EXIF if available
+        kwargs = {'format': 'WebP', 'quality': quality, 'method': method}
         if exif_data:
             kwargs['exif'] = exif_data
-        
         img.save(webp_buffer, **kwargs)
-        webp_buffer.seek(0)
+        timings["webp_encode"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        derivatives = _resize_ladder(img, widths)
+        timings["derivatives"] = time.perf_counter() - started
         
-        return webp_buffer.getvalue(), None
+        # Thumbnail (fits the box, same as Image.thumbnail without copying the full image)
+        started = time.perf_counter()
+        ratio = min(thumbnail_size[0] / img.width, thumbnail_size[1] / img.height, 1)
+        thumb_dims = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        thumb = img.resize(thumb_dims, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        thumb_buffer = io.BytesIO()
+        thumb.save(thumb_buffer, format='WebP', quality=80)
+        # From the thumbnail pixels already in memory (no extra full-size pass)
+        perceptual_hash = _dhash(thumb)
+        timings["thumbnail"] = time.perf_counter() - started
         
+        return {
+            "webp": webp_buffer.getvalue(),
+            "thumbnail": thumb_buffer.getvalue(),
+            "derivatives": derivatives,
+            "width": img.width,
+            "height": img.height,
+            "perceptual_hash": perceptual_hash,
+            "timings": timings,
+        }, None
+    
     except Exception as e:
-        print(f"Error converting image to WebP: {e}")
+        print(f"Error converting photo: {e}")
         return None, "CONVERSION_ERROR"
 
 
-def generate_thumbnail(file_content: bytes, size: Tuple[int, int] = (150, 150)) -> Tuple[bytes, Optional[str]]:
+def nearest_derivative_width(available_widths, requested_width: Optional[int]) -> Optional[int]:
     """
-    Generate thumbnail from image
+    Pick the stored width to serve for a requested width
     
     Args:
-        file_content: Image bytes
-        size: Thumbnail size (width, height)
+        available_widths: Widths stored for the photo
+        requested_width: Width asked for by the client (None for original)
     
     Returns:
-        Tuple[thumbnail_bytes, error_message]
+        Smallest stored width >= requested, or None to serve the original
     """
-    try:
-        img = Image.open(io.BytesIO(file_content))
-        
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        
-        # Create thumbnail
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        
-        # Save as WebP
-        thumb_buffer = io.BytesIO()
-        img.save(thumb_buffer, format='WebP', quality=80)
-        thumb_buffer.seek(0)
-        
-        return thumb_buffer.getvalue(), None
-        
-    except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        return None, "THUMBNAIL_ERROR"
+    if not requested_width:
+        return None
+    candidates = [width for width in available_widths if width >= requested_width]
+    return min(candidates) if candidates else None
 
 
 # ==================== FILE STORAGE ====================
@@ -255,7 +521,11 @@ def ensure_directory(directory_path: str) -> bool:
 
 def save_file_to_disk(file_content: bytes, file_path: str) -> Tuple[bool, Optional[str]]:
     """
-    Save file content to disk
+    Save file content to disk atomically
+    
+    The content is written to a temp file in the same directory, fsynced
+    and renamed over file_path, so readers and crash recovery see either
+    the old file or the complete new one, never a torn write.
     
     Args:
         file_content: File bytes
@@ -264,20 +534,26 @@ def save_file_to_disk(file_content: bytes, file_path: str) -> Tuple[bool, Option
     Returns:
         Tuple[success, error_message]
     """
+    # Ensure directory exists
+    directory = str(Path(file_path).parent)
+    if not ensure_directory(directory):
+        return False, "DIRECTORY_ERROR"
+    
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
     try:
-        # Ensure directory exists
-        directory = str(Path(file_path).parent)
-        if not ensure_directory(directory):
-            return False, "DIRECTORY_ERROR"
-        
-        # Write file
-        with open(file_path, 'wb') as f:
+        with open(tmp_path, 'wb') as f:
             f.write(file_content)
-        
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
         return True, None
         
     except Exception as e:
         print(f"Error saving file: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
         return False, "SAVE_ERROR"
 
 
@@ -361,13 +637,27 @@ def generate_file_id() -> str:
 
 # ==================== PDF CONVERSION ====================
 
-def image_to_pdf(image_bytes: bytes, mime_type: str = "image/jpeg") -> Tuple[Optional[bytes], Optional[str]]:
+# image_to_pdf output cap: pixels fit an A4 page at PDF_MAX_DPI
+# (200 DPI -> at most 1654 x 2339 px), embedded as JPEG at PDF_JPEG_QUALITY
+PDF_MAX_DPI = int(os.getenv("PDF_MAX_DPI", "200"))
+PDF_JPEG_QUALITY = int(os.getenv("PDF_JPEG_QUALITY", "80"))
+A4_INCHES = (8.27, 11.69)
+
+
+def image_to_pdf(
+    image_bytes: Union[bytes, str],
+    mime_type: str = "image/jpeg",
+    max_dpi: int = PDF_MAX_DPI,
+    quality: int = PDF_JPEG_QUALITY
+) -> Tuple[Optional[bytes], Optional[str]]:
     """
     Convert image to PDF
     
     Args:
-        image_bytes: Image file bytes
+        image_bytes: Image file bytes or path to the image file
         mime_type: MIME type of image
+        max_dpi: Output resolution cap for an A4 page
+        quality: JPEG quality of the embedded image
     
     Returns:
         Tuple[pdf_bytes, error_message]
@@ -375,23 +665,43 @@ def image_to_pdf(image_bytes: bytes, mime_type: str = "image/jpeg") -> Tuple[Opt
         - (None, error_msg) if failed
     
     Purpose: Convert uploaded images (JPEG, PNG) to PDF for community certificates
-    Preserves image quality and dimensions
+    
+    Memory and size are bounded by the output cap, not by the camera:
+    - JPEG is decoded at 1/2..1/8 scale (draft) when the photo is larger
+      than the cap, so a 12 MP photo never becomes a full-size bitmap
+    - Pixels are capped to A4 at max_dpi and embedded JPEG-compressed
+      (DCTDecode); grayscale scans stay single-channel
+    - Page size follows the capped resolution, so the PDF prints as A4
+      (or smaller for small images)
     """
     try:
-        # Open image from bytes
-        img = Image.open(io.BytesIO(image_bytes))
+        # Open image from bytes or path (pixels are not decoded yet)
+        img = _open_image(image_bytes)
         
-        # Convert RGBA to RGB if needed (PDF doesn't support transparency)
-        if img.mode == 'RGBA':
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            rgb_img.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-            img = rgb_img
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+        long_side = round(max(A4_INCHES) * max_dpi)
+        short_side = round(min(A4_INCHES) * max_dpi)
+        box = (long_side, short_side) if img.width >= img.height else (short_side, long_side)
+        
+        # JPEG only: let the decoder downscale by a power of two
+        img.draft(img.mode if img.mode in ('L', 'RGB') else 'RGB', box)
+        
+        # Phone photos: apply the EXIF rotation so the page is upright
+        img = ImageOps.exif_transpose(img)
+        box = (long_side, short_side) if img.width >= img.height else (short_side, long_side)
+        img.thumbnail(box, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        
+        # PDF has no transparency; DCTDecode needs L or RGB
+        if img.mode != 'L':
+            img = _flatten_to_rgb(img)
+        
+        # Resolution that fits the image on an A4 page (72 DPI minimum)
+        page_short, page_long = min(A4_INCHES), max(A4_INCHES)
+        page_w, page_h = (page_long, page_short) if img.width >= img.height else (page_short, page_long)
+        resolution = max(img.width / page_w, img.height / page_h, 72.0)
         
         # Convert to PDF
         pdf_bytes = io.BytesIO()
-        img.save(pdf_bytes, format='PDF', quality=95)
+        img.save(pdf_bytes, format='PDF', resolution=resolution, quality=quality)
         return pdf_bytes.getvalue(), None
     
     except Exception as e:
@@ -400,6 +710,112 @@ def image_to_pdf(image_bytes: bytes, mime_type: str = "image/jpeg") -> Tuple[Opt
         return None, error_msg
 
 
+def linearize_pdf(pdf_bytes: bytes) -> Tuple[bytes, Optional[str]]:
+    """
+    Rewrite a PDF linearized ("fast web view")
+    
+    Args:
+        pdf_bytes: PDF file bytes
+    
+    Returns:
+        Tuple[pdf_bytes, error_message]
+        - (linearized_bytes, None) if successful
+        - (pdf_bytes, None) if already linearized or pikepdf is not installed
+        - (pdf_bytes, error_msg) if rewriting failed (original bytes are kept)
+    
+    Purpose: Page one and the cross-reference data come first in the file, so
+    viewers render the first page while the rest is still downloading (with
+    the Range support of the PDF routes)
+    """
+    if pikepdf is None:
+        return pdf_bytes, None
+    
+    try:
+        with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+            if pdf.is_linearized:
+                return pdf_bytes, None
+            output = io.BytesIO()
+            pdf.save(output, linearize=True)
+            return output.getvalue(), None
+    except Exception as e:
+        error_msg = f"PDF linearization failed: {str(e)}"
+        print(f"[PDF CONVERSION WARNING] {error_msg}")
+        return pdf_bytes, error_msg
+
+
+# Bounding box (px) of PDF preview thumbnails, larger than photo thumbnails
+# so document text stays legible in the moderation grid
+PDF_PREVIEW_SIZE = int(os.getenv("PDF_PREVIEW_SIZE", "300"))
+
+
+def _render_pdf_first_page(source: Union[bytes, str], size: int) -> Optional[Image.Image]:
+    """Rasterize page one with pdfium, or take its largest embedded image"""
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(source)
+        try:
+            page = pdf[0]
+            # Render close to the target size instead of at full page resolution
+            scale = size * 2 / max(page.get_width(), page.get_height())
+            return page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+
+    if pikepdf is not None:
+        pdf_source = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        with pikepdf.open(pdf_source) as pdf:
+            images = [
+                pikepdf.PdfImage(image) for image in pdf.pages[0].images.values()
+            ]
+            if images:
+                largest = max(images, key=lambda image: image.width * image.height)
+                return largest.as_pil_image()
+    return None
+
+
+def generate_document_preview(
+    source: Union[bytes, str],
+    is_image: bool = False,
+    size: int = PDF_PREVIEW_SIZE,
+    quality: int = 75
+) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Generate a WebP preview of a document's first page
+    
+    Args:
+        source: PDF (or original image) bytes or file path
+        is_image: True when the upload was an image converted with image_to_pdf;
+            the preview is taken from the image itself instead of rendering the PDF
+        size: Bounding box in pixels
+        quality: WebP quality
+    
+    Returns:
+        Tuple[webp_bytes, error_message]
+        - (webp_bytes, None) if successful
+        - (None, error_msg) if no renderer is available or rendering failed
+    
+    Purpose: Admins review certificates/horoscopes from a thumbnail grid
+    without downloading each PDF
+    """
+    try:
+        if is_image:
+            img = _open_image(source)
+            # JPEG: decode at reduced scale (no full-resolution pixels needed)
+            img.draft('RGB', (size, size))
+        else:
+            img = _render_pdf_first_page(source, size)
+            if img is None:
+                return None, "No PDF renderer available (install pypdfium2 or pikepdf)"
+        
+        img = _flatten_to_rgb(img)
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        
+        output = io.BytesIO()
+        img.save(output, format='WEBP', quality=quality)
+        return output.getvalue(), None
+    except Exception as e:
+        return None, f"Preview generation failed: {str(e)}"
+
+
 def validate_pdf_file(file_content: bytes) -> Tuple[bool, Optional[str]]:
     """
     Validate PDF file
@@ -417,3 +833,160 @@ def validate_pdf_file(file_content: bytes) -> Tuple[bool, Optional[str]]:
         return True, None
     except Exception as e:
         return False, f"PDF validation error: {str(e)}"
+
+
+# ==================== IMAGE PROCESSING POOL ====================
+
+# Worker processes for CPU-heavy Pillow work (WebP encode, thumbnails, PDF)
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", "2"))
+# Maximum tasks queued or running at once; further callers wait for a slot
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", "16"))
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float]:
+    """
+    Run func inside a worker process and measure its execution time
+
+    Returns:
+        Tuple[result, elapsed_seconds]
+    """
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+class ImageProcessingService:
+    """
+    Bounded ProcessPoolExecutor for Pillow work called from async routes
+
+    - At most max_pending tasks are submitted at once (backpressure via semaphore)
+    - Executor is created lazily so it is forked inside each gunicorn worker
+    - Tracks queue depth and per-task timing (wait, run, total)
+
+    Usage:
+        result, error = await image_processor.run(convert_photo_with_derivatives, content)
+    """
+
+    def __init__(self, max_workers: int = IMAGE_POOL_WORKERS, max_pending: int = IMAGE_POOL_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._task_stats = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _record(self, name: str, wait_s: float, run_s: float, failed: bool) -> None:
+        with self._lock:
+            stats = self._task_stats.setdefault(name, {
+                "count": 0, "failures": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0,
+                "wait_total_ms": 0.0, "run_total_ms": 0.0,
+            })
+            total_ms = (wait_s + run_s) * 1000
+            stats["count"] += 1
+            stats["failures"] += int(failed)
+            stats["total_ms"] += total_ms
+            stats["max_ms"] = max(stats["max_ms"], total_ms)
+            stats["last_ms"] = total_ms
+            stats["wait_total_ms"] += wait_s * 1000
+            stats["run_total_ms"] += run_s * 1000
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a picklable module-level function in the process pool
+
+        Args:
+            func: Function to run (e.g., convert_photo_with_derivatives)
+            *args, **kwargs: Arguments passed to func
+
+        Returns:
+            Whatever func returns
+        """
+        name = getattr(func, "__name__", repr(func))
+        queued_at = time.perf_counter()
+
+        with self._lock:
+            self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        with self._lock:
+            self._in_flight += 1
+        run_s = 0.0
+        failed = True
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                result, run_s = await loop.run_in_executor(
+                    self._get_executor(), _timed_call, func, args, kwargs
+                )
+            except BrokenProcessPool:
+                # A worker died (e.g., OOM on a hostile image); start fresh next time
+                self._reset_executor()
+                raise
+            failed = False
+            return result
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+            elapsed = time.perf_counter() - queued_at
+            self._record(name, max(elapsed - run_s, 0.0), run_s, failed)
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of pool metrics
+
+        Returns:
+            Dict with queue depth, in-flight count and per-task timings
+        """
+        with self._lock:
+            queue_depth = self._waiting + max(self._in_flight - self.max_workers, 0)
+            tasks = {}
+            for name, stats in self._task_stats.items():
+                count = stats["count"] or 1
+                tasks[name] = {
+                    "count": stats["count"],
+                    "failures": stats["failures"],
+                    "avg_ms": round(stats["total_ms"] / count, 2),
+                    "avg_wait_ms": round(stats["wait_total_ms"] / count, 2),
+                    "avg_run_ms": round(stats["run_total_ms"] / count, 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                    "last_ms": round(stats["last_ms"], 2),
+                }
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "queue_depth": queue_depth,
+                "tasks": tasks,
+            }
+
+    def shutdown(self) -> None:
+        """Stop worker processes (called on application shutdown)"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+# Shared instance used by the upload routes
+image_processor = ImageProcessingService()
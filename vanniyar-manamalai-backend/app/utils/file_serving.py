@@ -0,0 +1,198 @@
+# app/utils/file_serving.py
+"""
+Response helpers for serving stored files
+- Strong ETags from stored SHA256 checksums, with If-None-Match -> 304
+- Cache-Control: immutable for content-hashed URLs (?v=<hash prefix>)
+- multipart/mixed bodies for batch responses
+- A single stat per request (missing files -> 404), so routes can skip
+  their own os.path.exists checks
+- Range / If-Range: FileResponse (starlette>=0.39) answers 206 / 416 and
+  compares If-Range with the strong ETag set here, so interrupted PDF
+  downloads resume instead of starting over; in x-accel mode nginx serves
+  the ranges itself with sendfile (ASGI gives Python no socket for
+  os.sendfile, so x-accel is the zero-copy path)
+- Optional nginx offload (FILE_SERVE_MODE=x-accel): the route only does the
+  lookup and returns X-Accel-Redirect to an internal location, so Python
+  workers never stream file bytes
+- Remote storage (STORAGE_BACKEND=s3): 307 redirect to a presigned URL
+  after the ETag check, so the bucket serves the bytes
+
+nginx (see manamalai_nginx_uploads.conf):
+    location /protected-uploads/ {
+        internal;
+        alias /srv/uploads/;
+        etag off;
+        add_header ETag $upstream_http_etag;
+    }
+"""
+
+import os
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from app.utils.storage import UPLOAD_ROOT, get_storage, key_for_path
+
+
+# ==================== CONFIGURATION ====================
+
+# "python": stream with FileResponse (development), "x-accel": hand off to nginx
+FILE_SERVE_MODE = os.getenv("FILE_SERVE_MODE", "python").lower()
+# Internal nginx location that maps to UPLOAD_ROOT
+X_ACCEL_PREFIX = os.getenv("X_ACCEL_PREFIX", "/protected-uploads/")
+
+# Length of the hash prefix used in ?v= cache-busting parameters
+URL_VERSION_LENGTH = 16
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Private documents and unversioned URLs: always revalidate (cheap 304s)
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+# Redirects to presigned URLs expire with the signature
+REDIRECT_CACHE_CONTROL = "private, no-store"
+
+
+# ==================== HELPERS ====================
+
+def make_etag(checksum: Optional[str], variant: str = "") -> Optional[str]:
+    """
+    Strong ETag for a stored representation
+
+    Args:
+        checksum: SHA256 hex of the stored (or original) content
+        variant: Distinguishes representations of the same file (e.g., "thumb", "w320")
+
+    Returns:
+        Quoted ETag or None if no checksum is known
+    """
+    if not checksum:
+        return None
+    return f'"{checksum}-{variant}"' if variant else f'"{checksum}"'
+
+
+def versioned_url(url: str, checksum: Optional[str]) -> str:
+    """
+    Add a content-hash version parameter so the URL can be cached as immutable
+
+    Args:
+        url: Route URL (e.g., "/files/{id}/thumbnail")
+        checksum: SHA256 hex of the content
+
+    Returns:
+        URL with ?v=<hash prefix> (unchanged if checksum is unknown)
+    """
+    if not checksum:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}v={checksum[:URL_VERSION_LENGTH]}"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison per RFC 9110 for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _accel_uri(path: str) -> Optional[str]:
+    try:
+        relative = Path(path).resolve().relative_to(UPLOAD_ROOT.resolve())
+    except ValueError:
+        return None
+    return X_ACCEL_PREFIX.rstrip("/") + "/" + relative.as_posix()
+
+
+def serve_file(
+    request: Request,
+    path: str,
+    media_type: str,
+    checksum: Optional[str] = None,
+    variant: str = "",
+    private: bool = False
+) -> Response:
+    """
+    Serve a stored file with ETag / 304 handling and optional nginx offload
+
+    Args:
+        request: Incoming request (If-None-Match, ?v=)
+        path: File path on disk
+        media_type: Content-Type
+        checksum: SHA256 used for the ETag and URL version
+        variant: Representation name when one file has several (thumbnail, widths)
+        private: Never mark as public/immutable (certificates, horoscopes)
+
+    Returns:
+        304 Response, 307 redirect to a presigned URL (remote storage),
+        X-Accel-Redirect Response or FileResponse
+        (206 for a satisfiable Range whose If-Range, if any, matches the ETag)
+
+    Raises:
+        HTTPException 404 if the file is missing on disk (python mode)
+    """
+    etag = make_etag(checksum, variant)
+    version = request.query_params.get("v")
+    if not private and checksum and version and checksum.startswith(version) and len(version) >= 8:
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = REVALIDATE_CACHE_CONTROL
+
+    headers = {"Cache-Control": cache_control}
+    if etag:
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    storage = get_storage()
+    if path and storage.local_path(key_for_path(path)) is None:
+        url = storage.presign(key_for_path(path), content_type=media_type)
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": REDIRECT_CACHE_CONTROL})
+
+    if FILE_SERVE_MODE == "x-accel":
+        accel_uri = _accel_uri(path)
+        if accel_uri:
+            headers["X-Accel-Redirect"] = accel_uri
+            return Response(media_type=media_type, headers=headers)
+
+    # One stat for both the existence check and FileResponse's headers
+    try:
+        stat_result = os.stat(path)
+    except (FileNotFoundError, TypeError):
+        raise HTTPException(status_code=404, detail="File not found on disk")
+
+    return FileResponse(path=path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+def multipart_mixed_response(parts: List[Tuple[str, str, Optional[str], bytes]]) -> Response:
+    """
+    Build a multipart/mixed response with one part per file
+
+    Args:
+        parts: List of (content_id, media_type, etag, content)
+
+    Returns:
+        Response with Content-Type multipart/mixed; boundary=...
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for content_id, media_type, etag, content in parts:
+        headers = [
+            f"--{boundary}",
+            f"Content-Type: {media_type}",
+            f"Content-ID: <{content_id}>",
+            f"Content-Length: {len(content)}",
+        ]
+        if etag:
+            headers.append(f"ETag: {etag}")
+        chunks.append(("\r\n".join(headers) + "\r\n\r\n").encode("ascii"))
+        chunks.append(content)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+    return Response(
+        content=b"".join(chunks),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers={"Cache-Control": REVALIDATE_CACHE_CONTROL}
+    )
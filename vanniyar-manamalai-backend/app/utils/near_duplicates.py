@@ -0,0 +1,342 @@
+# app/utils/near_duplicates.py
+"""
+Near-duplicate photo detection
+- Every ready photo has a 64-bit dHash (files.perceptual_hash, computed by
+  convert_photo_with_derivatives)
+- Hashes are indexed in an in-memory BK-tree keyed by Hamming distance,
+  so a lookup visits a small part of the tree instead of every photo
+- The index is per process: loaded lazily, updated as this process stores
+  or deletes photos, and rebuilt after NEAR_DUPLICATE_INDEX_TTL seconds to
+  pick up changes made by other workers; matches are re-checked against
+  the database before they are returned
+
+Backfill photos stored before hashes existed:
+    python -m app.utils.near_duplicates --backfill
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from app.database import SessionLocal
+from app.models.family import FamilyDetails
+from app.models.file import File, FileKindEnum, ProcessingStatusEnum
+from app.utils.file_handler import compute_perceptual_hash
+from app.utils.storage import get_storage, key_for_path, run_sync
+
+
+# ==================== CONFIGURATION ====================
+
+# Maximum Hamming distance (of 64 bits) treated as the same photo
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "6"))
+# Seconds before the index is rebuilt from the database
+NEAR_DUPLICATE_INDEX_TTL = int(os.getenv("NEAR_DUPLICATE_INDEX_TTL", "600"))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ==================== BK-TREE ====================
+
+class BKTree:
+    """
+    BK-tree over integer hashes with Hamming distance
+
+    Each node keeps the items sharing its hash and children keyed by their
+    distance to the node. A search for radius r only descends into children
+    whose key is within r of the query's distance to the node.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, [items], {distance: node}]
+        self.size = 0
+
+    def add(self, value: int, item) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """Return (distance, item) for every item within max_distance"""
+        results = []
+        if self._root is None:
+            return results
+        stack = [self._root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+# ==================== INDEX ====================
+
+class NearDuplicateIndex:
+    """
+    Process-local BK-tree of ready photos' perceptual hashes
+
+    Usage:
+        matches = near_duplicate_index.find(db, perceptual_hash, exclude_ids=profile_file_ids)
+        near_duplicate_index.add(file_id, perceptual_hash)   # after the photo is ready
+        near_duplicate_index.discard(file_id)                 # after delete
+    """
+
+    def __init__(self, ttl_seconds: int = NEAR_DUPLICATE_INDEX_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._tree = BKTree()
+        self._hashes: Dict[str, int] = {}
+        self._removed = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load(self, db) -> None:
+        tree = BKTree()
+        hashes = {}
+        rows = (
+            db.query(File.id, File.perceptual_hash)
+            .filter(
+                File.file_kind == FileKindEnum.image,
+                File.processing_status == ProcessingStatusEnum.ready,
+                File.perceptual_hash.isnot(None)
+            )
+            .yield_per(5000)
+        )
+        for file_id, perceptual_hash in rows:
+            if not perceptual_hash:
+                continue  # backfill marker for unreadable thumbnails
+            value = int(perceptual_hash, 16)
+            hashes[file_id] = value
+            tree.add(value, file_id)
+        with self._lock:
+            self._tree, self._hashes, self._removed = tree, hashes, set()
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self, db) -> None:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self._load(db)
+
+    def add(self, file_id: str, perceptual_hash: Optional[str]) -> None:
+        if not perceptual_hash or self._loaded_at is None:
+            # Not loaded yet: the next load reads it from the database
+            return
+        value = int(perceptual_hash, 16)
+        with self._lock:
+            self._removed.discard(file_id)
+            if self._hashes.get(file_id) != value:
+                self._hashes[file_id] = value
+                self._tree.add(value, file_id)
+
+    def discard(self, file_id: str) -> None:
+        # BK-trees have no cheap delete; removed IDs are filtered until the next rebuild
+        with self._lock:
+            if self._hashes.pop(file_id, None) is not None:
+                self._removed.add(file_id)
+
+    @staticmethod
+    def _still_ready(db, file_ids: Iterable[str]) -> set:
+        file_ids = list(file_ids)
+        if not file_ids:
+            return set()
+        return {
+            file_id for (file_id,) in db.query(File.id).filter(
+                File.id.in_(file_ids), File.processing_status == ProcessingStatusEnum.ready
+            )
+        }
+
+    def find(
+        self,
+        db,
+        perceptual_hash: str,
+        max_distance: int = NEAR_DUPLICATE_DISTANCE,
+        exclude_ids: Iterable[str] = ()
+    ) -> List[dict]:
+        """
+        Find ready photos within max_distance of a hash
+
+        Args:
+            db: Database session
+            perceptual_hash: dHash hex of the photo
+            max_distance: Maximum Hamming distance
+            exclude_ids: File IDs to ignore (e.g., the uploader's own photos)
+
+        Returns:
+            List of {"file_id", "distance"} ordered by distance
+        """
+        self._ensure_fresh(db)
+        exclude = set(exclude_ids)
+        with self._lock:
+            matches = [
+                (distance, file_id)
+                for distance, file_id in self._tree.search(int(perceptual_hash, 16), max_distance)
+                if file_id not in exclude and file_id not in self._removed
+            ]
+        ready = self._still_ready(db, {file_id for _, file_id in matches})
+        return [
+            {"file_id": file_id, "distance": distance}
+            for distance, file_id in sorted(matches) if file_id in ready
+        ]
+
+    def report(self, db, max_distance: int = NEAR_DUPLICATE_DISTANCE, limit: int = 200) -> List[dict]:
+        """
+        List near-duplicate photo pairs (one tree search per photo, no pairwise scan)
+
+        Returns:
+            List of {"file_id", "other_file_id", "distance", "profile_id",
+            "other_profile_id", "same_profile"} (at most limit pairs)
+        """
+        self._ensure_fresh(db)
+        with self._lock:
+            hashes = list(self._hashes.items())
+            tree, removed = self._tree, set(self._removed)
+
+        pairs = []
+        for file_id, value in hashes:
+            for distance, other_id in tree.search(value, max_distance):
+                # Each pair once; ignore the photo itself
+                if other_id <= file_id or other_id in removed:
+                    continue
+                pairs.append((distance, file_id, other_id))
+            if len(pairs) >= limit * 2:
+                break
+        pairs.sort()
+
+        ready = self._still_ready(db, {file_id for _, a, b in pairs for file_id in (a, b)})
+        pairs = [pair for pair in pairs if pair[1] in ready and pair[2] in ready][:limit]
+
+        owners = self._photo_owners(db, {file_id for _, a, b in pairs for file_id in (a, b)})
+        return [
+            {
+                "file_id": a,
+                "other_file_id": b,
+                "distance": distance,
+                "profile_id": owners.get(a),
+                "other_profile_id": owners.get(b),
+                "same_profile": owners.get(a) is not None and owners.get(a) == owners.get(b),
+            }
+            for distance, a, b in pairs
+        ]
+
+    @staticmethod
+    def _photo_owners(db, file_ids: set) -> Dict[str, int]:
+        if not file_ids:
+            return {}
+        owners = {}
+        families = db.query(
+            FamilyDetails.profile_id, FamilyDetails.photo_file_id_1, FamilyDetails.photo_file_id_2
+        ).filter(
+            or_(FamilyDetails.photo_file_id_1.in_(file_ids), FamilyDetails.photo_file_id_2.in_(file_ids))
+        )
+        for profile_id, photo_1, photo_2 in families:
+            for file_id in (photo_1, photo_2):
+                if file_id in file_ids:
+                    owners[file_id] = profile_id
+        return owners
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "photos": len(self._hashes),
+                "tree_nodes_added": self._tree.size,
+                "removed_pending_rebuild": len(self._removed),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            }
+
+
+# ==================== BACKFILL ====================
+
+def backfill_perceptual_hashes(db, batch_size: int = 500) -> int:
+    """
+    Compute perceptual hashes for ready photos stored without one
+
+    Hashes are computed from the stored thumbnails (small files), read
+    through the storage backend (local disk or S3), one get_many per batch.
+
+    Returns:
+        Number of files updated
+    """
+    updated = 0
+    while True:
+        files = (
+            db.query(File)
+            .filter(
+                File.file_kind == FileKindEnum.image,
+                File.processing_status == ProcessingStatusEnum.ready,
+                File.perceptual_hash.is_(None),
+                File.thumbnail_path.isnot(None)
+            )
+            .limit(batch_size)
+            .all()
+        )
+        if not files:
+            break
+        progressed = False
+        thumbnails = run_sync(get_storage().get_many(key_for_path(f.thumbnail_path) for f in files))
+        for db_file in files:
+            thumbnail = thumbnails.get(key_for_path(db_file.thumbnail_path))
+            if thumbnail is None:
+                perceptual_hash, error = None, "Thumbnail not found in storage"
+            else:
+                perceptual_hash, error = compute_perceptual_hash(thumbnail)
+            # Unreadable thumbnails get an empty marker so the loop moves on
+            db_file.perceptual_hash = perceptual_hash or ""
+            if perceptual_hash:
+                updated += 1
+                progressed = True
+            else:
+                print(f"[NEAR DUPLICATES] {db_file.id}: {error}")
+        db.commit()
+        if not progressed and len(files) < batch_size:
+            break
+    return updated
+
+
+# Shared index used by the upload worker and /files/admin/near-duplicates
+near_duplicate_index = NearDuplicateIndex()
+
+
+def find_near_duplicates(perceptual_hash: str, exclude_ids: Iterable[str] = ()) -> List[dict]:
+    """Look up near-duplicates with a session of its own (for asyncio.to_thread)"""
+    db = SessionLocal()
+    try:
+        return near_duplicate_index.find(db, perceptual_hash, exclude_ids=exclude_ids)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate photo index tools")
+    parser.add_argument("--backfill", action="store_true", help="Hash ready photos that have no perceptual hash")
+    parser.add_argument("--report", action="store_true", help="Print near-duplicate pairs")
+    parser.add_argument("--max-distance", type=int, default=NEAR_DUPLICATE_DISTANCE)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.backfill:
+            print(f"[NEAR DUPLICATES] Backfilled {backfill_perceptual_hashes(db)} photos")
+        if args.report:
+            for pair in near_duplicate_index.report(db, max_distance=args.max_distance):
+                print(pair)
+    finally:
+        db.close()
@@ -0,0 +1,181 @@
+# app/utils/read_routing.py
+"""
+Read-replica routing for read-only routes (get_read_db in app/database.py)
+- Reads go to the replica while its replication lag is at most
+  REPLICA_MAX_LAG_SECONDS; lag is polled at most every
+  REPLICA_LAG_CHECK_SECONDS (SHOW REPLICA STATUS) by the request that finds
+  it stale, the others use the last result
+- Unreachable replica, stopped replication or too much lag: reads fall back
+  to the primary until the next check says otherwise
+- Read-your-writes: a successful write (POST/PUT/PATCH/DELETE) sets a
+  short-lived cookie; that client's reads go to the primary until it
+  expires, so a PATCH followed by a GET never sees the old row
+- Routing decisions and the last lag are exposed by GET /admin/db/replica
+
+READ_YOUR_WRITES_SECONDS must cover REPLICA_MAX_LAG_SECONDS plus
+REPLICA_LAG_CHECK_SECONDS: once the cookie expires, a replica within the lag
+limit already has the write.
+"""
+
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import exc
+
+
+# ==================== CONFIGURATION ====================
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+# "none" for a frontend on another site (requires HTTPS; the frontend must
+# send credentials, CORS allow_credentials is already on)
+READ_YOUR_WRITES_SAMESITE = os.getenv("READ_YOUR_WRITES_SAMESITE", "lax").lower()
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+# ==================== HELPERS ====================
+
+def _replication_status(conn) -> Optional[dict]:
+    """
+    Replication status row of the server behind conn
+
+    Returns:
+        Status mapping, or None if the server is not replicating (e.g. a
+        standalone instance standing in for a replica in tests)
+    """
+    # SHOW REPLICA STATUS needs MySQL 8.0.22+; older servers only know SHOW SLAVE STATUS
+    for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+        try:
+            row = conn.exec_driver_sql(statement).mappings().first()
+            return dict(row) if row else None
+        except exc.ProgrammingError:
+            conn.rollback()
+    raise RuntimeError("Server supports neither SHOW REPLICA STATUS nor SHOW SLAVE STATUS")
+
+
+def _recent_write_until(request) -> float:
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        return 0.0
+
+
+# ==================== ROUTER ====================
+
+class ReplicaRouter:
+    """Decides per request whether a read may use the replica"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._check_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._checked_at = None         # time.monotonic() of the last lag check
+        # Primary until the first check has passed
+        self.usable = False
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.routed = {
+            "replica": 0,
+            "primary_recent_write": 0,
+            "primary_lag": 0,
+            "primary_unavailable": 0,
+        }
+
+    def _check(self) -> None:
+        """Poll replication lag and update usable / lag_seconds / last_error"""
+        try:
+            with self.engine.connect() as conn:
+                status = _replication_status(conn)
+        except Exception as e:
+            usable, lag, error = False, None, f"Replica check failed: {e}"
+        else:
+            if status is None:
+                usable, lag, error = True, 0.0, None
+            else:
+                lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+                if lag is None:
+                    # NULL while the SQL or IO thread is stopped
+                    usable, error = False, "Replication is not running"
+                else:
+                    lag = float(lag)
+                    usable = lag <= REPLICA_MAX_LAG_SECONDS
+                    error = None if usable else f"Replica lag {lag:.0f}s exceeds {REPLICA_MAX_LAG_SECONDS:.0f}s"
+
+        if usable != self.usable:
+            print(f"[DB REPLICA] Reading from {'replica' if usable else 'primary'}"
+                  f"{'' if usable else f': {error}'}")
+        self.usable, self.lag_seconds, self.last_error = usable, lag, error
+
+    def _replica_state(self) -> Tuple[bool, Optional[str]]:
+        """
+        Current replica state, re-checked when older than REPLICA_LAG_CHECK_SECONDS
+
+        Returns:
+            Tuple[usable, fallback_reason]
+        """
+        stale = self._checked_at is None or time.monotonic() - self._checked_at >= REPLICA_LAG_CHECK_SECONDS
+        # One request re-checks; concurrent ones route on the previous result
+        if stale and self._check_lock.acquire(blocking=False):
+            try:
+                self._check()
+                self._checked_at = time.monotonic()
+            finally:
+                self._check_lock.release()
+
+        if self.usable:
+            return True, None
+        return False, "primary_lag" if self.lag_seconds is not None else "primary_unavailable"
+
+    def use_replica(self, request) -> bool:
+        """
+        Whether this request's reads may go to the replica
+
+        Args:
+            request: Incoming request (read-your-writes cookie)
+
+        Returns:
+            True for the replica, False for the primary
+        """
+        if _recent_write_until(request) > time.time():
+            usable, route = False, "primary_recent_write"
+        else:
+            usable, reason = self._replica_state()
+            route = "replica" if usable else reason
+
+        with self._stats_lock:
+            self.routed[route] += 1
+        return usable
+
+    def mark_write(self, request, response) -> None:
+        """Pin the client's reads to the primary after a successful write"""
+        if request.method not in WRITE_METHODS or response.status_code >= 400:
+            return
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+            max_age=READ_YOUR_WRITES_SECONDS,
+            httponly=True,
+            samesite=READ_YOUR_WRITES_SAMESITE,
+            secure=READ_YOUR_WRITES_SAMESITE == "none"
+        )
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            routed = dict(self.routed)
+        return {
+            "configured": True,
+            "usable": self.usable,
+            "lag_seconds": self.lag_seconds,
+            "last_error": self.last_error,
+            "checked_seconds_ago": round(time.monotonic() - self._checked_at, 3) if self._checked_at else None,
+            "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+            "lag_check_seconds": REPLICA_LAG_CHECK_SECONDS,
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+            "routed": routed,
+        }
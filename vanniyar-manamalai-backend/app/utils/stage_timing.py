@@ -0,0 +1,201 @@
+# app/utils/stage_timing.py
+"""
+Per-stage timing for the upload pipeline
+- StageTimer measures named stages of one upload with a monotonic clock
+  (time.perf_counter)
+- StageHistograms aggregates the stages of every upload into fixed-bucket
+  histograms per pipeline (request.photo, worker.photo, ...)
+- Breakdowns are exposed as a Server-Timing header (UPLOAD_TIMING_HEADER=true),
+  JSON or Prometheus text via GET /files/admin/upload-timings
+
+Usage:
+    timer = StageTimer()
+    with timer.stage("ingest"):
+        ...
+    upload_timings.observe("request.photo", timer)
+    response.headers["Server-Timing"] = timer.server_timing()
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+# ==================== CONFIGURATION ====================
+
+# Add a Server-Timing header with the stage breakdown to upload/status responses
+UPLOAD_TIMING_HEADER = os.getenv("UPLOAD_TIMING_HEADER", "false").lower() == "true"
+
+# Histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+TIMING_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Worker breakdowns kept for GET /files/{id}/status
+MAX_TRACKED_BREAKDOWNS = 1000
+
+
+# ==================== TIMER ====================
+
+def server_timing_header(breakdown_ms: Dict[str, float]) -> str:
+    """Server-Timing header value, e.g. 'ingest;dur=12.1, scan;dur=40.3, total;dur=55.0'"""
+    return ", ".join(f"{name.replace('.', '-')};dur={ms}" for name, ms in breakdown_ms.items())
+
+
+class StageTimer:
+    """Stage durations of one upload, in the order they ran"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as stage `name` (repeated stages add up)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        """Add a duration measured elsewhere (e.g., inside a pool worker)"""
+        self.stages[name] = self.stages.get(name, 0.0) + max(seconds, 0.0)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        """Stage durations plus total, in milliseconds"""
+        result = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        result["total"] = round(self.total() * 1000, 2)
+        return result
+
+    def server_timing(self) -> str:
+        return server_timing_header(self.breakdown_ms())
+
+
+# ==================== HISTOGRAMS ====================
+
+class StageHistograms:
+    """Thread-safe per-pipeline, per-stage latency histograms"""
+
+    def __init__(self, buckets_ms=TIMING_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        # (pipeline, stage) -> [bucket counts (+Inf last), count, sum_ms, max_ms]
+        self._series = {}
+        self._recent = OrderedDict()
+
+    def _observe_ms(self, pipeline: str, stage: str, value_ms: float) -> None:
+        series = self._series.get((pipeline, stage))
+        if series is None:
+            series = self._series[(pipeline, stage)] = [[0] * (len(self.buckets_ms) + 1), 0, 0.0, 0.0]
+        index = len(self.buckets_ms)
+        for position, bound in enumerate(self.buckets_ms):
+            if value_ms <= bound:
+                index = position
+                break
+        series[0][index] += 1
+        series[1] += 1
+        series[2] += value_ms
+        series[3] = max(series[3], value_ms)
+
+    def observe(self, pipeline: str, timer: StageTimer, file_id: Optional[str] = None) -> Dict[str, float]:
+        """
+        Record every stage of a finished upload (and its total)
+
+        Args:
+            pipeline: Series name, e.g. "request.photo" or "worker.horoscope"
+            timer: Timer of the finished upload
+            file_id: Keep the breakdown for GET /files/{id}/status when given
+
+        Returns:
+            Breakdown in milliseconds
+        """
+        breakdown = timer.breakdown_ms()
+        with self._lock:
+            for stage, value_ms in breakdown.items():
+                self._observe_ms(pipeline, stage, value_ms)
+            if file_id:
+                self._recent[file_id] = breakdown
+                while len(self._recent) > MAX_TRACKED_BREAKDOWNS:
+                    self._recent.popitem(last=False)
+        return breakdown
+
+    def observe_value(self, pipeline: str, stage: str, seconds: float) -> None:
+        """Record a single duration measured outside a StageTimer"""
+        with self._lock:
+            self._observe_ms(pipeline, stage, round(seconds * 1000, 2))
+
+    def get_breakdown(self, file_id: str) -> Optional[Dict[str, float]]:
+        """Worker breakdown of a recently processed file (this process only)"""
+        with self._lock:
+            return self._recent.get(file_id)
+
+    def _quantile(self, counts: list, count: int, max_ms: float, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation (max beyond the last bucket)
+        target = q * count
+        running = 0
+        for position, bucket_count in enumerate(counts[:-1]):
+            running += bucket_count
+            if running >= target:
+                return self.buckets_ms[position]
+        return round(max_ms, 2)
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of all histograms
+
+        Returns:
+            {pipeline: {stage: {count, avg_ms, max_ms, p50_ms, p95_ms, p99_ms,
+            buckets: {le: cumulative count}}}}, stages ordered by total time spent
+        """
+        with self._lock:
+            series = {key: (list(value[0]), value[1], value[2], value[3]) for key, value in self._series.items()}
+
+        result = {}
+        for (pipeline, stage), (counts, count, sum_ms, max_ms) in sorted(
+            series.items(), key=lambda item: -item[1][2]
+        ):
+            cumulative, running = {}, 0
+            for position, bucket_count in enumerate(counts):
+                running += bucket_count
+                bound = self.buckets_ms[position] if position < len(self.buckets_ms) else "+Inf"
+                cumulative[str(bound)] = running
+            result.setdefault(pipeline, {})[stage] = {
+                "count": count,
+                "sum_ms": round(sum_ms, 2),
+                "avg_ms": round(sum_ms / count, 2) if count else 0.0,
+                "max_ms": round(max_ms, 2),
+                "p50_ms": self._quantile(counts, count, max_ms, 0.50),
+                "p95_ms": self._quantile(counts, count, max_ms, 0.95),
+                "p99_ms": self._quantile(counts, count, max_ms, 0.99),
+                "buckets": cumulative,
+            }
+        return result
+
+    def prometheus_text(self, metric: str = "upload_stage_duration_seconds") -> str:
+        """Histograms in the Prometheus text exposition format"""
+        with self._lock:
+            series = {key: (list(value[0]), value[1], value[2]) for key, value in sorted(self._series.items())}
+
+        lines = [
+            f"# HELP {metric} Upload pipeline stage duration",
+            f"# TYPE {metric} histogram",
+        ]
+        for (pipeline, stage), (counts, count, sum_ms) in series.items():
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            running = 0
+            for position, bucket_count in enumerate(counts):
+                running += bucket_count
+                bound = f"{self.buckets_ms[position] / 1000:g}" if position < len(self.buckets_ms) else "+Inf"
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {running}')
+            lines.append(f"{metric}_sum{{{labels}}} {sum_ms / 1000:.6f}")
+            lines.append(f"{metric}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared histograms for the upload routes and the background queue
+upload_timings = StageHistograms()
@@ -0,0 +1,393 @@
+# app/utils/storage.py
+"""
+Storage backends for processed uploads
+- One interface (put / get / get_many / stream / delete / exists / presign)
+  with a local-disk backend (aiofiles) and an S3-compatible backend (AWS S3,
+  MinIO, ...), selected by STORAGE_BACKEND
+- Keys are paths relative to UPLOAD_ROOT (e.g. "store/ab/cd/<sha256>.webp",
+  "horoscope/S1_horoscope.pdf"); files rows keep their UPLOAD_ROOT-based
+  paths, so switching backends needs no row migration and S3 object names
+  mirror the local layout
+- Quarantine, job manifests and the resize cache stay on local disk: they
+  are per-node scratch space, not shared storage
+
+Configuration:
+    STORAGE_BACKEND=local                 # default
+    UPLOAD_ROOT=/srv/uploads              # local root and key base
+
+    STORAGE_BACKEND=s3
+    S3_BUCKET=manamalai-uploads
+    S3_ENDPOINT_URL=http://127.0.0.1:9000 # MinIO; omit for AWS
+    S3_REGION=ap-south-1
+    S3_ACCESS_KEY_ID=... / S3_SECRET_ACCESS_KEY=...
+
+Usage:
+    storage = get_storage()
+    saved, error = await storage.put(key_for_path(path), content, "image/webp")
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import platform
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # optional: only needed for STORAGE_BACKEND=s3
+    boto3 = None
+    BotoConfig = None
+    ClientError = Exception
+
+
+# ==================== CONFIGURATION ====================
+
+if platform.system() == 'Windows':
+    UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", "./uploads"))
+else:
+    UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", "/srv/uploads"))
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+
+# Lifetime of presigned download URLs
+STORAGE_PRESIGN_SECONDS = int(os.getenv("STORAGE_PRESIGN_SECONDS", "300"))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# ==================== KEYS ====================
+
+def key_for_path(path: str) -> str:
+    """
+    Storage key for a path under UPLOAD_ROOT
+
+    Args:
+        path: Stored path, e.g. "/srv/uploads/store/ab/cd/abcd...ef.webp"
+
+    Returns:
+        Key like "store/ab/cd/abcd...ef.webp"
+    """
+    try:
+        return Path(path).relative_to(UPLOAD_ROOT).as_posix()
+    except ValueError:
+        # Paths stored with a different root (or relative): keep the name below the root
+        return Path(path).as_posix().lstrip("/")
+
+
+def path_for_key(key: str) -> str:
+    """Local path of a key (inverse of key_for_path)"""
+    return str(UPLOAD_ROOT / key)
+
+
+# ==================== INTERFACE ====================
+
+class StorageBackend(ABC):
+    """
+    Storage interface; methods return (success, error) or None on missing keys
+
+    Backends must implement every abstract method (an incomplete backend
+    fails when it is instantiated, not mid-request).
+    """
+
+    name = "base"
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path on this node's disk (FileResponse, X-Accel-Redirect, Pillow), None if remote"""
+        return None
+
+    @abstractmethod
+    async def put(self, key: str, content: bytes, content_type: Optional[str] = None,
+                  if_absent: bool = False) -> Tuple[bool, Optional[str]]:
+        """
+        Store content under key (readers never see a partial object)
+
+        Args:
+            key: Storage key
+            content: Bytes to store
+            content_type: MIME type recorded with the object (remote backends)
+            if_absent: Keep an existing object (content-addressed keys)
+
+        Returns:
+            Tuple[success, error_message]
+        """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Object content, or None if it does not exist"""
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Content of several objects by key (missing keys are left out)"""
+        keys = list(dict.fromkeys(keys))
+        contents = await asyncio.gather(*(self.get(key) for key in keys))
+        return {key: content for key, content in zip(keys, contents) if content is not None}
+
+    @abstractmethod
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Yield object content in chunks (async generator; raises FileNotFoundError if missing)"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> Tuple[bool, Optional[str]]:
+        """Delete an object (missing objects count as deleted)"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Whether an object exists under key"""
+
+    def presign(self, key: str, expires_seconds: int = STORAGE_PRESIGN_SECONDS,
+                content_type: Optional[str] = None) -> Optional[str]:
+        """
+        Time-limited download URL (signing only, no I/O)
+
+        Returns:
+            URL, or None when the app serves the file itself (local backend)
+        """
+        return None
+
+
+# ==================== LOCAL DISK ====================
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Files under a root directory, written with aiofiles
+
+    put writes a temp file in the target directory, fsyncs it and renames
+    (or hardlinks, for if_absent) it into place.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path = UPLOAD_ROOT):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> str:
+        return str(self.root / key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+    async def put(self, key: str, content: bytes, content_type: Optional[str] = None,
+                  if_absent: bool = False) -> Tuple[bool, Optional[str]]:
+        path = self._path(key)
+        if if_absent and await aiofiles.os.path.exists(path):
+            return True, None
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(content)
+                await f.flush()
+                await asyncio.to_thread(os.fsync, f.fileno())
+            if if_absent:
+                try:
+                    await aiofiles.os.link(tmp_path, path)
+                except FileExistsError:
+                    # Identical content stored concurrently by another worker
+                    pass
+            else:
+                await aiofiles.os.replace(tmp_path, path)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+        finally:
+            try:
+                await aiofiles.os.remove(tmp_path)
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            async with aiofiles.open(self._path(key), "rb") as f:
+                return await f.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        # One worker thread reads all files instead of a thread hop per file
+        return await asyncio.to_thread(self._read_many, list(dict.fromkeys(keys)))
+
+    def _read_many(self, keys: list) -> Dict[str, bytes]:
+        contents = {}
+        for key in keys:
+            try:
+                with open(self._path(key), "rb") as f:
+                    contents[key] = f.read()
+            except OSError:
+                continue
+        return contents
+
+    async def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self._path(key), "rb") as f:
+            while True:
+                chunk = await f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def delete(self, key: str) -> Tuple[bool, Optional[str]]:
+        try:
+            await aiofiles.os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            return False, str(e)
+        return True, None
+
+    async def exists(self, key: str) -> bool:
+        return await aiofiles.os.path.isfile(self._path(key))
+
+
+# ==================== S3-COMPATIBLE ====================
+
+class S3StorageBackend(StorageBackend):
+    """
+    Objects in an S3-compatible bucket (AWS S3, MinIO)
+
+    boto3 is synchronous; calls run in worker threads. Objects are only
+    visible once the PUT completes, so readers never see partial uploads.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: str = S3_REGION,
+        access_key_id: Optional[str] = S3_ACCESS_KEY_ID,
+        secret_access_key: Optional[str] = S3_SECRET_ACCESS_KEY
+    ):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            # Path-style addressing works with MinIO and custom endpoints
+            config=BotoConfig(s3={"addressing_style": "path"}, retries={"max_attempts": 3})
+        )
+
+    @staticmethod
+    def _is_missing(error: Exception) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    async def put(self, key: str, content: bytes, content_type: Optional[str] = None,
+                  if_absent: bool = False) -> Tuple[bool, Optional[str]]:
+        if if_absent and await self.exists(key):
+            return True, None
+        extra = {"ContentType": content_type} if content_type else {}
+        try:
+            await asyncio.to_thread(self.client.put_object, Bucket=self.bucket, Key=key, Body=content, **extra)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        def _get():
+            try:
+                return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+            except ClientError as e:
+                if self._is_missing(e):
+                    return None
+                raise
+        return await asyncio.to_thread(_get)
+
+    async def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str) -> Tuple[bool, Optional[str]]:
+        try:
+            await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    async def exists(self, key: str) -> bool:
+        def _head():
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=key)
+                return True
+            except ClientError as e:
+                if self._is_missing(e):
+                    return False
+                raise
+        return await asyncio.to_thread(_head)
+
+    def presign(self, key: str, expires_seconds: int = STORAGE_PRESIGN_SECONDS,
+                content_type: Optional[str] = None) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_seconds)
+
+
+# ==================== FACTORY ====================
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """Backend selected by STORAGE_BACKEND (created once per process)"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3StorageBackend()
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorageBackend()
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (local or s3)")
+    return _storage
+
+
+def require_local_storage(tool: str) -> None:
+    """
+    Stop a maintenance command that works on local paths directly
+
+    With STORAGE_BACKEND=s3 every stored path would look missing on this
+    node's disk (and --clean would act on that).
+
+    Args:
+        tool: Command name for the error message
+    """
+    if STORAGE_BACKEND != "local":
+        raise SystemExit(
+            f"{tool} works on local disk only (STORAGE_BACKEND=local); "
+            f"STORAGE_BACKEND is '{STORAGE_BACKEND}'"
+        )
+
+
+def run_sync(coroutine):
+    """Run a storage call from synchronous code (CLI tools, to_thread workers)"""
+    return asyncio.run(coroutine)
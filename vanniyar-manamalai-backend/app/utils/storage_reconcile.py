@@ -0,0 +1,305 @@
+# app/utils/storage_reconcile.py
+"""
+Storage reconciliation between /srv/uploads and the files / content_blobs tables
+- Files without rows: photos, thumbnails, community, horoscope, store and
+  leftover quarantine uploads/manifests that nothing references
+- Rows without files: files rows whose storage or thumbnail file is gone,
+  content_blobs rows whose stored copy is gone
+- Constant memory: directories are walked with os.scandir and looked up in
+  batches; rows are streamed with yield_per; stat calls for each batch run
+  on a thread pool
+- Entries younger than the grace period are skipped (uploads in flight
+  write the file before the row, or the row before the file)
+- cache/ is not checked (app/utils/derivative_cache.py manages it)
+
+Run:
+    python -m app.utils.storage_reconcile              # report only
+    python -m app.utils.storage_reconcile --clean      # delete orphans, fix rows
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+from app.database import SessionLocal
+from app.models.file import File, ContentBlob, ProcessingStatusEnum
+from app.utils.storage import UPLOAD_ROOT, require_local_storage
+
+
+# ==================== CONFIGURATION ====================
+
+# Local disk only: reconcile_storage exits unless STORAGE_BACKEND=local
+BASE_UPLOAD_DIR = str(UPLOAD_ROOT)
+
+# Directories whose files are referenced by files.storage_path / thumbnail_path
+PATH_DIRS = ("photos", "thumbnails", "community", "horoscope")
+STORE_SUBDIR = "store"
+QUARANTINE_SUBDIR = "quarantine"
+
+RECONCILE_GRACE_MINUTES = int(os.getenv("RECONCILE_GRACE_MINUTES", "60"))
+RECONCILE_BATCH_SIZE = 500
+RECONCILE_STAT_WORKERS = 8
+# Orphans printed per category (all are counted)
+MAX_REPORTED_PATHS = 50
+
+
+# ==================== HELPERS ====================
+
+def _iter_files(root: str) -> Iterator[str]:
+    """Yield file paths under root (scandir, no stat unless d_type is unknown)"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except FileNotFoundError:
+            continue
+
+
+def _batched(iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _store_key(name: str) -> Optional[tuple]:
+    """
+    Parse a store filename into (sha256, width)
+
+    <sha>.webp -> (sha, None); <sha>_thumb.webp -> (sha, None);
+    <sha>_w640.webp -> (sha, 640); anything else (e.g. .tmp) -> None
+    """
+    sha256, rest = name[:64], name[64:]
+    if len(sha256) != 64 or rest not in (".webp", "_thumb.webp") and not (
+        rest.startswith("_w") and rest.endswith(".webp") and rest[2:-5].isdigit()
+    ):
+        return None
+    return sha256, int(rest[2:-5]) if rest.startswith("_w") else None
+
+
+class ReconcileReport:
+    """Counters and (truncated) path lists per category"""
+
+    def __init__(self):
+        self.counts = {}
+        self.bytes = {}
+        self.samples = {}
+
+    def add(self, category: str, path: str, size_bytes: int = 0) -> None:
+        self.counts[category] = self.counts.get(category, 0) + 1
+        self.bytes[category] = self.bytes.get(category, 0) + size_bytes
+        samples = self.samples.setdefault(category, [])
+        if len(samples) < MAX_REPORTED_PATHS:
+            samples.append(path)
+
+    def as_dict(self) -> dict:
+        return {
+            category: {"count": count, "bytes": self.bytes[category], "paths": self.samples[category]}
+            for category, count in self.counts.items()
+        }
+
+
+# ==================== FILES WITHOUT ROWS ====================
+
+def _orphans_in_batch(db, kind: str, paths: List[str]) -> List[str]:
+    """Return the paths of a batch that no row references"""
+    if kind == "paths":
+        referenced = set()
+        for column in (File.storage_path, File.thumbnail_path):
+            referenced.update(value for (value,) in db.query(column).filter(column.in_(paths)))
+        return [path for path in paths if path not in referenced]
+
+    if kind == "store":
+        keys = {path: _store_key(os.path.basename(path)) for path in paths}
+        shas = {key[0] for key in keys.values() if key}
+        widths = {
+            sha256: {int(width) for width in (derivative_widths or "").split(",") if width}
+            for sha256, derivative_widths in db.query(ContentBlob.sha256, ContentBlob.derivative_widths)
+            .filter(ContentBlob.sha256.in_(shas))
+        } if shas else {}
+        return [
+            path for path, key in keys.items()
+            if key is None or key[0] not in widths or (key[1] is not None and key[1] not in widths[key[0]])
+        ]
+
+    # quarantine: <file_id>.bin / <file_id>.json belong to pending/scanning rows
+    file_ids = {path: os.path.splitext(os.path.basename(path))[0] for path in paths}
+    active = {
+        file_id for (file_id,) in db.query(File.id).filter(
+            File.id.in_(set(file_ids.values())),
+            File.processing_status.in_([ProcessingStatusEnum.pending, ProcessingStatusEnum.scanning])
+        )
+    }
+    return [path for path, file_id in file_ids.items() if file_id not in active]
+
+
+def _reconcile_directory(db, pool, root: str, kind: str, category: str, report: ReconcileReport,
+                         clean: bool, cutoff: float, batch_size: int) -> None:
+    for batch in _batched(_iter_files(root), batch_size):
+        orphans = _orphans_in_batch(db, kind, batch)
+        db.rollback()  # end the read transaction; nothing is held between batches
+        if not orphans:
+            continue
+        for path, stat in zip(orphans, pool.map(_stat, orphans)):
+            if stat is None or stat.st_mtime > cutoff:
+                continue
+            report.add(category, path, stat.st_size)
+            if clean:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+# ==================== ROWS WITHOUT FILES ====================
+
+def _reconcile_file_rows(db, writer, pool, report: ReconcileReport, clean: bool,
+                         cutoff: datetime, batch_size: int) -> None:
+    rows = (
+        db.query(File.id, File.storage_path, File.thumbnail_path, File.processing_status, File.updated_at)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+    for batch in _batched(rows, batch_size):
+        batch = [row for row in batch if row.updated_at is None or row.updated_at < cutoff]
+        storage_stats = pool.map(_stat, [row.storage_path for row in batch])
+        thumbnail_stats = pool.map(_stat, [row.thumbnail_path or "" for row in batch])
+
+        for row, storage_stat, thumbnail_stat in zip(batch, storage_stats, thumbnail_stats):
+            status = row.processing_status
+            if storage_stat is None:
+                if status in (ProcessingStatusEnum.pending, ProcessingStatusEnum.scanning):
+                    # Quarantine copy is gone: the upload can never finish
+                    report.add("stale_pending_rows", row.id)
+                    if clean:
+                        # ORM update so file_stats follows the status change
+                        stale_file = writer.get(File, row.id)
+                        if stale_file:
+                            stale_file.processing_status = ProcessingStatusEnum.rejected
+                elif status == ProcessingStatusEnum.ready:
+                    # Needs a decision (re-upload / delete); never changed automatically
+                    report.add("ready_rows_missing_file", f"{row.id} {row.storage_path}")
+            if row.thumbnail_path and thumbnail_stat is None:
+                report.add("rows_missing_thumbnail", f"{row.id} {row.thumbnail_path}")
+                if clean:
+                    writer.query(File).filter(File.id == row.id).update(
+                        {File.thumbnail_path: None}, synchronize_session=False
+                    )
+        if clean:
+            writer.commit()
+            # Cached serving metadata must not point at the removed paths
+            from app.crud.file import invalidate_file_meta
+            for row in batch:
+                invalidate_file_meta(row.id)
+
+
+def _reconcile_blob_rows(db, pool, report: ReconcileReport, batch_size: int) -> None:
+    rows = (
+        db.query(ContentBlob.sha256, ContentBlob.storage_path, ContentBlob.ref_count)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+    for batch in _batched(rows, batch_size):
+        for row, stat in zip(batch, pool.map(_stat, [row.storage_path for row in batch])):
+            if stat is None:
+                report.add("blob_rows_missing_file", f"{row.sha256} refs={row.ref_count}")
+
+
+# ==================== ENTRY POINT ====================
+
+def reconcile_storage(
+    clean: bool = False,
+    grace_minutes: int = RECONCILE_GRACE_MINUTES,
+    base_dir: str = BASE_UPLOAD_DIR,
+    batch_size: int = RECONCILE_BATCH_SIZE,
+    workers: int = RECONCILE_STAT_WORKERS
+) -> dict:
+    """
+    Compare the upload volume with the database in both directions
+
+    Args:
+        clean: Delete orphaned files, clear dangling thumbnail_path and reject
+            pending rows whose quarantine file is gone (report only when False)
+        grace_minutes: Skip files and rows changed more recently than this
+        base_dir: Upload root (/srv/uploads)
+        batch_size: Paths / rows per lookup and stat batch
+        workers: Threads used for stat calls
+
+    Returns:
+        Dict {category: {count, bytes, paths (first MAX_REPORTED_PATHS)}}
+        plus elapsed seconds
+    """
+    require_local_storage("storage_reconcile")
+    started = time.monotonic()
+    report = ReconcileReport()
+    file_cutoff = time.time() - grace_minutes * 60
+    row_cutoff = datetime.utcnow() - timedelta(minutes=grace_minutes)
+
+    db = SessionLocal()
+    stream_db = SessionLocal()  # server-side cursor for streamed rows
+    writer = SessionLocal()     # updates while a stream is open
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for subdir in PATH_DIRS:
+                _reconcile_directory(db, pool, os.path.join(base_dir, subdir), "paths",
+                                     f"orphan_{subdir}", report, clean, file_cutoff, batch_size)
+            _reconcile_directory(db, pool, os.path.join(base_dir, STORE_SUBDIR), "store",
+                                 "orphan_store", report, clean, file_cutoff, batch_size)
+            _reconcile_directory(db, pool, os.path.join(base_dir, QUARANTINE_SUBDIR), "quarantine",
+                                 "orphan_quarantine", report, clean, file_cutoff, batch_size)
+
+            _reconcile_file_rows(stream_db, writer, pool, report, clean, row_cutoff, batch_size)
+            _reconcile_blob_rows(stream_db, pool, report, batch_size)
+    finally:
+        writer.close()
+        stream_db.close()
+        db.close()
+
+    result = report.as_dict()
+    result["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile /srv/uploads with the files table")
+    parser.add_argument("--clean", action="store_true", help="Delete orphans and fix dangling rows")
+    parser.add_argument("--grace-minutes", type=int, default=RECONCILE_GRACE_MINUTES)
+    parser.add_argument("--base-dir", default=BASE_UPLOAD_DIR)
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=RECONCILE_STAT_WORKERS)
+    args = parser.parse_args()
+
+    result = reconcile_storage(
+        clean=args.clean,
+        grace_minutes=args.grace_minutes,
+        base_dir=args.base_dir,
+        batch_size=args.batch_size,
+        workers=args.workers
+    )
+    elapsed = result.pop("elapsed_seconds")
+    for category, details in sorted(result.items()):
+        print(f"[RECONCILE] {category}: {details['count']} ({details['bytes']} bytes)")
+        for path in details["paths"]:
+            print(f"    {path}")
+    action = "cleaned" if args.clean else "report only"
+    print(f"[RECONCILE] Done in {elapsed}s ({action})")
@@ -0,0 +1,600 @@
+# app/utils/upload_processor.py
+"""
+Background processing for accepted uploads
+- Upload routes write raw bytes to quarantine, create a 'pending' files row
+  and return 202 immediately
+- Worker tasks then drive virus scan, conversion, thumbnailing, storage and
+  slot assignment, moving the row pending -> scanning -> ready (or rejected)
+- Uploads are normally kept in memory between the route and the worker
+  (scan and conversion read the bytes directly), so the disk only sees the
+  files that are kept; past UPLOAD_MEMORY_BUDGET_MB of queued bytes they
+  are spooled to quarantine instead
+- Each quarantined upload has a JSON manifest next to it so pending jobs
+  survive a restart (in-memory jobs lost to a restart or a crashed sibling
+  process are marked rejected by a periodic sweep and have to be uploaded
+  again)
+- Every job's stages (queue wait, scan, convert, store, ...) are timed into
+  app/utils/stage_timing.py histograms (pipeline worker.<upload_kind>)
+- Quarantine files and manifests stay on local disk; processed files are
+  written through app/utils/storage.py (local disk or S3)
+- Database calls use AsyncSession (app/crud/file_async.py), so they never
+  block the event loop
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Optional, Tuple
+
+from app.database import AsyncSessionLocal
+from app.models.file import ProcessingStatusEnum
+from app.crud.file_async import (
+    claim_file_for_processing, get_unfinished_uploads, update_file_record,
+    get_profile_with_family, find_available_photo_slot, assign_photo_to_slot,
+    assign_community_cert_to_family, assign_horoscope_to_astrology,
+    get_astrology_file_id, get_file_by_id, find_blob_by_source_checksum,
+    acquire_content_blob, release_content_blob, get_profile_file_ids,
+    get_perceptual_hash_for_content
+)
+from app.utils.file_handler import (
+    scan_file_with_clamav, convert_photo_with_derivatives, image_to_pdf,
+    validate_pdf_file, linearize_pdf, generate_document_preview, save_file_to_disk, delete_file_from_disk, image_processor,
+    compute_perceptual_hash, scan_bytes_with_clamav
+)
+from app.utils.content_store import content_path_for
+from app.utils.storage import get_storage, key_for_path
+from app.utils.near_duplicates import near_duplicate_index, find_near_duplicates
+from app.utils.stage_timing import StageTimer, upload_timings
+
+
+# ==================== CONFIGURATION ====================
+
+# Number of uploads processed concurrently per application process
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+# Accepted uploads held in memory awaiting processing (per process); beyond
+# this, uploads are spooled to quarantine
+UPLOAD_MEMORY_BUDGET_MB = int(os.getenv("UPLOAD_MEMORY_BUDGET_MB", "256"))
+# Pending uploads without quarantine bytes younger than this may still be
+# queued in another worker process's memory, so recovery leaves them
+IN_MEMORY_RECOVERY_GRACE_MINUTES = 15
+# Interval of the recovery sweep that rejects in-memory uploads lost with a
+# crashed sibling process once they are past the grace period
+UPLOAD_RECOVERY_SWEEP_SECONDS = int(os.getenv("UPLOAD_RECOVERY_SWEEP_SECONDS", "300"))
+
+
+class UploadKindEnum(str, Enum):
+    """What an accepted upload will become once processed"""
+    photo = "photo"
+    community_certificate = "community_certificate"
+    horoscope = "horoscope"
+
+
+# ==================== JOB MANIFEST ====================
+
+def manifest_path_for(quarantine_path: str) -> str:
+    """Path of the JSON manifest stored next to a quarantined upload"""
+    return str(Path(quarantine_path).with_suffix(".json"))
+
+
+def write_job_manifest(job: dict) -> Tuple[bool, Optional[str]]:
+    """
+    Persist job details next to the quarantined bytes
+
+    Args:
+        job: Job dict (file_id, upload_kind, profile_id, quarantine_path, ...)
+
+    Returns:
+        Tuple[success, error_message]
+    """
+    # Keys starting with "_" are in-memory only (bytes, timing marks)
+    content = json.dumps({key: value for key, value in job.items() if not key.startswith("_")}).encode("utf-8")
+    return save_file_to_disk(content, manifest_path_for(job["quarantine_path"]))
+
+
+def job_source(job: dict):
+    """Upload bytes of an in-memory job, else its quarantine path"""
+    content = job.get("_content")
+    return content if content is not None else job["quarantine_path"]
+
+
+def read_job_manifest(quarantine_path: str) -> Optional[dict]:
+    """
+    Load job details for a quarantined upload
+
+    Returns:
+        Job dict or None if the manifest is missing or unreadable
+    """
+    try:
+        with open(manifest_path_for(quarantine_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class UploadRejected(Exception):
+    """Raised by a pipeline step to reject an upload with an error code"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+# ==================== PROCESSING QUEUE ====================
+
+class UploadProcessingQueue:
+    """
+    In-process queue of accepted uploads with a pool of worker tasks
+
+    Usage:
+        upload_queue = UploadProcessingQueue(QUARANTINE_DIR)
+        await upload_queue.start()            # on application startup
+        await upload_queue.enqueue(job)       # from an upload route
+        await upload_queue.stop()             # on application shutdown
+
+    In-memory jobs carry their bytes in job["_content"]; the route reserves
+    them against the memory budget with reserve_memory() first.
+    """
+
+    def __init__(self, quarantine_dir: Path, workers: int = UPLOAD_WORKERS,
+                 memory_budget_bytes: int = UPLOAD_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.quarantine_dir = Path(quarantine_dir)
+        self.workers = workers
+        self.memory_budget_bytes = memory_budget_bytes
+        self._memory_bytes = 0
+        self._spooled = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        # Jobs queued or running in this process (left alone by the recovery sweep)
+        self._active_ids = set()
+        self._profile_locks = {}
+        self._processed = 0
+        self._rejected = 0
+
+    async def start(self) -> None:
+        """Start worker tasks and re-enqueue uploads left pending by a restart"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._recover_pending()
+        self._tasks.append(asyncio.create_task(self._recovery_sweep()))
+
+    async def stop(self) -> None:
+        """Cancel worker tasks (unfinished jobs are recovered on next start)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def reserve_memory(self, size_bytes: int) -> bool:
+        """
+        Reserve room for an upload kept in memory until it is processed
+
+        Returns:
+            False if the budget is used up (spool the upload to quarantine)
+        """
+        if self._memory_bytes + size_bytes > self.memory_budget_bytes:
+            self._spooled += 1
+            return False
+        self._memory_bytes += size_bytes
+        return True
+
+    def release_memory(self, size_bytes: int) -> None:
+        """Return a reservation (job processed, or never queued)"""
+        self._memory_bytes = max(self._memory_bytes - size_bytes, 0)
+
+    async def enqueue(self, job: dict) -> None:
+        """
+        Queue an accepted upload for processing
+
+        Args:
+            job: Job dict as written by write_job_manifest, plus "_content"
+                for in-memory uploads
+        """
+        if self._queue is None:
+            await self.start()
+        # In memory only (the manifest is already written); used for queue wait timing
+        job["_enqueued_at"] = time.perf_counter()
+        self._active_ids.add(job["file_id"])
+        await self._queue.put(job)
+
+    def metrics(self) -> dict:
+        """Snapshot of queue metrics"""
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "processed": self._processed,
+            "rejected": self._rejected,
+            "memory_bytes": self._memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "spooled_to_quarantine": self._spooled,
+        }
+
+    @contextlib.asynccontextmanager
+    async def _locked_profile(self, profile_id: int):
+        # Serialize slot lookup + store + assign for one profile so two
+        # concurrent uploads cannot pick the same slot or filename
+        entry = self._profile_locks.setdefault(profile_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._profile_locks.pop(profile_id, None)
+
+    async def _recover_pending(self, requeue: bool = True) -> None:
+        """
+        Re-enqueue quarantined uploads and reject in-memory ones that were lost
+
+        Args:
+            requeue: Re-enqueue uploads whose quarantine bytes still exist
+                (startup only; afterwards they belong to the process that
+                queued them, and a crashed one recovers them on restart)
+        """
+        db = AsyncSessionLocal()
+        try:
+            in_memory_cutoff = datetime.utcnow() - timedelta(minutes=IN_MEMORY_RECOVERY_GRACE_MINUTES)
+            for db_file in await get_unfinished_uploads(db):
+                if db_file.id in self._active_ids:
+                    continue
+                quarantine_path = str(self.quarantine_dir / f"{db_file.id}.bin")
+                job = read_job_manifest(quarantine_path)
+                if job and os.path.exists(quarantine_path):
+                    if requeue:
+                        self._active_ids.add(db_file.id)
+                        await self._queue.put(job)
+                elif db_file.created_at and db_file.created_at > in_memory_cutoff:
+                    # Possibly an in-memory upload of a running sibling process
+                    # (rejected by a later sweep if it is still pending then)
+                    continue
+                else:
+                    # Raw bytes are gone; nothing left to process
+                    await update_file_record(
+                        db, db_file.id,
+                        processing_status=ProcessingStatusEnum.rejected,
+                        rejection_code="PROCESSING_ERROR",
+                        rejection_message="Upload was interrupted before processing; please upload again"
+                    )
+        except Exception as e:
+            print(f"[UPLOAD QUEUE] Failed to recover pending uploads: {e}")
+        finally:
+            await db.close()
+
+    async def _recovery_sweep(self, interval_seconds: int = UPLOAD_RECOVERY_SWEEP_SECONDS) -> None:
+        """Periodically reject lost in-memory uploads once past the grace period"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self._recover_pending(requeue=False)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process_job(job)
+            except Exception as e:
+                print(f"[UPLOAD QUEUE] Unexpected error processing {job.get('file_id')}: {e}")
+            finally:
+                self._active_ids.discard(job.get("file_id"))
+                self._queue.task_done()
+
+    async def _reject(self, db, file_id: str, code: str, message: str) -> None:
+        # Stored on the files row so GET /files/{id}/status can show it from any process
+        await update_file_record(
+            db, file_id,
+            processing_status=ProcessingStatusEnum.rejected,
+            rejection_code=code,
+            rejection_message=message[:512]
+        )
+        self._rejected += 1
+
+    async def _process_job(self, job: dict) -> None:
+        file_id = job["file_id"]
+        quarantine_path = job["quarantine_path"]
+        in_memory = job.get("_content") is not None
+        timer = StageTimer()
+        if job.get("_enqueued_at"):
+            timer.record("queue_wait", timer.started - job["_enqueued_at"])
+        db = AsyncSessionLocal()
+        # pending -> scanning (skip if another worker already claimed it)
+        with timer.stage("claim"):
+            claimed = await claim_file_for_processing(db, file_id)
+        if not claimed:
+            await db.close()
+            if in_memory:
+                self.release_memory(len(job.pop("_content")))
+            return
+
+        try:
+            try:
+                # Scan for viruses (blocking clamd socket I/O; keep it off the event loop)
+                with timer.stage("scan"):
+                    if in_memory:
+                        clean, virus_error = await asyncio.to_thread(scan_bytes_with_clamav, job["_content"])
+                    else:
+                        clean, virus_error = await asyncio.to_thread(scan_file_with_clamav, quarantine_path)
+                if not clean:
+                    # VIRUS_FOUND only for detections; a failed scan keeps its own code
+                    if virus_error == "VIRUS_FOUND":
+                        raise UploadRejected("VIRUS_FOUND", "Virus detected")
+                    raise UploadRejected(
+                        virus_error or "SCANNING_ERROR",
+                        "Virus scan could not be completed; please try again"
+                    )
+
+                if job["upload_kind"] == UploadKindEnum.photo:
+                    await self._process_photo(db, job, timer)
+                else:
+                    await self._process_document(db, job, timer)
+
+                self._processed += 1
+                print(f"[UPLOAD QUEUE] {job['upload_kind']} {file_id} ready")
+
+            except UploadRejected as e:
+                await db.rollback()
+                await self._reject(db, file_id, e.code, e.message)
+                print(f"[UPLOAD QUEUE] {job['upload_kind']} {file_id} rejected: {e.code} {e.message}")
+            except Exception as e:
+                await db.rollback()
+                await self._reject(db, file_id, "PROCESSING_ERROR", str(e))
+                print(f"[UPLOAD QUEUE] {job['upload_kind']} {file_id} failed: {e}")
+        finally:
+            # Upload bytes (memory, or quarantine copy and manifest) are no longer needed
+            with timer.stage("cleanup"):
+                if in_memory:
+                    self.release_memory(len(job.pop("_content")))
+                else:
+                    _, _ = delete_file_from_disk(quarantine_path)
+                    _, _ = delete_file_from_disk(manifest_path_for(quarantine_path))
+                await db.close()
+            breakdown = upload_timings.observe(f"worker.{job['upload_kind']}", timer, file_id=file_id)
+            print(f"[UPLOAD TIMING] {job['upload_kind']} {file_id} " + " ".join(
+                f"{stage}={ms}ms" for stage, ms in breakdown.items()
+            ))
+
+    async def _process_photo(self, db, job: dict, timer: StageTimer) -> None:
+        profile_id = job["profile_id"]
+
+        # Identical upload already converted (by any profile): reuse the stored copy
+        with timer.stage("reuse_lookup"):
+            db_file = await get_file_by_id(db, job["file_id"])
+            blob = None
+            if db_file and db_file.checksum:
+                blob = await find_blob_by_source_checksum(db, db_file.checksum)
+            reusable = bool(blob and await get_storage().exists(key_for_path(blob.storage_path)))
+        if reusable:
+            async with self._locked_profile(profile_id):
+                await self._store_photo(db, job, timer, blob.sha256)
+            return
+
+        # Convert to WebP (EXIF preserved, PHOTO_WEBP_QUALITY / PHOTO_WEBP_METHOD)
+        # and 150x150 thumbnail from one decode (from the in-memory bytes, or
+        # the worker process reads the quarantine file itself). Responsive
+        # sizes are generated on first request by app/utils/derivative_cache.py
+        with timer.stage("convert"):
+            converted, convert_error = await image_processor.run(
+                convert_photo_with_derivatives, job_source(job), widths=()
+            )
+        if convert_error or not converted:
+            raise UploadRejected("PROCESSING_ERROR", f"Failed to convert to WebP: {convert_error}")
+        # Measured inside the pool worker; "convert" minus these is pool wait + transfer
+        for stage, seconds in converted.get("timings", {}).items():
+            timer.record(f"convert.{stage}", seconds)
+
+        content_hash = hashlib.sha256(converted["webp"]).hexdigest()
+        lock_requested = time.perf_counter()
+        async with self._locked_profile(profile_id):
+            timer.record("profile_lock", time.perf_counter() - lock_requested)
+            await self._store_photo(db, job, timer, content_hash, converted)
+
+    async def _store_photo(self, db, job: dict, timer: StageTimer, content_hash: str,
+                           converted: Optional[dict] = None) -> None:
+        file_id = job["file_id"]
+        profile_id = job["profile_id"]
+
+        with timer.stage("slot_lookup"):
+            result = await get_profile_with_family(db, profile_id)
+            if not result:
+                raise UploadRejected("NOT_FOUND", f"Profile {profile_id} not found")
+
+            # Find available photo slot (1 or 2)
+            slot_num, slot_error = await find_available_photo_slot(db, profile_id)
+            if slot_error:
+                raise UploadRejected("NO_FREE_SLOT", slot_error)
+
+        # Reference the blob before touching disk so garbage collection keeps it
+        with timer.stage("blob_reference"):
+            blob = await acquire_content_blob(
+                db,
+                content_hash,
+                storage_path=content_path_for(content_hash, ".webp", job["storage_dir"]),
+                thumbnail_path=content_path_for(content_hash, "_thumb.webp", job["storage_dir"]),
+                size_bytes=len(converted["webp"]) if converted else 0
+            )
+        storage_path, thumbnail_path, size_bytes = blob.storage_path, blob.thumbnail_path, blob.size_bytes
+
+        try:
+            # Content store: one copy per distinct WebP, shared by every files row using it
+            with timer.stage("disk_write"):
+                storage = get_storage()
+                if converted:
+                    outputs = [(converted["webp"], storage_path), (converted["thumbnail"], thumbnail_path)]
+                    for content, path in outputs:
+                        # if_absent: identical content stored by another upload is kept as is
+                        saved, save_error = await storage.put(key_for_path(path), content, "image/webp", if_absent=True)
+                        if not saved:
+                            raise UploadRejected("PROCESSING_ERROR", f"Failed to save WebP file: {save_error}")
+                elif not await storage.exists(key_for_path(storage_path)):
+                    raise UploadRejected("PROCESSING_ERROR", "Stored copy of duplicate photo is missing")
+
+            # Assign to family_details photo slot
+            with timer.stage("slot_assign"):
+                assigned = await assign_photo_to_slot(db, profile_id, file_id, slot_num)
+            if not assigned:
+                raise UploadRejected("PROCESSING_ERROR", "Failed to assign photo slot")
+        except Exception:
+            await db.rollback()
+            await release_content_blob(db, content_hash)
+            raise
+
+        with timer.stage("near_duplicates"):
+            perceptual_hash = await self._check_near_duplicates(db, job, content_hash, thumbnail_path, converted)
+
+        with timer.stage("db_update"):
+            await update_file_record(
+                db, file_id,
+                storage_path=storage_path,
+                thumbnail_path=thumbnail_path,
+                content_hash=content_hash,
+                mime_type="image/webp",
+                size_bytes=size_bytes,
+                width=converted["width"] if converted else None,
+                height=converted["height"] if converted else None,
+                perceptual_hash=perceptual_hash,
+                processing_status=ProcessingStatusEnum.ready
+            )
+        near_duplicate_index.add(file_id, perceptual_hash)
+
+    async def _check_near_duplicates(self, db, job: dict, content_hash: str, thumbnail_path: str,
+                                     converted: Optional[dict]) -> Optional[str]:
+        """
+        Get the photo's perceptual hash and log near-duplicates owned by other profiles
+
+        Matches are only logged for moderation (see /files/admin/near-duplicates);
+        the upload is never rejected because of them.
+        """
+        if converted:
+            perceptual_hash = converted.get("perceptual_hash")
+        else:
+            # Reused stored copy: take the hash of a row sharing it, else hash its thumbnail
+            perceptual_hash = await get_perceptual_hash_for_content(db, content_hash)
+            if not perceptual_hash:
+                storage = get_storage()
+                thumbnail_key = key_for_path(thumbnail_path)
+                source = storage.local_path(thumbnail_key) or await storage.get(thumbnail_key)
+                if source:
+                    perceptual_hash, _ = await image_processor.run(compute_perceptual_hash, source)
+        if not perceptual_hash:
+            return None
+
+        try:
+            own_file_ids = (await get_profile_file_ids(db, job["profile_id"])) + [job["file_id"]]
+            matches = await asyncio.to_thread(find_near_duplicates, perceptual_hash, own_file_ids)
+        except Exception as e:
+            print(f"[UPLOAD QUEUE] Near-duplicate lookup failed for {job['file_id']}: {str(e)}")
+            return perceptual_hash
+
+        if matches:
+            print(
+                f"[UPLOAD QUEUE] Photo {job['file_id']} (profile {job['profile_id']}) resembles "
+                + ", ".join(f"{match['file_id']} (distance {match['distance']})" for match in matches[:5])
+            )
+        return perceptual_hash
+
+    async def _process_document(self, db, job: dict, timer: StageTimer) -> None:
+        profile_id = job["profile_id"]
+        content_type = job.get("content_type") or ""
+
+        # Convert to PDF if image (from memory, or the worker process reads the quarantine file)
+        if content_type.startswith("image/"):
+            with timer.stage("convert"):
+                pdf_bytes, convert_error = await image_processor.run(image_to_pdf, job_source(job), content_type)
+            if convert_error or not pdf_bytes:
+                raise UploadRejected("PROCESSING_ERROR", f"Failed to convert image to PDF: {convert_error}")
+        elif job.get("_content") is not None:
+            pdf_bytes = job["_content"]
+        else:
+            with timer.stage("read"):
+                pdf_bytes = await asyncio.to_thread(Path(job["quarantine_path"]).read_bytes)
+
+        # Validate PDF format
+        with timer.stage("validate_pdf"):
+            pdf_valid, pdf_error = validate_pdf_file(pdf_bytes)
+        if not pdf_valid:
+            raise UploadRejected("PROCESSING_ERROR", f"PDF validation failed: {pdf_error}")
+
+        # Linearize so viewers can show page one before the download completes
+        # (non-fatal: the original bytes are stored if rewriting fails)
+        with timer.stage("linearize"):
+            pdf_bytes, _ = await image_processor.run(linearize_pdf, pdf_bytes)
+
+        # First-page preview for the moderation grid (non-fatal). Images
+        # converted with image_to_pdf are previewed from the source image.
+        with timer.stage("preview"):
+            preview, preview_error = await image_processor.run(
+                generate_document_preview, job_source(job), is_image=content_type.startswith("image/")
+            )
+        if preview_error:
+            print(f"[UPLOAD QUEUE] No preview for {job['file_id']}: {preview_error}")
+
+        lock_requested = time.perf_counter()
+        async with self._locked_profile(profile_id):
+            timer.record("profile_lock", time.perf_counter() - lock_requested)
+            await self._store_document(db, job, timer, pdf_bytes, preview)
+
+    async def _store_document(self, db, job: dict, timer: StageTimer, pdf_bytes: bytes,
+                              preview: Optional[bytes] = None) -> None:
+        file_id = job["file_id"]
+        profile_id = job["profile_id"]
+
+        result = await get_profile_with_family(db, profile_id)
+        if not result:
+            raise UploadRejected("NOT_FOUND", f"Profile {profile_id} not found")
+        profile, family = result
+
+        # Check before writing so an existing file is never overwritten
+        if job["upload_kind"] == UploadKindEnum.community_certificate:
+            if family and family.community_file_id:
+                raise UploadRejected("PROCESSING_ERROR", "Community certificate already uploaded for this profile")
+            # Filename: {profile_id}_community_certificate.pdf
+            storage_path = str(Path(job["storage_dir"]) / f"{profile_id}_community_certificate.pdf")
+        else:
+            if await get_astrology_file_id(db, profile_id):
+                raise UploadRejected("PROCESSING_ERROR", "Horoscope file already uploaded for this profile")
+            # Filename: {serial_number}_horoscope.pdf
+            serial_number = profile.serial_number or str(profile.id)
+            storage_path = str(Path(job["storage_dir"]) / f"{serial_number}_horoscope.pdf")
+
+        storage = get_storage()
+        with timer.stage("disk_write"):
+            saved, save_error = await storage.put(key_for_path(storage_path), pdf_bytes, "application/pdf")
+            if not saved:
+                raise UploadRejected("PROCESSING_ERROR", f"Failed to save PDF file: {save_error}")
+
+            thumbnail_path = None
+            if preview:
+                thumbnail_dir = job.get("thumbnail_dir") or job["storage_dir"]
+                thumbnail_path = str(Path(thumbnail_dir) / f"{file_id}_preview.webp")
+                saved, save_error = await storage.put(key_for_path(thumbnail_path), preview, "image/webp")
+                if not saved:
+                    print(f"[UPLOAD QUEUE] Failed to save preview for {file_id}: {save_error}")
+                    thumbnail_path = None
+
+        with timer.stage("slot_assign"):
+            if job["upload_kind"] == UploadKindEnum.community_certificate:
+                assigned, error_msg = await assign_community_cert_to_family(db, profile_id, file_id)
+            else:
+                assigned, error_msg = await assign_horoscope_to_astrology(db, profile_id, file_id)
+        if not assigned:
+            _, _ = await storage.delete(key_for_path(storage_path))
+            if thumbnail_path:
+                _, _ = await storage.delete(key_for_path(thumbnail_path))
+            raise UploadRejected("PROCESSING_ERROR", error_msg or "Failed to assign file")
+
+        with timer.stage("db_update"):
+            await update_file_record(
+                db, file_id,
+                storage_path=storage_path,
+                thumbnail_path=thumbnail_path,
+                size_bytes=len(pdf_bytes),
+                processing_status=ProcessingStatusEnum.ready
+            )